@@ -0,0 +1,133 @@
+import os
+import io
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+
+from pyebas import *
+from pyebas.version import __version__
+from .synthetic import make_archive, archive_range, COMPONENTS
+
+
+@contextlib.contextmanager
+def quiet():
+   """hide progress output of the timed calls"""
+   with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+      yield
+
+def timeit(func, repeat=1):
+   """wall time of each run
+
+   Returns:
+       tuple: (result of the last run, list of seconds)
+   """
+   runs = []
+   for _ in range(repeat):
+      with quiet():
+         t = time.perf_counter()
+         res = func()
+         runs.append(time.perf_counter()-t)
+   return res, runs
+
+def summary(runs, **extra):
+   res = {"runs": runs, "min": min(runs), "median": statistics.median(runs)}
+   res.update(extra)
+   return res
+
+def run_benchmarks(work_dir, args):
+   db_dir = os.path.join(work_dir, "ebas")
+   raw_dir = os.path.join(db_dir, "raw_data")
+   print("Generating synthetic archive...")
+   files = make_archive(raw_dir, args.sites, args.files, args.vars, args.length, seed=args.seed)
+   size = sum(os.path.getsize(os.path.join(raw_dir, f)) for f in files)
+
+   results = {}
+   # middle third of the archive, so the query selects rows whatever the archive size
+   st, ed = archive_range(args.files, args.length)
+   third = (ed-st)//3
+   condition = {"component": COMPONENTS[:2],
+                "st": st+third,
+                "ed": ed-third}
+
+   print("create_site_index...")
+   db = EbasDB(db_dir, dump=args.dump)
+   _, runs = timeit(db.create_site_index, args.repeat)
+   results["create_site_index"] = summary(runs)
+
+   print("update_db...")
+   _, runs = timeit(lambda: EbasDB(db_dir, dump=args.dump).update_db(full=True), args.repeat)
+   results["update_db"] = summary(runs)
+   _, runs = timeit(lambda: EbasDB(db_dir, dump=args.dump).update_db(), args.repeat)
+   results["update_db_unchanged"] = summary(runs)
+
+   for lazy in [False, True]:
+      name = "init_db_lazy" if lazy else "init_db"
+      print(f"{name}...")
+      db = EbasDB(db_dir, dump=args.dump, lazy=lazy)
+      _, runs = timeit(db.init_db, args.repeat)
+      results[name] = summary(runs)
+
+   print("query...")
+   db = EbasDB(db_dir, dump=args.dump)
+   with quiet():
+      db.init_db()
+   query_res, runs = timeit(lambda: Query.query(db.site_index, db.db_index, condition, db.value_index, db.inverted_index), args.repeat)
+   results["Query.query"] = summary(runs, series=sum(len(v) for v in query_res[0].values()))
+   df, runs = timeit(lambda: Query.get_df(db.db, db.db_index, query_res, False, db.value_index), args.repeat)
+   results["Query.get_df"] = summary(runs, rows=0 if df is None else len(df))
+   df, runs = timeit(lambda: db.query(dict(condition), use_number_indexing=False), args.repeat)
+   results["EbasDB.query"] = summary(runs, rows=0 if df is None else len(df))
+   if results["Query.get_df"]["rows"]==0 or results["EbasDB.query"]["rows"]==0:
+      raise ValueError(f"The benchmark query selects no rows: {condition}")
+   _, runs = timeit(db.list_sites, args.repeat)
+   results["list_sites"] = summary(runs)
+
+   print("export_csv...")
+   exporter = csvExporter(db_dir)
+   _, runs = timeit(lambda: exporter.export_csv("benchmark.csv"), args.repeat)
+   results["csvExporter.export_csv"] = summary(runs, bytes=os.path.getsize(os.path.join(db_dir, "benchmark.csv")))
+
+   return {"pyebas_version": __version__,
+           "python": platform.python_version(),
+           "platform": platform.platform(),
+           "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+           "params": vars(args),
+           "archive": {"files": len(files), "bytes": size},
+           "results": results}
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(prog="python -m benchmarks.run",
+                                    description="Benchmark pyebas with a synthetic EBAS archive.")
+   parser.add_argument('--sites', type=int, default=10, help='number of sites')
+   parser.add_argument('--files', type=int, default=2, help='number of files per site')
+   parser.add_argument('--vars', type=int, default=3, help='number of variables per file')
+   parser.add_argument('--length', type=int, default=8760, help='number of samples per file')
+   parser.add_argument('--dump', choices=['xz', 'zst', 'lz4', 'p', 'npy'], default='xz', help='dump file type')
+   parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark')
+   parser.add_argument('--seed', type=int, default=0, help='random seed')
+   parser.add_argument('--work-dir', type=str, default=None, help='folder for the archive, a temporary folder by default')
+   parser.add_argument('--output', type=str, default=None, help='json output file, printed if not given')
+   args = parser.parse_args(argv)
+
+   work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix="pyebas_bench_")
+   try:
+      res = run_benchmarks(work_dir, args)
+   finally:
+      if args.work_dir is None:
+         shutil.rmtree(work_dir, ignore_errors=True)
+
+   text = json.dumps(res, indent=4, default=str)
+   if args.output is None:
+      print(text)
+   else:
+      with open(args.output, "w") as f:
+         f.write(text)
+      print(f"Results have been written to {args.output}.")
+
+if __name__ =="__main__":
+   main()
@@ -0,0 +1,99 @@
+import os
+import json
+import numpy as np
+import xarray as xr
+
+COUNTRIES = ["DE", "FR", "ES", "NO", "IT", "AT", "CH", "FI"]
+COMPONENTS = ["ozone", "nitrogen_dioxide", "sulphur_dioxide", "nitrate", "ammonium", "pm10_mass", "carbon_monoxide", "temperature"]
+MATRIX = ["air", "aerosol", "pm10", "pm25"]
+UNITS = ["ug/m3", "nmol/mol", "ug N/m3", "K"]
+STATISTICS = ["arithmetic mean", "median"]
+BAD_QC = [459, 460, 999]
+# starting time of the first file of each site
+START = np.datetime64("1990-01-01T00:00:00", "ns")
+
+
+def site_code(index):
+   return f"{COUNTRIES[index%len(COUNTRIES)]}{index:04d}R"
+
+def make_file(out_dir, site, file_index, num_vars, length, resolution, rng):
+   """write one EBAS-shaped .nc file
+
+   Args:
+       out_dir (str): raw data path
+       site (int): site number
+       file_index (int): file number of the site, files of one site cover consecutive periods
+       num_vars (int): number of variables
+       length (int): number of samples
+       resolution (numpy.timedelta64): sample length
+       rng (numpy.random.Generator): random generator
+
+   Returns:
+       str: file name
+   """
+   code = site_code(site)
+   start = START+file_index*length*resolution
+   st = start+np.arange(length)*resolution
+   ed = st+resolution
+
+   ds = xr.Dataset(coords={"time": st+resolution//2})
+   ds["time_bnds"] = (("time", "tbnd"), np.stack([st, ed], axis=1))
+   ds["metadata_time_bnds"] = (("metadata_time", "tbnd"), np.array([[st[0], ed[-1]]]))
+   for v in range(num_vars):
+      component = COMPONENTS[(site+v)%len(COMPONENTS)]
+      name = f"{component}_{v}"
+      qc = np.zeros(length, dtype=np.int32)
+      bad = rng.random(length)<0.05
+      qc[bad] = rng.choice(BAD_QC, bad.sum())
+      metadata = {"Matrix": MATRIX[v%len(MATRIX)],
+                  "Unit": UNITS[v%len(UNITS)],
+                  "Statistics": STATISTICS[v%len(STATISTICS)],
+                  "Component": component}
+      ds[name] = (("time",), rng.gamma(2.0, 10.0, length))
+      ds[name+"_qc"] = (("time",), qc)
+      ds[name+"_ebasmetadata"] = (("metadata_time",), np.array([json.dumps(metadata)], dtype=object))
+
+   ds.attrs["ebas_metadata"] = json.dumps({
+      "Station code": code,
+      "Station name": f"Synthetic station {site}",
+      "Station land use": "Grassland",
+      "Station setting": "Rural",
+      "Station altitude": f"{100+site} m",
+      "Station latitude": 35.0+(site*7.3)%35,
+      "Station longitude": -10.0+(site*13.1)%40,
+      "Resolution code": "1h" if resolution==np.timedelta64(1, "h") else "1d",
+   })
+
+   t0 = str(st[0].astype("datetime64[s]")).replace("-", "").replace(":", "").replace("T", "")
+   t1 = str(ed[-1].astype("datetime64[s]")).replace("-", "").replace(":", "").replace("T", "")
+   file_name = f"{code}.{t0}.{t1}.synthetic.{COMPONENTS[site%len(COMPONENTS)]}.air.1y.1h.SYN01L_{file_index}.lev2.nc"
+   ds.to_netcdf(os.path.join(out_dir, file_name))
+   return file_name
+
+def archive_range(num_files=2, length=8760, resolution=np.timedelta64(1, "h")):
+   """starting time of the first sample and ending time of the last sample of each site of make_archive"""
+   return START, START+num_files*length*resolution
+
+def make_archive(out_dir, num_sites=10, num_files=2, num_vars=3, length=8760, resolution=np.timedelta64(1, "h"), seed=0):
+   """write a synthetic EBAS archive
+
+   Args:
+       out_dir (str): raw data path
+       num_sites (int, optional): number of sites. Defaults to 10.
+       num_files (int, optional): number of files per site. Defaults to 2.
+       num_vars (int, optional): number of variables per file. Defaults to 3.
+       length (int, optional): number of samples per file. Defaults to 8760.
+       resolution (numpy.timedelta64, optional): sample length. Defaults to 1 hour.
+       seed (int, optional): random seed. Defaults to 0.
+
+   Returns:
+       list: file names
+   """
+   if not os.path.exists(out_dir):
+      os.makedirs(out_dir)
+   rng = np.random.default_rng(seed)
+   files = []
+   for site in range(num_sites):
+      for f in range(num_files):
+         files.append(make_file(out_dir, site, f, num_vars, length, resolution, rng))
+   return files
@@ -1 +1,2 @@
 from .db import *
+from .server import *
@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+from .query import *
+
+# samples are put in the cell of their starting time
+START_RULES = ["mean", "sum", "min", "max", "count"]
+# "weighted": mean weighted by the overlap of samples and cells, for samples longer or shorter than cells
+# "nearest": value of the sample closest to the middle of each cell, for samples longer than cells
+RULES = START_RULES+["weighted", "nearest"]
+
+
+def check_rule(how):
+   if how not in RULES:
+      raise ValueError(f"Unknown alignment rule: {how}, use one of {RULES}")
+   return how
+
+def to_step(freq):
+   """cell length as timedelta64[ns], eg. "1h" or "1D" """
+   return pd.Timedelta(freq).to_timedelta64().astype("timedelta64[ns]")
+
+def time_grid(st, ed, freq):
+   """starting time of grid cells covering [st, ed)
+
+   Args:
+       st (numpy.datetime64): starting time
+       ed (numpy.datetime64): ending time
+       freq (str or numpy.timedelta64): fixed cell length, eg. "1h" or "1D"
+
+   Returns:
+       ndarray: datetime64[ns] starting time of each cell
+   """
+   step = to_step(freq)
+   st = np.datetime64(st, "ns")
+   ed = np.datetime64(ed, "ns")
+   return np.arange(st, max(st, ed), step)
+
+def query_grid(db_index, query_res, freq):
+   """grid of a query, from "st" and "ed" of the condition, otherwise covering the selected series
+
+   Cells start at multiples of freq if "st" is not given.
+
+   Returns:
+       ndarray: datetime64[ns] starting time of each cell
+   """
+   selected, time_selector = query_res
+   step = to_step(freq)
+   st, ed = None, None
+   for site_id, content_ids in selected.items():
+      for cid in content_ids:
+         header = db_index[site_id][cid]
+         st = header["st"] if st is None else min(st, header["st"])
+         ed = header["ed"] if ed is None else max(ed, header["ed"])
+   if "st" in time_selector.keys():
+      st = np.datetime64(time_selector["st"], "ns")
+   elif st is not None:
+      st = np.datetime64(st, "ns")
+      st = st-(st-np.datetime64(0, "ns"))%step
+   if "ed" in time_selector.keys():
+      ed = time_selector["ed"]
+   if st is None or ed is None:
+      return np.array([], dtype="datetime64[ns]")
+   return time_grid(st, ed, step)
+
+def align_columns(ts, val, column, columns, grid, step, how="mean", tolerance=None):
+   """align samples of several series onto one grid at once
+
+   Args:
+       ts (ndarray): (n, 2) starting and ending time of all samples
+       val (ndarray): (n,) values, nan values are skipped
+       column (ndarray): (n,) output column of each sample
+       columns (int): number of output columns
+       grid (ndarray): starting time of the cells, evenly spaced
+       step (numpy.timedelta64): cell length
+       how (str, optional): "mean", "sum", "min", "max", "count" of the samples starting in each cell,
+                            "weighted" mean by overlap, or "nearest" sample. Defaults to "mean".
+       tolerance (numpy.timedelta64, optional): largest gap between a cell middle and the "nearest" sample.
+                                                Defaults to None, half of step.
+
+   Returns:
+       ndarray: (len(grid), columns) float64, nan for cells without values (0 for "count")
+   """
+   check_rule(how)
+   cells = len(grid)
+   res = np.full((cells, columns), 0.0 if how=="count" else np.nan)
+   if cells==0 or columns==0:
+      return res
+   valid = ~np.isnan(val) & ~np.isnat(ts[:,0]) & ~np.isnat(ts[:,1])
+   ts, val, column = ts[valid], val[valid].astype(np.float64), column[valid]
+   if len(val)==0:
+      return res
+   origin = np.datetime64(grid[0], "ns")
+   step = np.timedelta64(step, "ns")
+   st = (ts[:,0].astype("datetime64[ns]")-origin).astype(np.int64)
+   ed = (ts[:,1].astype("datetime64[ns]")-origin).astype(np.int64)
+   step_ns = int(step.astype(np.int64))
+
+   if how in START_RULES:
+      cell = st//step_ns
+      inside = (cell>=0) & (cell<cells)
+      # flat index in the (cell, column) output, so all series are reduced by one call
+      flat = cell[inside]*columns+column[inside]
+      val = val[inside]
+      out = res.reshape(-1)
+      count = np.bincount(flat, minlength=out.size)
+      if how=="count":
+         out[:] = count
+      elif how in ["mean", "sum"]:
+         total = np.bincount(flat, weights=val, minlength=out.size)
+         if how=="sum":
+            np.copyto(out, total, where=count>0)
+         else:
+            np.divide(total, count, out=out, where=count>0)
+      else:
+         (np.fmin if how=="min" else np.fmax).at(out, flat, val)
+      return res
+
+   if how=="weighted":
+      return align_weighted(st, ed, val, column, res, step_ns)
+   tolerance = step_ns//2 if tolerance is None else int(np.timedelta64(tolerance, "ns").astype(np.int64))
+   return align_nearest(st, ed, val, column, res, step_ns, tolerance)
+
+def align_weighted(st, ed, val, column, res, step_ns):
+   """overlap weighted mean, times are ns from the first cell, see align_columns"""
+   cells, columns = res.shape
+   # zero length samples count as 1 ns
+   ed = np.maximum(ed, st+1)
+   c0 = np.clip(st//step_ns, 0, cells)
+   c1 = np.clip(-(-ed//step_ns), 0, cells)
+   num = c1-c0
+   # one row for each (sample, cell) overlap
+   sample = np.repeat(np.arange(len(val)), num)
+   cell = c0[sample]+np.arange(len(sample))-np.repeat(np.cumsum(num)-num, num)
+   cell_st = cell*step_ns
+   overlap = (np.minimum(ed[sample], cell_st+step_ns)-np.maximum(st[sample], cell_st)).astype(np.float64)
+   flat = cell*columns+column[sample]
+   weight = np.bincount(flat, weights=overlap, minlength=res.size)
+   total = np.bincount(flat, weights=overlap*val[sample], minlength=res.size)
+   np.divide(total, weight, out=res.reshape(-1), where=weight>0)
+   return res
+
+def align_nearest(st, ed, val, column, res, step_ns, tolerance):
+   """nearest sample of each cell middle, times are ns from the first cell, see align_columns"""
+   cells, columns = res.shape
+   middle = np.arange(cells, dtype=np.int64)*step_ns+step_ns//2
+   order = np.lexsort((st, column))
+   st, ed, val, column = st[order], ed[order], val[order], column[order]
+   bounds = np.searchsorted(column, np.arange(columns+1))
+   for c in range(columns):
+      s_st, s_ed, s_val = st[bounds[c]:bounds[c+1]], ed[bounds[c]:bounds[c+1]], val[bounds[c]:bounds[c+1]]
+      if len(s_val)==0:
+         continue
+      # the last sample starting before the middle, and the next one
+      nxt = np.searchsorted(s_st, middle, side="right")
+      before = np.maximum(nxt-1, 0)
+      after = np.minimum(nxt, len(s_val)-1)
+      never = np.iinfo(np.int64).max
+      gap_before = np.where(nxt>0, np.maximum(middle-s_ed[before], 0), never)
+      gap_after = np.where(nxt<len(s_val), s_st[after]-middle, never)
+      pick = np.where(gap_after<gap_before, after, before)
+      gap = np.minimum(gap_before, gap_after)
+      res[:,c] = np.where(gap<=tolerance, s_val[pick], np.nan)
+   return res
+
+def cell_selector(grid, time_selector, how):
+   """rows read for aligning onto grid, samples starting before the grid only matter if they can overlap it
+
+   Returns:
+       dict: time selector of Query.site_parts
+   """
+   if how not in START_RULES:
+      return {}
+   selector = {"st": grid[0]}
+   if "ed" in time_selector.keys():
+      selector["ed"] = time_selector["ed"]
+   return selector
+
+def series_keys(db_index, value_index, selected):
+   """output columns of aligned data, one per (site, component, unit, matrix)
+
+   Returns:
+       dict: {(site, component, unit, matrix) codes: column}, in the order of selected series
+   """
+   keys = {}
+   for site_id, content_ids in selected.items():
+      for cid in content_ids:
+         header = db_index[site_id][cid]
+         key = (value_index["site"][site_id], header["component"], header["unit"], header["matrix"])
+         keys.setdefault(key, len(keys))
+   return keys
+
+def query_aligned(load_site, db_index, query_res, value_index, freq="1h", how="mean", qc=None, tolerance=None):
+   """align selected series onto one grid, series of the same site and variable share a column
+
+   Sites are loaded one at a time, and all series of a site are aligned by one batched call.
+
+   Args:
+       load_site (function): load_site(site_id) returns the data of one site
+       db_index (dict): {site_id: content_index}
+       query_res (tuple): result of Query.query
+       value_index (dict): value index
+       freq (str, optional): cell length, eg. "1h" or "1D". Defaults to "1h".
+       how (str, optional): alignment rule, see align_columns. Defaults to "mean".
+       qc (QCPolicy, optional): qc policy, the flags option is ignored. Defaults to None, default bad flags.
+       tolerance (numpy.timedelta64, optional): see align_columns. Defaults to None.
+
+   Returns:
+       tuple: (grid, values, keys), values is (len(grid), len(keys)) float64,
+              keys is a list of (site, component, unit, matrix) codes
+   """
+   check_rule(how)
+   selected, time_selector = query_res
+   qc = QCPolicy.create(qc)
+   qc = QCPolicy(qc.bad, keep=qc.keep)
+   step = to_step(freq)
+   grid = query_grid(db_index, query_res, freq)
+   keys = series_keys(db_index, value_index, selected)
+   values = np.full((len(grid), len(keys)), 0.0 if how=="count" else np.nan)
+   if len(grid)==0:
+      return grid, values, list(keys.keys())
+   selector = cell_selector(grid, time_selector, how)
+
+   with span("align", rule=how):
+      for site_id, content_ids in selected.items():
+         parts = Query.site_parts(load_site(site_id), site_id, content_ids, db_index, selector, value_index, qc)
+         add_count("series_selected", len(parts))
+         if len(parts)==0:
+            continue
+         # parts of the same variable share a column
+         used, local = np.unique([keys[p[3]] for p in parts], return_inverse=True)
+         ts = np.concatenate([p[0] for p in parts])
+         val = np.concatenate([p[1][:,0] for p in parts])
+         column = np.repeat(local.reshape(-1), [p[0].shape[0] for p in parts])
+         values[:, used] = align_columns(ts, val, column, len(used), grid, step, how, tolerance)
+   return grid, values, list(keys.keys())
+
+def aligned_to_df(grid, values, keys, use_number_index, value_index):
+   """wide dataframe of aligned data, indexed by time, columns are (site, component, unit, matrix)"""
+   codes = np.array(keys, dtype=np.int64).reshape(-1, len(Query.code_keys))
+   levels = []
+   for i, k in enumerate(Query.code_keys):
+      level = codes[:,i]
+      if not use_number_index:
+         level = np.array(Query.categories(value_index, k), dtype=object)[level]
+      levels.append(level)
+   columns = pd.MultiIndex.from_arrays(levels, names=Query.code_keys)
+   return pd.DataFrame(values, index=pd.DatetimeIndex(grid, name="time"), columns=columns, copy=False)
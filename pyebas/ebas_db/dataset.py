@@ -0,0 +1,135 @@
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+from .query import *
+from .align import *
+
+
+class SeriesArray(BackendArray):
+   def __init__(self, load_site, site_ids, series, db_index, value_index, grid, step, qc, how="mean", time_selector=None):
+      """(site, time) array of one variable, series are read and aligned when a slice is computed
+
+      Args:
+          load_site (function): load_site(site_id) returns the data of one site
+          site_ids (list): sites of the site dimension
+          series (dict): {site_id: [content_id, ...]}, selected series of the variable
+          db_index (dict): {site_id: content_index}
+          value_index (dict): value index
+          grid (ndarray): starting time of the time dimension
+          step (numpy.timedelta64): cell length
+          qc (QCPolicy): qc policy
+          how (str, optional): alignment rule, see align_columns. Defaults to "mean".
+          time_selector (dict, optional): time range of the query. Defaults to None.
+      """
+      self.load_site = load_site
+      self.site_ids = site_ids
+      self.series = series
+      self.db_index = db_index
+      self.value_index = value_index
+      self.grid = grid
+      self.step = step
+      self.qc = qc
+      self.how = how
+      self.time_selector = {} if time_selector is None else time_selector
+      self.shape = (len(site_ids), len(grid))
+      self.dtype = np.dtype(np.float64)
+
+   def __getitem__(self, key):
+      return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.OUTER, self.__getitem)
+
+   def __getitem(self, key):
+      site_key, time_key = key
+      sites = np.arange(self.shape[0])[site_key]
+      times = np.arange(self.shape[1])[time_key]
+      res = np.full((np.size(sites), np.size(times)), np.nan)
+      if np.size(times)>0:
+         # only the cells covering the requested time are computed
+         t0, t1 = int(np.min(times)), int(np.max(times))+1
+         grid = self.grid[t0:t1]
+         for i, s in enumerate(np.atleast_1d(sites)):
+            res[i] = self.__site_values(self.site_ids[s], grid)[np.atleast_1d(times)-t0]
+      if np.ndim(times)==0:
+         res = res[:,0]
+      if np.ndim(sites)==0:
+         res = res[0]
+      return res
+
+   def __site_values(self, site_id, grid):
+      content_ids = self.series.get(site_id, [])
+      empty = np.full(len(grid), 0.0 if self.how=="count" else np.nan)
+      if len(content_ids)==0:
+         return empty
+      selector = cell_selector(grid, self.time_selector, self.how)
+      parts = Query.site_parts(self.load_site(site_id), site_id, content_ids, self.db_index,
+                               selector, self.value_index, self.qc)
+      if len(parts)==0:
+         # all shards are outside the time range
+         return empty
+      ts = np.concatenate([p[0] for p in parts])
+      val = np.concatenate([p[1][:,0] for p in parts])
+      return align_columns(ts, val, np.zeros(len(val), dtype=np.int64), 1, grid, self.step, self.how)[:,0]
+
+
+def query_dataset(load_site, site_index, db_index, query_res, value_index, freq="1h", qc=None, how="mean"):
+   """(site, time) dataset of selected series, variables are lazy
+
+   One variable per component, matrix and unit, named by component
+   (matrix and unit are added to the name if a component has several).
+   Values are aligned to the time cells with the rule of how, by default the mean of the samples starting in each cell.
+
+   Args:
+       load_site (function): load_site(site_id) returns the data of one site
+       site_index (dict): site index
+       db_index (dict): {site_id: content_index}
+       query_res (tuple): result of Query.query
+       value_index (dict): value index
+       freq (str, optional): fixed length of time cells, eg. "1h" or "1D". Defaults to "1h".
+       qc (QCPolicy, optional): qc policy. Defaults to None, default bad flags.
+       how (str, optional): alignment rule, see align_columns. Defaults to "mean".
+
+   Returns:
+       xarray.Dataset: dimensions are site and time, lat, lon and alt are site coordinates
+   """
+   selected, time_selector = query_res
+   check_rule(how)
+   qc = QCPolicy.create(qc)
+   qc = QCPolicy(qc.bad, keep=qc.keep)
+   step = to_step(freq)
+   site_ids = list(selected.keys())
+   grid = query_grid(db_index, query_res, freq)
+
+   # group series by variable
+   groups = {}
+   for site_id in site_ids:
+      for cid in selected[site_id]:
+         header = db_index[site_id][cid]
+         key = (header["component"], header["matrix"], header["unit"])
+         groups.setdefault(key, {}).setdefault(site_id, []).append(cid)
+
+   names = {}
+   for component, matrix, unit in groups.keys():
+      names.setdefault(value_index["component"][component], []).append((component, matrix, unit))
+   data_vars = {}
+   for name, keys in names.items():
+      for component, matrix, unit in keys:
+         attrs = {"component": name,
+                  "matrix": value_index["matrix"][matrix],
+                  "unit": value_index["unit"][unit]}
+         var_name = name
+         if len(keys)>1:
+            var_name = f"{name}_{attrs['matrix']}"
+            if len([k for k in keys if k[1]==matrix])>1:
+               var_name = f"{var_name}_{attrs['unit']}"
+         array = SeriesArray(load_site, site_ids, groups[(component, matrix, unit)], db_index, value_index, grid, step, qc, how,
+                             time_selector)
+         data_vars[var_name] = xr.Variable(("site", "time"), indexing.LazilyIndexedArray(array), attrs=attrs)
+
+   coords = {
+      "site": site_ids,
+      "time": grid,
+      "lat": ("site", [to_float(site_index[s]["lat"]) for s in site_ids]),
+      "lon": ("site", [to_float(site_index[s]["lon"]) for s in site_ids]),
+      "alt": ("site", [to_float(site_index[s]["alt"]) for s in site_ids]),
+   }
+   return xr.Dataset(data_vars, coords=coords, attrs={"freq": str(freq), "how": how})
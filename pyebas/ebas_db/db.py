@@ -4,18 +4,65 @@ from .site_index import *
 from .value_index import *
 from .query import *
 from .files_io import *
+from .site_cache import *
+from .query_cache import *
+from .align import *
+from .dataset import *
+from .rollup import *
+from .manifest import *
+from .ingest import *
+from .shards import *
 
 class EbasDB(SiteIndex, ValueIndex):
-   def __init__(self, dir=None, dump='xz', **agrs):
+   def __init__(self, dir=None, dump='xz', lazy=False, cache_size=None, num_cores=None, mem_per_worker=None, 
+                query_cache=128, query_cache_bytes=None, codec_options=None, rollups=None, shards=None, 
+                query_workers=None, **agrs):
       """EBAS database
 
       Args:
           dir (str, optional): path to database. Defaults to None.
-          dump (str, optional): dump file type, 'xz', 'p', or 'json'. Defaults to 'xz'.
+          dump (str, optional): dump file type, 'xz', 'zst' (requires zstandard), 'lz4' (requires lz4), 'p', 'npy', or 'json'. Defaults to 'xz'.
+                                note: the codec of compressed files is detected when loading.
+                                note: 'npy' stores each series as uncompressed arrays which are memory-mapped when queried.
                                 note: json file can be only used for exporting, 
                                       it can't be used as indexing file in databas. 
+          lazy (bool, optional): load site data on demand instead of loading all sites in init_db. Defaults to False.
+          cache_size (int, optional): memory budget (bytes) of loaded site data in lazy mode,
+                                      least recently used sites are released first. None means no limit. Defaults to None.
+          num_cores (int, optional): number of worker processes. Defaults to None, limited by cpu cores and available memory.
+          mem_per_worker (int, optional): memory (bytes) reserved for each worker process. Defaults to None, 1GB.
+          query_cache (int, optional): number of query results kept in memory, 0 disables the cache. Defaults to 128.
+          query_cache_bytes (int, optional): memory budget (bytes) of cached query results. None means no limit. Defaults to None.
+          codec_options (dict, optional): {"level": compression level, "threads": zstd compression threads (-1 for all cores),
+                                           "dict": path to a zstd dictionary, "zstd.dict" in the database folder is used if it exists,
+                                           see EbasDB.train_zstd_dict}. Defaults to None.
+          rollups (list, optional): resolutions of period statistics built at import, eg. ["D", "M", "Y"],
+                                    with the qc policy of bad_qc, see EbasDB.query. The resolutions are saved with 
+                                    the database, and update_db rebuilds the database if other resolutions are given
+                                    ([] for no rollups). Defaults to None, the rollups of an existing database, 
+                                    otherwise no rollups.
+          shards (str, optional): "year" or "decade" to store the series of each site in time shards,
+                                  queries with a time range only read the shards overlapping it.
+                                  The layout of an existing database is detected in init_db and update_db,
+                                  and update_db rebuilds the database if another period is given.
+                                  Defaults to None, the layout of an existing database, otherwise one dump per site.
+          query_workers (int, optional): number of threads selecting rows and filling the result of EbasDB.query,
+                                         threads come from a pool shared by all queries. 
+                                         Defaults to None, cpu cores but at most 8.
       """
       self.dump = dump
+      self.codec_options = codec_options
+      self.rollups = [check_resolution(r) for r in rollups] if rollups is not None else None
+      self.shards = check_period(shards) if shards else None
+      # {"period": shard period, "sites": {site_id: {key: {content_id: time range}}}}, None if sites are not sharded
+      self.shard_index = None
+      self.lazy = lazy
+      self.cache_size = cache_size
+      self.num_cores = num_cores
+      self.query_workers = query_workers
+      self.mem_per_worker = mem_per_worker
+      # worker pool shared by all steps of update_db
+      self.__pool = None
       self.db_dir = None
       self.dump_dir = None
       self.raw_dir = None
@@ -25,47 +72,295 @@ class EbasDB(SiteIndex, ValueIndex):
       # inverse indexing of file content in site_index
       self.db_index={}
       self.db={}
+      # posting lists of selector values, built from site_index and db_index
+      self.inverted_index = None
+      # results of repeated queries, cleared when the database changes
+      self.query_cache = QueryCache(query_cache, query_cache_bytes)
       self.selected = {}
             
-      self.bad_qc = [459,460,471,530,533,540,549,565,566,567,568,591,599,635,658,659,663,664,666,669,677,682,683,684,685,686,687,699,783,890,980,999]
+      # bad flags from EBAS website, a copy so the default of QCPolicy is not changed with it
+      self.bad_qc = list(bad_qc)
       self.__make_dir(dir)
+      dict_file = os.path.join(self.db_dir, "zstd.dict")
+      if os.path.exists(dict_file) and "dict" not in (codec_options or {}):
+         # dictionary trained by train_zstd_dict
+         self.codec_options = dict(codec_options or {}, dict=dict_file)
       super(EbasDB, self).__init__(raw_dir=self.raw_dir, 
                                    dump_dir=self.dump_dir,
                                    dump=dump,
                                    **agrs)
       
    def init_db(self):
-      print("init database...")     
-      print("Load value index...")
-      file_path = os.path.join(self.db_dir, f"value_index.{self.dump}")
-      self.value_index = load_value(file_path) 
-      
-      print("Load site index...")
-      file_path = os.path.join(self.db_dir, f"site_index.{self.dump}")
-      self.site_index = load_value(file_path)
+      with span("init_db", lazy=self.lazy):
+         self.query_cache.clear()
+         echo("init database...")     
+         with span("load_index"):
+            echo("Load value index...")
+            file_path = os.path.join(self.db_dir, f"value_index.{value_suffix(self.dump)}")
+            self.value_index = load_value(file_path, self.codec_options) 
+            
+            echo("Load site index...")
+            file_path = os.path.join(self.db_dir, f"site_index.{value_suffix(self.dump)}")
+            self.site_index = load_value(file_path, self.codec_options)
+            
+            echo("Load content index...")
+            self.db_index = self.__load_db_index()
+            self.shard_index = self.__load_shard_index()
+            if self.shard_index is not None:
+               self.shards = self.shard_index["period"]
+            if self.rollups is None:
+               self.rollups = self.__load_rollups()
+         self.__open_site_data()
+         with span("inverted_index"):
+            self.inverted_index = InvertedIndex(self.site_index, self.db_index)
+         Query.db_overview(self.site_index)
+         echo("Database is loaded.")
       
-      print("Load site data...")    
+   def __open_site_data(self):
+      if self.shard_index is not None:
+         sites = self.shard_index["sites"]
+         if self.lazy:
+            self.db = ShardedDB(sites, self.__load_site, SiteCache(self.__load_site, self.cache_size))
+            return
+         names = [shard_name(site, key) for site in sites.keys() for key in sites[site].keys()]
+         data = self.__load_all(names)
+         self.db = ShardedDB(sites, self.__load_site, data)
+      elif self.lazy:
+         # site data are loaded when a query needs them
+         self.db = SiteCache(self.__load_site, self.cache_size)
+      else:
+         self.db = self.__load_all(list(self.site_index.keys()))
+   
+   def __load_all(self, names):
+      echo("Load site data...")
       files = []
-      suffix = '.xz' if self.dump=="xz" else '.p'
-      for site in self.site_index.keys():
-         temp = {"path": os.path.join(self.dump_dir, site+suffix),
-               "name": site}
+      for name in names:
+         temp = {"path": site_dump_path(self.dump_dir, name, self.dump),
+               "name": name,
+               "options": self.codec_options}
          files.append(temp)
-      self.db_index, self.db = load_files(files)
-      Query.db_overview(self.site_index)
-      print("Database is loaded.")
+      with span("load_sites", sites=len(files)):
+         with WorkerPool(worker_count(len(files), self.num_cores, self.mem_per_worker)) as pool:
+            _, data = load_files(files, pool)
+      return data
+   
+   def update_db(self, full=False, hash_files=False):
+      """create or update database with the files in raw data folder
+
+      Args:
+          full (bool, optional): rebuild the whole database. Defaults to False, 
+                                 only new, changed, and deleted files are processed if the database has a file manifest.
+          hash_files (bool, optional): compare files with sha1, files downloaded again with the same content are not processed.
+                                       Defaults to False, files are compared with size and modified time.
+      """
+      with span("update_db", full=full):
+         with span("scan_files"):
+            files = scan_files(self.raw_dir, hash_files)
+            add_count("files_scanned", len(files))
+         manifest = self.__load_manifest()
+         shard_index = self.__load_shard_index()
+         if self.shards is None and shard_index is not None:
+            # keep the layout of the existing database
+            self.shards = shard_index["period"]
+         elif manifest is not None and (shard_index or {}).get("period")!=self.shards:
+            echo("Shard layout is changed, creating the database again...")
+            full = True
+         rollups = self.__load_rollups()
+         if self.rollups is None:
+            # sites imported again keep the rollups of the other sites
+            self.rollups = rollups
+         elif manifest is not None and sorted(self.rollups)!=sorted(rollups or []):
+            echo("Rollups are changed, creating the database again...")
+            full = True
+         with WorkerPool(self.num_cores, self.mem_per_worker) as self.__pool:
+            if full or manifest is None:
+               self.__create_db()
+               sites = list(self.site_index.keys())
+               manifest = {}
+            else:
+               sites = self.__update_files(manifest, files)
+         self.__pool = None
+         if sites is not None:
+            self.query_cache.clear()
+            self.__record_files(manifest, files, sites)
+   
+   def __record_files(self, manifest, files, sites):
+      # record processed files
+      file_sites = {}
+      for site in self.site_index.keys():
+         for f in self.site_index[site]["files"].keys():
+            file_sites[f] = site
+      for f in list(manifest.keys()):
+         if f not in files.keys():
+            manifest.pop(f)
+      for f in files.keys():
+         # files can't be indexed are recorded as well, they will be processed again when they are changed
+         manifest[f] = dict(files[f], site=file_sites.get(f))
+      dump_value(manifest, self.db_dir, "manifest", self.dump, self.codec_options)
       
-   def update_db(self):
+      with span("inverted_index"):
+         self.inverted_index = InvertedIndex(self.site_index, self.db_index)
+      self.__refresh_sites(sites)
+   
+   def __create_db(self):
+      # index and import all files, each file is opened once
+      raw_data = os.listdir(self.raw_dir)
+      files = list(filter(lambda x: x.endswith('nc'), raw_data))
+      records, content_index, shards = self.__ingest(group_files(files))
       # create site index
-      self.create_site_index()
+      self.site_index, _, bad = self.merge_file_index({}, records)
+      echo(f"Collected site number: {len(self.site_index.keys())}")
+      self.__print_bad(bad)
       # create value index
       self.create_value_index(self.site_index)
-      dump_value(self.value_index, self.db_dir, "value_index", self.dump)
+      dump_value(self.value_index, self.db_dir, "value_index", self.dump, self.codec_options)
       # update site index with value index
       self.site_index = self.update_site_index(self.site_index)
-      dump_value(self.site_index, self.db_dir, "site_index", self.dump)
-      # import data
-      self.__import_data()
+      dump_value(self.site_index, self.db_dir, "site_index", self.dump, self.codec_options)
+      # content index with numbers
+      self.db_index = {}
+      for site in content_index.keys():
+         if site in self.site_index.keys():
+            self.db_index[site] = self.encode_content_index(content_index[site])
+      dump_value(self.db_index, self.db_dir, "db_index", self.dump, self.codec_options)
+      self.shard_index = None
+      if self.shards is not None:
+         self.shard_index = {"period": self.shards, 
+                             "sites": {site: shards[site] for site in self.db_index.keys()}}
+      self.__dump_shard_index()
+      self.__dump_rollups()
+   
+   def __update_files(self, manifest, files):
+      """process new, changed, and deleted files
+
+      Returns:
+          list: ids of updated sites, None if there is nothing to update
+      """
+      new_files, changed_files, deleted_files = diff_manifest(manifest, files)
+      echo(f"{len(new_files)} new files, {len(changed_files)} changed files, {len(deleted_files)} deleted files.")
+      if len(new_files)+len(changed_files)+len(deleted_files)==0:
+         echo("Database is up to date.")
+         return None
+      
+      self.value_index = load_value(os.path.join(self.db_dir, f"value_index.{value_suffix(self.dump)}"), self.codec_options)
+      self.site_index = load_value(os.path.join(self.db_dir, f"site_index.{value_suffix(self.dump)}"), self.codec_options)
+      self.db_index = self.__load_db_index()
+      self.shard_index = self.__load_shard_index()
+      
+      # sites with new, changed, or deleted files are imported again, other sites are not changed
+      touched = set(group_files(new_files+changed_files+deleted_files).keys())
+      old_files = []
+      for site in touched:
+         if site in self.site_index.keys():
+            old_files.extend(self.site_index[site]["files"].keys())
+      self.site_index, _ = self.remove_file_index(self.site_index, old_files)
+      
+      site_files = group_files(files.keys())
+      records, content_index, shards = self.__ingest({s: site_files[s] for s in touched if s in site_files.keys()})
+      self.site_index, merged, bad = self.merge_file_index(self.site_index, records)
+      self.__print_bad(bad)
+      
+      # new values are added to the end of value index, existing numbers are kept
+      for attr in ["matrix", "unit", "res_code", "component"]:
+         vals = set()
+         for r in records:
+            for site in r.values():
+               for f in site.get("files", {}).values():
+                  vals |= set(c[attr] for c in f["contents"])
+         self.extend_value_index(attr, sorted(vals))
+      self.extend_value_index("site", sorted(merged))
+      dump_value(self.value_index, self.db_dir, "value_index", self.dump, self.codec_options)
+      ingested = set()
+      for site in merged:
+         ingested |= set(self.site_index[site]["files"].keys())
+      self.site_index = self.update_site_index(self.site_index, files=ingested)
+      dump_value(self.site_index, self.db_dir, "site_index", self.dump, self.codec_options)
+      
+      for site in touched:
+         if site in self.site_index.keys() and site in content_index.keys():
+            self.db_index[site] = self.encode_content_index(content_index[site])
+            if self.shard_index is not None:
+               self.shard_index["sites"][site] = shards[site]
+         else:
+            # site without files
+            remove_site_dump(self.dump_dir, site, self.dump)
+            remove_site_shards(self.dump_dir, site, self.dump)
+            self.db_index.pop(site, None)
+            if self.shard_index is not None:
+               self.shard_index["sites"].pop(site, None)
+      dump_value(self.db_index, self.db_dir, "db_index", self.dump, self.codec_options)
+      self.__dump_shard_index()
+      
+      return list(touched)
+   
+   def __ingest(self, site_files):
+      """index and import files of each site
+
+      Args:
+          site_files (dict): {site_id: [file_name, ...]}
+
+      Returns:
+          tuple: (indexing information of each file, {site_id: content_index}, {site_id: shards of the site})
+      """
+      arg_list = []
+      for site, files in site_files.items():
+         arg_list.append((self.raw_dir, self.dump_dir, self.dump, site, files, self.detailed, self.codec_options,
+                          self.rollups, self.bad_qc, self.shards))
+      if len(arg_list)==0:
+         return [], {}, {}
+      
+      echo("Indexing and importing datafile for each site...")
+      with span("ingest", sites=len(arg_list)):
+         # one site per task, sites have very different sizes
+         res = run_mp(ingest_site, arg_list, pool=self.__pool, chunksize=1)
+         records = []
+         content_index = {}
+         shards = {}
+         for r in res:
+            records.extend(r["records"])
+            content_index[r["name"]] = r["content_index"]
+            shards[r["name"]] = r["shards"]
+            add_count("series_imported", len(r["content_index"]))
+         add_count("files_indexed", len(records))
+      return records, content_index, shards
+   
+   def __print_bad(self, bad):
+      if len(bad)>0:
+         echo(f"Bad files :{len(bad)}")
+         for b in bad:
+            echo(b)
+      else:
+         echo("No bad files were found.")
+   
+   def __load_manifest(self):
+      file_path = os.path.join(self.db_dir, f"manifest.{value_suffix(self.dump)}")
+      for name in ["site_index", "value_index"]:
+         if not os.path.exists(os.path.join(self.db_dir, f"{name}.{value_suffix(self.dump)}")):
+            return None
+      if not os.path.exists(file_path):
+         return None
+      return load_value(file_path, self.codec_options)
+   
+   def __refresh_sites(self, sites):
+      # loaded site data are outdated
+      if isinstance(self.db, ShardedDB)!=(self.shard_index is not None):
+         # layout is changed
+         if len(self.db)>0:
+            self.__open_site_data()
+         return
+      if isinstance(self.db, ShardedDB):
+         self.db.refresh(self.shard_index["sites"], sites)
+         return
+      if isinstance(self.db, SiteCache):
+         self.db.clear()
+         return
+      if len(self.db)==0:
+         return
+      for site in sites:
+         if site in self.site_index.keys():
+            self.db[site] = self.__load_site(site)
+         else:
+            self.db.pop(site, None)
    
    def list_sites(self, keys=None, list_time=False):
       sites = []
@@ -110,18 +405,190 @@ class EbasDB(SiteIndex, ValueIndex):
       return sites
       
    
-   def query(self, query_dict, use_number_indexing=True):
-      query_res = Query.query(self.site_index, self.db_index, query_dict, self.value_index)
-      df = Query.get_df(self.db, self.db_index, query_res, use_number_indexing, self.value_index)
+   def query(self, query_dict, use_number_indexing=True, cache=True, qc=None, resolution=None):
+      """select data with conditions
+
+      Args:
+          query_dict (dict): query condition, the dict is not modified
+          use_number_indexing (bool, optional): whether site, component, unit and matrix are numbers. Defaults to True.
+          cache (bool, optional): whether the result of the same query is reused. Defaults to True.
+          qc (optional): qc policy, None for the bad flags in self.bad_qc, "keep" for keeping flagged values, 
+                         "flags" for adding a "qc" column, a list of bad flags, or QCPolicy. Defaults to None.
+          resolution (str, optional): "D", "M" or "Y" for daily, monthly or yearly statistics (count, sum, min, max, 
+                                      and mean as val) of the periods within the time range. Rollups built at import
+                                      are used if they have the same qc policy, otherwise they are computed from the rows.
+                                      Defaults to None, rows as stored.
+
+      Returns:
+          pandas.DataFrame: selected data, None if nothing is selected
+      """
+      qc = QCPolicy(self.bad_qc) if qc is None else QCPolicy.create(qc)
+      key = canonical_query(query_dict, use_number_indexing=use_number_indexing, qc=qc.key(), resolution=resolution)
+      if cache:
+         found, df = self.query_cache.get(key)
+         if found:
+            add_count("query_cache_hits")
+            return df
+      with span("query"):
+         query_res = Query.query(self.site_index, self.db_index, query_dict, self.value_index, self.inverted_index)
+         if resolution is None:
+            df = Query.get_df(self.db, self.db_index, query_res, use_number_indexing, self.value_index, qc, self.query_workers)
+         else:
+            df = get_rollup_df(self.db, self.db_index, query_res, use_number_indexing, self.value_index, qc, resolution)
+      if cache:
+         self.query_cache.put(key, df)
       return df
    
-   def __import_data(self):
-      arg_list = []
-      for k in self.site_index.keys():
-         arg_list.append((self.raw_dir, self.dump_dir, self.dump, self.site_index[k]["files"]))
+   def iter_query(self, query_dict, use_number_indexing=True, chunk_rows=None, qc=None, arrays=False):
+      """select data with conditions, results are yielded chunk by chunk instead of one dataframe
+
+      Sites are loaded one at a time in lazy mode (without filling the site cache), 
+      so large selections can be processed with bounded memory.
+
+      Args:
+          query_dict (dict): query condition, the dict is not modified
+          use_number_indexing (bool, optional): whether site, component, unit and matrix are numbers. Defaults to True.
+          chunk_rows (int, optional): number of rows of each chunk. Defaults to None, one chunk per site.
+          qc (optional): qc policy, see EbasDB.query. Defaults to None.
+          arrays (bool, optional): yield dicts of numpy arrays instead of dataframes. Defaults to False.
+
+      Yields:
+          pandas.DataFrame or dict: columns are st, ed, val, (qc), site, component, unit, matrix
+      """
+      qc = QCPolicy(self.bad_qc) if qc is None else QCPolicy.create(qc)
+      query_res = Query.query(self.site_index, self.db_index, query_dict, self.value_index, self.inverted_index)
+      if isinstance(self.db, SiteCache):
+         load_site = lambda site_id: self.db[site_id] if site_id in self.db else self.__load_site(site_id)
+      elif isinstance(self.db, ShardedDB) and self.lazy:
+         # only the last shard is kept
+         load_site = ShardedDB(self.db.sites, self.__load_site, SiteCache(self.__load_site, 0)).__getitem__
+      else:
+         load_site = self.db.__getitem__
+      yield from Query.iter_df(load_site, self.db_index, query_res, use_number_indexing, self.value_index, qc, chunk_rows, arrays)
+   
+   def query_dataset(self, query_dict, freq="1h", qc=None, how="mean"):
+      """select data as a (site, time) xarray.Dataset, data are read and aligned when they are accessed
+
+      Args:
+          query_dict (dict): query condition, the dict is not modified. 
+                             "st" and "ed" set the time range, otherwise it covers the selected series.
+          freq (str, optional): fixed length of time cells, eg. "1h" or "1D". Defaults to "1h".
+          qc (optional): qc policy, see EbasDB.query. Defaults to None.
+          how (str, optional): alignment rule, see EbasDB.query_aligned. Defaults to "mean".
+
+      Returns:
+          xarray.Dataset: one variable per component, with lat, lon, and alt of the sites as coordinates
+      """
+      qc = QCPolicy(self.bad_qc) if qc is None else QCPolicy.create(qc)
+      query_res = Query.query(self.site_index, self.db_index, query_dict, self.value_index, self.inverted_index)
+      return query_dataset(self.db.__getitem__, self.site_index, self.db_index, query_res, self.value_index, freq, qc, how)
+   
+   def query_aligned(self, query_dict, freq="1h", how="mean", qc=None, tolerance=None, use_number_indexing=True, arrays=False):
+      """select data aligned onto one time grid, as a wide (time x series) table
+
+      Series of the same site, component, unit and matrix (eg. from several files) share one column.
+
+      Args:
+          query_dict (dict): query condition, the dict is not modified. 
+                             "st" and "ed" set the time range, otherwise it covers the selected series.
+          freq (str, optional): fixed length of time cells, eg. "1h" or "1D". Defaults to "1h".
+          how (str, optional): "mean", "sum", "min", "max" or "count" of the samples starting in each cell,
+                               "weighted" mean by the overlap of samples and cells, 
+                               or "nearest" sample to the middle of each cell (for samples longer than cells). Defaults to "mean".
+          qc (optional): qc policy, see EbasDB.query. Defaults to None.
+          tolerance (str or numpy.timedelta64, optional): largest gap between a cell middle and the "nearest" sample. 
+                                                          Defaults to None, half of freq.
+          use_number_indexing (bool, optional): whether site, component, unit and matrix are numbers. Defaults to True.
+          arrays (bool, optional): return (time, values, keys) numpy arrays instead of a dataframe,
+                                   keys are (site, component, unit, matrix) numbers of each column. Defaults to False.
+
+      Returns:
+          pandas.DataFrame: indexed by time, columns are (site, component, unit, matrix)
+      """
+      qc = QCPolicy(self.bad_qc) if qc is None else QCPolicy.create(qc)
+      if isinstance(tolerance, str):
+         tolerance = to_step(tolerance)
+      with span("query_aligned"):
+         query_res = Query.query(self.site_index, self.db_index, query_dict, self.value_index, self.inverted_index)
+         grid, values, keys = query_aligned(self.db.__getitem__, self.db_index, query_res, self.value_index, 
+                                            freq, how, qc, tolerance)
+      if arrays:
+         return grid, values, np.array(keys, dtype=np.int64).reshape(-1, len(Query.code_keys))
+      return aligned_to_df(grid, values, keys, use_number_indexing, self.value_index)
+   
+   def train_zstd_dict(self, dict_size=1<<17, sample_size=1<<14):
+      """train a zstd dictionary from the site dumps, and use it for later dumps
+
+      A dictionary improves the compression of small site files. The database should be created again
+      (update_db(full=True)) with dump='zst', and the dictionary file must be kept with the database.
+
+      Args:
+          dict_size (int, optional): dictionary size in bytes. Defaults to 128KB.
+          sample_size (int, optional): site dumps are split into training samples of this size. Defaults to 16KB.
+
+      Returns:
+          str: path to the dictionary
+      """
+      if self.shard_index is not None:
+         sites = self.shard_index["sites"]
+         names = [shard_name(site, key) for site in sites.keys() for key in sites[site].keys()]
+      else:
+         names = list(self.site_index.keys())
+      files = [site_dump_path(self.dump_dir, name, self.dump) for name in names]
+      dict_file = train_zstd_dict(files, os.path.join(self.db_dir, "zstd.dict"), dict_size, self.codec_options, sample_size)
+      self.codec_options = dict(self.codec_options or {}, dict=dict_file)
+      return dict_file
+   
+   def __load_shard_index(self):
+      file_path = os.path.join(self.db_dir, f"shard_index.{value_suffix(self.dump)}")
+      if not os.path.exists(file_path):
+         return None
+      return load_value(file_path, self.codec_options)
+   
+   def __dump_shard_index(self):
+      if self.shard_index is not None:
+         dump_value(self.shard_index, self.db_dir, "shard_index", self.dump, self.codec_options)
+         return
+      file_path = os.path.join(self.db_dir, f"shard_index.{value_suffix(self.dump)}")
+      if os.path.exists(file_path):
+         os.remove(file_path)
+   
+   def __load_rollups(self):
+      """resolutions of the rollups built at import, None if the database has no rollups"""
+      file_path = os.path.join(self.db_dir, f"rollup_index.{value_suffix(self.dump)}")
+      if not os.path.exists(file_path):
+         return None
+      return load_value(file_path, self.codec_options)["resolutions"]
+   
+   def __dump_rollups(self):
+      if self.rollups:
+         dump_value({"resolutions": self.rollups}, self.db_dir, "rollup_index", self.dump, self.codec_options)
+         return
+      file_path = os.path.join(self.db_dir, f"rollup_index.{value_suffix(self.dump)}")
+      if os.path.exists(file_path):
+         os.remove(file_path)
+   
+   def __load_site(self, site_id):
+      return load_site(self.dump_dir, site_id, self.dump, self.codec_options)
+
+   def __load_db_index(self):
+      file_path = os.path.join(self.db_dir, f"db_index.{value_suffix(self.dump)}")
+      if os.path.exists(file_path):
+         return load_value(file_path, self.codec_options)
       
-      print("Importing datafile for each site...")
-      utilities.run_mp(import_site_data, arg_list)
+      # databases created by older versions do not have content index file
+      echo("Content index is not found, creating it from site data...")
+      db_index = {}
+      for site in self.site_index.keys():
+         res = load_file({"path": site_dump_path(self.dump_dir, site, self.dump), "name": site, "options": self.codec_options})
+         count_loaded(res)
+         content_index = res["data"]["content_index"]
+         if any(isinstance(c["component"], str) for c in content_index.values()):
+            # site data are saved with names since single-pass import
+            content_index = self.encode_content_index(content_index)
+         db_index[site] = content_index
+      dump_value(db_index, self.db_dir, "db_index", self.dump, self.codec_options)
+      return db_index
 
 
    def __make_dir(self, dir):
@@ -137,10 +604,10 @@ class EbasDB(SiteIndex, ValueIndex):
          
       if not os.path.exists(self.db_dir):
          os.makedirs(self.db_dir)
-         print(f"Make data folder {self.db_dir}...")
+         echo(f"Make data folder {self.db_dir}...")
       if not os.path.exists(self.dump_dir):
          os.makedirs(self.dump_dir)
-         print(f"Make data folder {self.dump_dir}...")
+         echo(f"Make data folder {self.dump_dir}...")
       if not os.path.exists(self.raw_dir):
          os.makedirs(self.raw_dir)
-         print(f"Make data folder {self.raw_dir}...")
+         echo(f"Make data folder {self.raw_dir}...")
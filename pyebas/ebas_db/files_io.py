@@ -3,26 +3,186 @@ import pickle
 import lzma
 import json
 import os
+import shutil
+import functools
 import numpy as np
-import xarray as xr
 
+try:
+   import zstandard
+except ImportError:
+   zstandard = None
+try:
+   import lz4.frame as lz4_frame
+except ImportError:
+   lz4_frame = None
+
+# compressed dump types, detected from the first bytes of the files
+CODECS = {
+   "xz": b"\xfd7zXZ\x00",
+   "zst": b"\x28\xb5\x2f\xfd",
+   "lz4": b"\x04\x22\x4d\x18",
+}
+
+# bad flags from EBAS website, default of QCPolicy and EbasDB.bad_qc
 bad_qc = [459,460,471,530,533,540,549,565,566,567,568,591,599,635,658,659,663,664,666,669,677,682,683,684,685,686,687,699,783,890,980,999]
 
 
-def load_files(files):
+def site_dump_path(dump_dir, site_id, dump):
+   """path of the dump file of one site
+
+   Args:
+       dump_dir (str): path to site dumps
+       site_id (str): site id
+       dump (str): dump file type, 'xz', 'zst', 'lz4', 'p' or 'npy'
+
+   Returns:
+       str: path to the site dump, a folder for 'npy'
+   """
+   if dump=="npy":
+      return os.path.join(dump_dir, site_id)
+   suffix = dump if dump in CODECS.keys() else 'p'
+   return os.path.join(dump_dir, f"{site_id}.{suffix}")
+
+def remove_site_dump(dump_dir, site_id, dump):
+   """delete the dump of one site if it exists"""
+   path = site_dump_path(dump_dir, site_id, dump)
+   if os.path.isdir(path):
+      shutil.rmtree(path)
+   elif os.path.exists(path):
+      os.remove(path)
+
+def value_suffix(dump):
+   """suffix of index files (site_index, value_index, ...)
+
+   Args:
+       dump (str): dump file type
+
+   Returns:
+       str: file suffix, index files of 'npy' database are python pickle files
+   """
+   return 'p' if dump=="npy" else dump
+
+def require_codec(dump):
+   """raise ImportError if the package of a codec is not installed"""
+   if dump=="zst" and zstandard is None:
+      raise ImportError("zstandard is required for 'zst' dumps, use 'pip install zstandard'.")
+   if dump=="lz4" and lz4_frame is None:
+      raise ImportError("lz4 is required for 'lz4' dumps, use 'pip install lz4'.")
+
+def detect_codec(head):
+   """codec of a file from its first bytes, None for uncompressed files"""
+   for dump, magic in CODECS.items():
+      if head.startswith(magic):
+         return dump
+   return None
+
+@functools.lru_cache(maxsize=8)
+def zstd_dict(dict_file):
+   """trained zstd dictionary, loaded once per process"""
+   if dict_file is None:
+      return None
+   with open(dict_file, "rb") as f:
+      return zstandard.ZstdCompressionDict(f.read())
+
+def open_dump(file_path, mode="rb", dump=None, options=None):
+   """open a dump file as a binary stream, compressed with the codec of dump
+
+   For reading, the codec is detected from the first bytes of the file, so dump is not needed.
+
+   Args:
+       file_path (str): file path
+       mode (str, optional): 'rb' or 'wb'. Defaults to 'rb'.
+       dump (str, optional): dump file type for writing, 'xz', 'zst', 'lz4', or others for uncompressed files. Defaults to None.
+       options (dict, optional): codec options, {"level": compression level, 
+                                 "threads": zstd compression threads (-1 for all cores), 
+                                 "dict": path to a zstd dictionary, see train_zstd_dict}. Defaults to None.
+
+   Returns:
+       file object: binary stream
+   """
+   options = options if options is not None else {}
+   level = options.get("level")
+   if mode=="rb":
+      with open(file_path, "rb") as f:
+         dump = detect_codec(f.read(6))
+   if dump not in CODECS.keys():
+      return open(file_path, mode)
+   
+   require_codec(dump)
+   if dump=="xz":
+      return lzma.open(file_path, mode, preset=level if mode=="wb" else None)
+   if dump=="lz4":
+      return lz4_frame.open(file_path, mode, compression_level=0 if level is None else level)
+   dict_data = zstd_dict(options.get("dict"))
+   if mode=="rb":
+      return zstandard.ZstdDecompressor(dict_data=dict_data).stream_reader(open(file_path, "rb"), closefd=True)
+   cctx = zstandard.ZstdCompressor(level=3 if level is None else level, 
+                                   threads=options.get("threads", 0),
+                                   dict_data=dict_data)
+   return cctx.stream_writer(open(file_path, "wb"), closefd=True)
+
+def train_zstd_dict(files, dict_file, dict_size=1<<17, options=None, sample_size=1<<14):
+   """train a zstd dictionary from dump files, which improves the compression of small site files
+
+   Args:
+       files (list): paths to dump files, eg. site dumps of an existing database
+       dict_file (str): output path of the dictionary
+       dict_size (int, optional): dictionary size in bytes. Defaults to 128KB.
+       options (dict, optional): codec options to read the files. Defaults to None.
+       sample_size (int, optional): files are split into samples of this size. Defaults to 16KB.
+
+   Returns:
+       str: dict_file
+   """
+   require_codec("zst")
+   samples = []
+   for file_path in files:
+      with open_dump(file_path, "rb", options=options) as f:
+         data = f.read()
+      # the trainer needs many samples, large files are split
+      samples.extend(data[i:i+sample_size] for i in range(0, len(data), sample_size))
+   dict_data = zstandard.train_dictionary(dict_size, samples)
+   with open(dict_file, "wb") as f:
+      f.write(dict_data.as_bytes())
+   return dict_file
+
+def load_site(dump_dir, site_id, dump, options=None):
+   """load the data arrays of one site, without content index
+
+   Args:
+       dump_dir (str): path to site dumps
+       site_id (str): site id
+       dump (str): dump file type, 'xz', 'zst', 'lz4', 'p' or 'npy'
+       options (dict, optional): codec options, see open_dump. Defaults to None.
+
+   Returns:
+       dict: {content_id: {"time": dict, "val": ndarray, "qc": ndarray}}, NpySite for 'npy' 
+   """
+   res = load_file({"path": site_dump_path(dump_dir, site_id, dump), "name": site_id, "options": options})
+   count_loaded(res)
+   res["data"].pop("content_index")
+   return res["data"]
+
+def is_sorted(array):
+   """whether a 1-d array is in ascending order"""
+   return len(array)<2 or bool(np.all(array[1:]>=array[:-1]))
+
+def load_files(files, pool=None):
    """this method opens ebas data files
    
    Args:
          files (dict): {"path":"", "name":""}   
+         pool (WorkerPool, optional): worker pool, a new pool is used if None
    Returns:
          (tuple): (db_index, db)    
    """
    db_index = {}
    db = {}
-   res = run_mp(load_file, files)
+   res = run_mp(load_file, files, pool=pool)
          
    # combine all the data
    for r in res:
+      count_loaded(r)
       db_index[r["name"]] = r["data"]["content_index"]
       r["data"].pop("content_index")
       db[r["name"]] = r["data"]
@@ -31,116 +191,260 @@ def load_files(files):
    return db_index, db
 
 def load_file(file):
-   """this method opens one '.xz', '.json', and python pickle files
+   """this method opens one compressed ('.xz', '.zst', '.lz4') or python pickle file, '.json' files, and 'npy' site folders
 
    Args:
-         file (dict): {"name":"", "path":""}
+         file (dict): {"name":"", "path":"", "options": codec options (optional), see open_dump}
 
    Returns:
-         dict: {"name":"", "data":""}
+         dict: {"name":"", "data":"", "bytes_read": file size, "bytes_decompressed": size of the pickled data}
+               arrays of 'npy' folders are memory-mapped, only the header file is counted
    """
    
    file_path = file["path"]
    
-   if file_path.endswith("xz"):
-      with lzma.open(file_path, "rb") as pickle_file:
-         res = pickle.load(pickle_file)
+   if os.path.isdir(file_path):
+      res = load_npy_site(file_path)
+      size = os.path.getsize(os.path.join(file_path, "header.p"))
+      raw_size = size
    elif file_path.endswith("json"):
       with open(file_path,"r") as json_file:
          res = json.load(json_file)
+      size = raw_size = os.path.getsize(file_path)
    else:
-      with open(file_path, "rb") as pickle_file:
+      # codec is detected from the file header
+      with open_dump(file_path, "rb", options=file.get("options")) as pickle_file:
          res = pickle.load(pickle_file)
+         raw_size = pickle_file.tell()
+      size = os.path.getsize(file_path)
    
-   return {"name":file["name"], "data":res}
+   return {"name":file["name"], "data":res, "bytes_read": size, "bytes_decompressed": raw_size}
 
-def load_value(file_path):
-   if file_path.endswith("xz"):
-      with lzma.open(file_path, "rb") as pickle_file:
-         res = pickle.load(pickle_file)
-   elif file_path.endswith("json"):
+def count_loaded(res):
+   """add the sizes returned by load_file to counters, load_file may run in worker processes"""
+   add_count("sites_loaded")
+   add_count("bytes_read", res["bytes_read"])
+   add_count("bytes_decompressed", res["bytes_decompressed"])
+
+def load_value(file_path, options=None):
+   if file_path.endswith("json"):
       with open(file_path,"r") as json_file:
          res = json.load(json_file)
    else:
-      with open(file_path, "rb") as pickle_file:
+      with open_dump(file_path, "rb", options=options) as pickle_file:
          res = pickle.load(pickle_file)
    
    return res
 
-def dump_value(var, dir, file_name, dump): 
-   f_name = f"{file_name}.{dump}"
-   print(f"Dumping data to to '{f_name}'...")      
-   if dump =="xz":
-      with lzma.open(os.path.join(dir, f_name), "wb") as pickle_file:
-         pickle.dump(var, pickle_file)
-   elif dump=="p":
-      with open(os.path.join(dir, f_name),"wb") as f:
-         pickle.dump(var, f)  
-   else:
+def dump_value(var, dir, file_name, dump, options=None): 
+   f_name = f"{file_name}.{value_suffix(dump)}"
+   echo(f"Dumping data to to '{f_name}'...")      
+   if dump=="json":
       with open(os.path.join(dir, f_name),"w") as f:
          json.dump(var, f, indent=4,  sort_keys=True, default=str)
+   else:
+      # 'npy' and 'p' databases use uncompressed pickle files
+      with open_dump(os.path.join(dir, f_name), "wb", dump, options) as pickle_file:
+         pickle.dump(var, pickle_file)
          
-def import_site_data(args):
+def read_time_bounds(ebas):
+   """read time bounds of one opened .nc file
+
+   Args:
+       ebas (xarray.Dataset): opened .nc file
+
+   Returns:
+       tuple: (ts, order, sorted), ts is (n, 2) starting and ending time in column-major order,
+              order is the sorting index of values (None if they are in order), 
+              sorted is whether both columns of ts are ascending.
    """
-   {
-      content_index: {
-         id1:{
-            st, ed, comp, var, matrix, res_code, units
-         } ,
-         id2:{
-            }
-      ,...
-      }
-      id1:(df: st, ed, val_qc)
-      id2:(df: st, ed, val_qc)
-   }
+   st = ebas["time_bnds"].data[:,0]
+   ed = ebas["time_bnds"].data[:,1]
+   ts = np.array([st,ed]).T
+   
+   # keep series ordered by time, so time ranges can be selected with binary search
+   order = None
+   if not is_sorted(ts[:,0]):
+      order = np.argsort(ts[:,0], kind="stable")
+      ts = np.asfortranarray(ts[order])
+   return ts, order, is_sorted(ts[:,1])
+
+def read_values(ebas, var, order=None):
+   """read values of one variable, flagged values are kept, see read_flags
+
+   Args:
+       ebas (xarray.Dataset): opened .nc file
+       var (str): variable name
+       order (ndarray, optional): sorting index from read_time_bounds. Defaults to None.
+
+   Returns:
+       ndarray: (n, 1) values
    """
-   raw_dir, dump_dir, dump, files = args
-   res = { "content_index" :{} }
-   id_count = 0
-   for file in files.keys():
-      try:
-         site_id = file.split(".")[0]
-         ebas = xr.open_dataset(os.path.join(raw_dir, file))
-         for content in files[file]["contents"]:
-            res["content_index"][id_count] = {
-                  "st": content["st"],
-                  "ed": content["ed"],
-                  "component":content["component"],
-                  "matrix": content["matrix"],
-                  "res_code": content["res_code"],
-                  "unit": content["unit"],
-                  "var": content["var"],
-                  "stat": content["stat"],
-                  "file":file
-            }
-            # temp = pd.DataFrame()
-            st = ebas["time_bnds"].data[:,0]
-            ed = ebas["time_bnds"].data[:,1]
-            ts = np.array([st,ed]).T
-            
-            # get var value and qc, the values can be updated for several times, so additional dimensions may be applied
-            val = ebas[content["var"]].data
-            while len(val.shape)>1:
-               val = val[-1,:]  
-            qc = ebas[content["var"]+"_qc"].data
-            while len(qc.shape)>1:
-               qc = qc[-1,:]
-            
-            # filter value with qc values
-            val[np.isin(qc, bad_qc)]=None
-            
-            val = np.array([val]).T
-            
-            res[id_count] = {"ts": ts, "val": val}
-            id_count+=1
-         
-      except Exception as e:
-         print(e, file)  
+   # get var value, the values can be updated for several times, so additional dimensions may be applied
+   val = ebas[var].data
+   while len(val.shape)>1:
+      val = val[-1,:]  
    
-   if dump=="xz":   
-      with lzma.open(os.path.join(dump_dir, f"{site_id}.xz"), "wb") as pickle_file:
-         pickle.dump(res, pickle_file)
+   val = np.array([val]).T
+   if order is not None:
+      val = val[order]
+   return val
+
+def read_flags(ebas, var, order=None):
+   """read qc flags of one variable
+
+   Args:
+       ebas (xarray.Dataset): opened .nc file
+       var (str): variable name
+       order (ndarray, optional): sorting index from read_time_bounds. Defaults to None.
+
+   Returns:
+       ndarray: (n, k) uint16 flags, k flags of each sample, 0 means no flag
+   """
+   qc = ebas[var+"_qc"]
+   if "time" in qc.dims:
+      # all flags of each sample are kept, only the last version of other dimensions
+      for d in qc.dims:
+         if d!="time" and not d.endswith("_flags"):
+            qc = qc.isel({d: -1})
+      qc = qc.transpose("time", ...).data
+   else:
+      qc = qc.data
+      while len(qc.shape)>1:
+         qc = qc[-1,:]
+   
+   qc = np.asarray(qc)
+   qc = np.where(np.isnan(qc), 0, qc) if qc.dtype.kind=="f" else qc
+   qc = qc.astype(np.uint16).reshape(qc.shape[0], -1)
+   if order is not None:
+      qc = qc[order]
+   return qc
+
+def content_header(content, file, sorted):
+   """content index entry of one series"""
+   return {
+         "st": content["st"],
+         "ed": content["ed"],
+         "component":content["component"],
+         "matrix": content["matrix"],
+         "res_code": content["res_code"],
+         "unit": content["unit"],
+         "var": content["var"],
+         "stat": content["stat"],
+         "file":file,
+         "sorted": sorted,
+   }
+
+def dump_site(res, dump_dir, site_id, dump, options=None):
+   """write data of one site
+
+   Args:
+       res (dict): {"content_index": {}, content_id: {"time": dict, "val": ndarray, "qc": ndarray}}
+       dump_dir (str): path to site dumps
+       site_id (str): site id
+       dump (str): dump file type, 'xz', 'zst', 'lz4', 'p' or 'npy'
+       options (dict, optional): codec options, see open_dump. Defaults to None.
+   """
+   if dump=="npy":
+      dump_npy_site(res, site_dump_path(dump_dir, site_id, dump))
    else:
-      with open(os.path.join(dump_dir, f"{site_id}.p"), "wb") as pickle_file:
-         pickle.dump(res, pickle_file)
\ No newline at end of file
+      with open_dump(site_dump_path(dump_dir, site_id, dump), "wb", dump, options) as pickle_file:
+         pickle.dump(res, pickle_file)
+
+class NpySite:
+   def __init__(self, path, header):
+      """data of one site stored as '.npy' arrays, series are memory-mapped when accessed
+
+      Args:
+          path (str): path to the site folder
+          header (dict): {"content_index": {}, "series": {content_id: {"arrays": [], "attrs": {}}}}
+      """
+      self.path = path
+      self.header = header
+      self.series = header["series"]
+
+   def __getitem__(self, content_id):
+      # content index can be accessed like pickled site data
+      if content_id=="content_index":
+         return self.header["content_index"]
+      
+      layout = self.series[content_id]
+      res = {}
+      for key, value in layout["attrs"].items():
+         set_dotted(res, key, value)
+      for key in layout["arrays"]:
+         array = np.load(os.path.join(self.path, f"{content_id}.{key}.npy"), mmap_mode="r")
+         set_dotted(res, key, array)
+      return res
+
+   def __contains__(self, content_id):
+      return content_id in self.series
+
+   def __len__(self):
+      return len(self.series)
+
+   def keys(self):
+      return self.series.keys()
+   
+   def pop(self, key):
+      # the header is kept, content index is only hidden from keys()
+      if key=="content_index":
+         return self.header["content_index"]
+      raise KeyError(key)
+
+def load_npy_site(path):
+   """open the header of one 'npy' site folder
+
+   Args:
+       path (str): path to the site folder
+
+   Returns:
+       NpySite: site data, arrays are memory-mapped on access
+   """
+   with open(os.path.join(path, "header.p"), "rb") as f:
+      header = pickle.load(f)
+   return NpySite(path, header)
+
+def dump_npy_site(res, path):
+   """write one site as a folder of '.npy' arrays with a small pickled header
+
+   Args:
+       res (dict): {"content_index": {}, content_id: {"time": dict, "val": ndarray, "qc": ndarray}}
+       path (str): path to the site folder
+   """
+   if os.path.exists(path):
+      shutil.rmtree(path)
+   os.makedirs(path)
+   
+   header = {"content_index": res["content_index"], "series": {}}
+   for content_id, series in res.items():
+      if content_id=="content_index":
+         continue
+      layout = {"arrays": [], "attrs": {}}
+      for key, value in flatten_series(series):
+         if isinstance(value, np.ndarray) and value.dtype!=object:
+            # memory order is kept
+            np.save(os.path.join(path, f"{content_id}.{key}.npy"), value)
+            layout["arrays"].append(key)
+         else:
+            layout["attrs"][key] = value
+      header["series"][content_id] = layout
+   
+   # header is written last, an incomplete folder can't be opened
+   with open(os.path.join(path, "header.p"), "wb") as f:
+      pickle.dump(header, f)
+
+def flatten_series(series, prefix=""):
+   """flatten nested series dict to (dotted key, value) pairs"""
+   for key, value in series.items():
+      if isinstance(value, dict):
+         yield from flatten_series(value, f"{prefix}{key}.")
+      else:
+         yield f"{prefix}{key}", value
+
+def set_dotted(res, key, value):
+   """set value in nested dict with dotted key, eg. "time.start" """
+   keys = key.split(".")
+   for k in keys[:-1]:
+      res = res.setdefault(k, {})
+   res[keys[-1]] = value
@@ -0,0 +1,98 @@
+import os
+import xarray as xr
+from .site_index import index_dataset, error_index
+from .files_io import *
+from .time_axis import encode_bounds
+from .rollup import build_rollups
+from .qc_policy import QCPolicy
+from .shards import *
+
+
+def group_files(files):
+   """group .nc files by site, file names start with site id
+
+   Args:
+       files (list): file names
+
+   Returns:
+       dict: {site_id: [file_name, ...]}, file names are sorted
+   """
+   res = {}
+   for f in sorted(files):
+      res.setdefault(f.split(".")[0], []).append(f)
+   return res
+
+def ingest_site(args):
+   """index and import all files of one site, each file is opened once
+
+   Args:
+       args (tuple): (raw_dir, dump_dir, dump, site_id, file names, detailed, codec options,
+                      rollup resolutions (None for no rollups), bad qc flags of rollups,
+                      shard period (None for one dump per site))
+
+   Returns:
+       dict: {"name": site id,
+              "records": indexing information of each file, same as SiteIndex.get_file_indexing,
+              "content_index": content index of the site, values are names instead of numbers,
+              "shards": {key: {content_id: time range}} of sharded sites, otherwise None}
+   """
+   raw_dir, dump_dir, dump, site_id, files, detailed, options, rollups, bad, period = args
+   qc = QCPolicy(bad)
+   res = { "content_index" :{} }
+   # {key: site data of the shard} and {key: {content_id: time range}}
+   shards = {}
+   shard_index = {}
+   records = []
+   id_count = 0
+   for file in files:
+      try:
+         with xr.open_dataset(os.path.join(raw_dir, file)) as ebas:
+            record = index_dataset(ebas, file, detailed)
+            contents = list(record.values())[0]["files"][file]["contents"]
+            ts, order, sorted = read_time_bounds(ebas)
+            time = encode_bounds(ts)
+            series = [(read_values(ebas, content["var"], order), read_flags(ebas, content["var"], order)) for content in contents]
+      except Exception as e:
+         echo(f"{e} {file}")
+         records.append(error_index(file, e))
+         continue
+
+      # contents are added after the whole file is read
+      records.append(record)
+      if period is not None:
+         # rows of each shard, time bounds are shared by the contents of the file
+         keys, inverse = row_shards(ts[:,0], period)
+         file_shards = []
+         for i, key in enumerate(keys):
+            index = np.flatnonzero(inverse==i)
+            file_shards.append((key, index, ts[index], encode_bounds(ts[index])))
+      for content, (val, flags) in zip(contents, series):
+         header = content_header(content, file, sorted)
+         res["content_index"][id_count] = header
+         if period is None:
+            res[id_count] = {"time": time, "val": val, "qc": flags}
+            if rollups:
+               res[id_count]["rollup"] = build_rollups(ts, val, flags, qc, rollups)
+         else:
+            for key, index, shard_ts, shard_time in file_shards:
+               shard = shards.setdefault(key, {"content_index": {}})
+               shard["content_index"][id_count] = header
+               shard[id_count] = {"time": shard_time, "val": val[index], "qc": flags[index]}
+               if rollups:
+                  # periods of rollups never cross shards
+                  shard[id_count]["rollup"] = build_rollups(shard_ts, val[index], flags[index], qc, rollups)
+               shard_index.setdefault(key, {})[id_count] = shard_range(shard_ts)
+         id_count+=1
+
+   # dumps of the other layout are removed as well
+   remove_site_shards(dump_dir, site_id, dump)
+   if period is not None:
+      remove_site_dump(dump_dir, site_id, dump)
+      for key, shard in shards.items():
+         dump_site(shard, dump_dir, shard_name(site_id, key), dump, options)
+   elif id_count>0:
+      dump_site(res, dump_dir, site_id, dump, options)
+   else:
+      remove_site_dump(dump_dir, site_id, dump)
+   return {"name": site_id, "records": records, "content_index": res["content_index"],
+           "shards": shard_index if period is not None else None}
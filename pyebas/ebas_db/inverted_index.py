@@ -0,0 +1,143 @@
+import numpy as np
+from .spatial_index import *
+
+
+class InvertedIndex:
+   # selectors stored in each content of db_index
+   content_keys = ["component", "matrix", "stat", "res_code", "unit"]
+   # selectors stored in site_index, applied to every content of the site
+   site_keys = ["id", "name", "country", "land_use", "station_setting"]
+   # content selectors which are stored as numbers in db_index
+   coded_keys = ["component", "matrix", "res_code", "unit"]
+
+   def __init__(self, site_index, db_index):
+      """posting lists from selector values to (site, content_id) entries
+
+      Args:
+          site_index (dict): site index
+          db_index (dict): {site_id: content_index}
+
+      Each (site, content_id) pair is one entry, entries are numbered in the order of site_index,
+      so every posting list is a sorted array of entry numbers.
+      """
+      self.sites = []
+      site_codes = []
+      content_ids = []
+      st = []
+      ed = []
+      postings = {k: {} for k in self.content_keys+self.site_keys}
+
+      for site_id in site_index.keys():
+         if site_id not in db_index:
+            continue
+         site_code = len(self.sites)
+         self.sites.append(site_id)
+         first = len(content_ids)
+         for content_id, content in db_index[site_id].items():
+            entry = len(content_ids)
+            site_codes.append(site_code)
+            content_ids.append(content_id)
+            st.append(content["st"])
+            ed.append(content["ed"])
+            for k in self.content_keys:
+               postings[k].setdefault(content[k], []).append(entry)
+
+         entries = range(first, len(content_ids))
+         for k in self.site_keys:
+            postings[k].setdefault(site_index[site_id][k], []).extend(entries)
+
+      self.site_codes = np.array(site_codes, dtype=np.int64)
+      self.content_ids = np.array(content_ids, dtype=np.int64)
+      self.st = np.array(st, dtype="datetime64[ns]")
+      self.ed = np.array(ed, dtype="datetime64[ns]")
+      self.postings = {}
+      for k in postings:
+         self.postings[k] = {v: np.array(e, dtype=np.int64) for v, e in postings[k].items()}
+      # sites are numbered as site_codes
+      self.spatial = SpatialIndex(site_index, self.sites)
+
+   def __len__(self):
+      return len(self.content_ids)
+
+   def lookup(self, key, values, value_index=None):
+      """entries matching any of the values
+
+      Args:
+          key (str): selector name, eg. "component"
+          values (list): selector values, names are converted to numbers for coded selectors.
+                         A single string is one value.
+          value_index (dict, optional): value index. Defaults to None.
+
+      Returns:
+          ndarray: sorted entry numbers
+      """
+      if isinstance(values, str):
+         values = [values]
+      if key in self.coded_keys and value_index is not None:
+         # unknown names are ignored
+         values = [value_index[key][v] for v in values if v in value_index[key].keys()]
+
+      postings = self.postings[key]
+      lists = [postings[v] for v in values if v in postings]
+      if len(lists)==0:
+         return np.empty(0, dtype=np.int64)
+      if len(lists)==1:
+         return lists[0]
+      return np.unique(np.concatenate(lists))
+
+   def search(self, condition, value_index=None):
+      """entries matching all selectors of the condition
+
+      Args:
+          condition (dict): query condition, see EbasDB.query
+          value_index (dict, optional): value index. Defaults to None.
+
+      Returns:
+          ndarray: sorted entry numbers
+      """
+      res = None
+      keys = [k for k in self.content_keys+self.site_keys if k in condition.keys()]
+      # start from the shortest list, so the intersections are small
+      lists = [self.lookup(k, condition[k], value_index) for k in keys]
+      lists.sort(key=len)
+      for entries in lists:
+         res = entries if res is None else np.intersect1d(res, entries, assume_unique=True)
+         if len(res)==0:
+            break
+
+      if res is None:
+         res = np.arange(len(self), dtype=np.int64)
+      # contents without data in the time range
+      if "st" in condition.keys() and len(res)>0:
+         res = res[self.ed[res]>=condition["st"]]
+      if "ed" in condition.keys() and len(res)>0:
+         res = res[self.st[res]<=condition["ed"]]
+
+      # station coordinates
+      sites = self.spatial.search(condition)
+      if sites is not None and len(res)>0:
+         res = res[np.isin(self.site_codes[res], sites)]
+      if "nearest" in condition.keys() and len(res)>0:
+         # nearest sites among those matching the other selectors
+         sites = self.spatial.search_nearest(condition, np.unique(self.site_codes[res]))
+         res = res[np.isin(self.site_codes[res], sites)]
+      return res
+
+   def group(self, entries):
+      """group entries by site
+
+      Args:
+          entries (ndarray): sorted entry numbers
+
+      Returns:
+          dict: {site_id: [content_id, ...]}
+      """
+      selected = {}
+      if len(entries)==0:
+         return selected
+      site_codes = self.site_codes[entries]
+      content_ids = self.content_ids[entries]
+      bounds = np.flatnonzero(np.diff(site_codes))+1
+      for codes, ids in zip(np.split(site_codes, bounds), np.split(content_ids, bounds)):
+         selected[self.sites[codes[0]]] = ids.tolist()
+      return selected
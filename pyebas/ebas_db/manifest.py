@@ -0,0 +1,56 @@
+import os
+import hashlib
+
+
+def file_hash(file_path, block_size=1<<20):
+   """sha1 of one file"""
+   sha1 = hashlib.sha1()
+   with open(file_path, "rb") as f:
+      for block in iter(lambda: f.read(block_size), b""):
+         sha1.update(block)
+   return sha1.hexdigest()
+
+def scan_files(raw_dir, hash_files=False):
+   """stat all '.nc' files in raw data folder
+
+   Args:
+       raw_dir (str): raw data path
+       hash_files (bool, optional): whether compute sha1 of each file. Defaults to False.
+
+   Returns:
+       dict: {file_name: {"size": bytes, "mtime": modified time, "hash": sha1 or None}}
+   """
+   res = {}
+   for entry in os.scandir(raw_dir):
+      if not entry.name.endswith("nc"):
+         continue
+      stat = entry.stat()
+      res[entry.name] = {
+         "size": stat.st_size,
+         "mtime": stat.st_mtime,
+         "hash": file_hash(entry.path) if hash_files else None,
+      }
+   return res
+
+def diff_manifest(old, new):
+   """compare processed files with current files
+
+   Args:
+       old (dict): manifest of processed files, {file_name: {"size", "mtime", "hash", "site"}}
+       new (dict): result of scan_files
+
+   Returns:
+       tuple: (new_files, changed_files, deleted_files), sorted lists of file names
+   """
+   new_files = sorted(set(new.keys()) - set(old.keys()))
+   deleted_files = sorted(set(old.keys()) - set(new.keys()))
+   changed_files = []
+   for f in sorted(set(new.keys()) & set(old.keys())):
+      if new[f]["hash"] is not None and old[f].get("hash") is not None:
+         # files downloaded again have new mtime, but same content
+         changed = new[f]["hash"]!=old[f]["hash"]
+      else:
+         changed = new[f]["size"]!=old[f]["size"] or new[f]["mtime"]!=old[f]["mtime"]
+      if changed:
+         changed_files.append(f)
+   return new_files, changed_files, deleted_files
@@ -0,0 +1,96 @@
+import numpy as np
+from .files_io import bad_qc
+
+
+class QCPolicy:
+   # flags are stored as uint16
+   flag_num = 1<<16
+
+   def __init__(self, bad=None, keep=False, flags=False):
+      """how qc flags are applied to query results
+
+      Args:
+          bad (list, optional): flags marking invalid values. Defaults to None, bad flags from EBAS website.
+          keep (bool, optional): keep values with bad flags. Defaults to False, they are set to nan.
+          flags (bool, optional): add a "qc" column to the results. Defaults to False.
+      """
+      self.bad = sorted(set(int(f) for f in (bad_qc if bad is None else bad)))
+      self.keep = keep
+      self.flags = flags
+      # lookup table indexed by flag, so masking is one gather
+      self.lut = np.zeros(self.flag_num, dtype=bool)
+      self.lut[[f for f in self.bad if 0<=f<self.flag_num]] = True
+
+   @staticmethod
+   def create(qc=None):
+      """policy from the qc argument of EbasDB.query
+
+      Args:
+          qc (optional): None for default bad flags, "keep" for keeping flagged values,
+                         "flags" for default bad flags and a "qc" column,
+                         a list of bad flags, or QCPolicy. Defaults to None.
+
+      Returns:
+          QCPolicy: qc policy
+      """
+      if isinstance(qc, QCPolicy):
+         return qc
+      if qc is None:
+         return QCPolicy()
+      if isinstance(qc, str):
+         if qc=="keep":
+            return QCPolicy(keep=True)
+         if qc=="flags":
+            return QCPolicy(flags=True)
+         raise ValueError(f"Unknown qc policy: {qc}")
+      return QCPolicy(bad=qc)
+
+   def key(self):
+      """hashable form of the policy, eg. for caching query results"""
+      return (tuple(self.bad), self.keep, self.flags)
+
+   def invalid(self, qc):
+      """samples with any bad flag
+
+      Args:
+          qc (ndarray): (n, k) flags
+
+      Returns:
+          ndarray: (n,) boolean
+      """
+      bad = self.lut[qc]
+      return bad[:,0] if bad.shape[1]==1 else bad.any(axis=1)
+
+   def apply(self, val, qc):
+      """set values with bad flags to nan
+
+      Args:
+          val (ndarray): (n, 1) values
+          qc (ndarray): (n, k) flags, None for series imported by older versions, their bad values are already nan
+
+      Returns:
+          ndarray: (n, 1) values, val is returned if nothing is changed
+      """
+      if self.keep or qc is None or len(qc)==0:
+         return val
+      invalid = self.invalid(qc)
+      if not invalid.any():
+         return val
+      return np.where(invalid[:,None], np.nan, val)
+
+   def flag_column(self, qc, n):
+      """one flag of each sample, a bad flag if there is any, otherwise the first flag
+
+      Args:
+          qc (ndarray): (n, k) flags, or None for series imported by older versions
+          n (int): number of samples
+
+      Returns:
+          ndarray: (n,) uint16 flags, 0 means no flag
+      """
+      if qc is None:
+         return np.zeros(n, dtype=np.uint16)
+      if qc.shape[1]==1:
+         return qc[:,0]
+      score = self.lut[qc].astype(np.int8)*2+(qc!=0)
+      return qc[np.arange(n), np.argmax(score, axis=1)]
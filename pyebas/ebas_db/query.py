@@ -1,9 +1,17 @@
 import numpy as np
 import pandas as pd
 import itertools
-from tqdm import tqdm
+from ..utilities.instrument import *
+from ..utilities.utilities import run_threads_iter, thread_count
+from .inverted_index import *
+from .qc_policy import *
+from .time_axis import *
+from .shards import ShardedSite
 
 class Query:
+   # coded columns of query results
+   code_keys = ["site", "component", "unit", "matrix"]
+   
    @staticmethod
    def db_overview(site_index):
       country = list(set(map(lambda x: site_index[x]["country"], site_index)))
@@ -13,10 +21,10 @@ class Query:
       components = list(map(lambda x: list(site_index[x]["components"].keys()), site_index))
       components = list(set(itertools.chain(*matrix)))
            
-      print(f"{len(site_index.keys()):<10} sites included in current database.")
-      print(f"{len(components):<10} components included in current database.")
-      print(f"{len(matrix):<10} matrix included in current database.")
-      print(f"{len(country):<10} country included in current database.")
+      echo(f"{len(site_index.keys()):<10} sites included in current database.")
+      echo(f"{len(components):<10} components included in current database.")
+      echo(f"{len(matrix):<10} matrix included in current database.")
+      echo(f"{len(country):<10} country included in current database.")
       
    # @staticmethod
    # def summary(site_index, site_keys=None):
@@ -60,123 +68,303 @@ class Query:
       return res
    
    @staticmethod
-   def query(site_index, db_index, condition, value_index):
-      selected = {}
-      condition_key = list(condition.keys())
-      site_selector_key = ["id", "name", "land_use", "station_setting","country"]
-      site_selector_key = list(set(site_selector_key) & set(condition_key))
-      # if "id" in site_selector_key:
-      #    condition["id"] = list(map(lambda x: value_index["site"][x], condition["id"]))
-            
-      measure_selector_key = ["component", "matrix","stat"]
-      measure_selector_key = list(set(measure_selector_key) & set(condition_key))
-      
-      if "component" in measure_selector_key:
-         cond_temp = []
-         for c in condition["component"]:
-            if c in value_index["component"].keys():
-               cond_temp.append(value_index["component"][c])
-         condition["component"] = cond_temp
-         # condition["component"] = list(map(lambda x: value_index["component"][x], condition["component"]))
-      if "matrix" in measure_selector_key:
-         cond_temp = []
-         for c in condition["matrix"]:
-            if c in value_index["matrix"].keys():
-               cond_temp.append(value_index["matrix"][c])
-         condition["matrix"] = cond_temp
-         # condition["matrix"] = list(map(lambda x: value_index["matrix"][x], condition["matrix"]))
-  
-
-      time_selector_key =  ["st", "ed"]
-      time_selector_key = list(set(time_selector_key) & set(condition_key))
+   def query(site_index, db_index, condition, value_index, inverted_index=None):
+      """select contents with an inverted index
+
+      Args:
+          site_index (dict): site index
+          db_index (dict): {site_id: content_index}
+          condition (dict): query condition, the dict is not modified. "st" and "ed" can be strings, eg. "2000-01-01"
+          value_index (dict): value index
+          inverted_index (InvertedIndex, optional): prebuilt index, created from site_index and db_index if None. 
+                                                    Defaults to None.
+
+      Returns:
+          tuple: (selected, time_selector), selected is {site_id: [content_id, ...]}, times are numpy.datetime64
+      """
+      times = {k: np.datetime64(condition[k]) for k in ["st", "ed"] if k in condition.keys()}
+      if len(times)>0:
+         condition = dict(condition, **times)
+      with span("select"):
+         if inverted_index is None:
+            inverted_index = InvertedIndex(site_index, db_index)
+         
+         entries = inverted_index.search(condition, value_index)
+         selected = inverted_index.group(entries)
       
       time_selector = {}
-      for k in time_selector_key:
-         time_selector[k] = condition[k]
-      for site_id in tqdm(site_index.keys(), desc="seraching..."):
-         select =True
-         if len(site_selector_key)>0:
-            for key in site_selector_key:
-               if site_index[site_id][key] not in condition[key]:
-                  select=False
-                  break
-               
-         # if the site is not the target, examing files are not necessary.
-         if not select:
-            continue
-         
-         files = []
-         for file_id in db_index[site_id].keys():
-            select_file = True
-            content = db_index[site_id][file_id]
-            if "st" in site_selector_key:
-               if content["ed"]<condition["st"]:
-                  select_file = False
-            if "ed" in site_selector_key:
-               if content["st"]>condition["ed"]:
-                  select_file = False
-            for k in measure_selector_key:
-               if content[k] not in condition[k]:
-                  select_file = False
-                  break
-            if select_file:
-               files.append(file_id)
-         
-         if len(files)>0:
-            selected[site_id] = files
+      for k in ["st", "ed"]:
+         if k in condition.keys():
+            time_selector[k] = condition[k]
       
       return (selected, time_selector)
    
    @staticmethod
-   def get_df(db, db_index, query_res, use_number_index, value_index):
-      print("Gathering data to dataframe...")
-      selected, time_selector = query_res
-      res_ts = []
-      res_val = []
+   def time_index(ts, time_selector, sorted=False):
+      """select rows within the time range
+
+      Args:
+          ts (ndarray): (n, 2) starting and ending time
+          time_selector (dict): {"st": starting time, "ed": ending time}, both are optional
+          sorted (bool, optional): whether both columns of ts are in ascending order. Defaults to False.
+
+      Returns:
+          slice or ndarray: slice for sorted series (indexing returns views), otherwise boolean mask
+      """
+      return bounds_index(ts, time_selector, sorted)
+   
+   @staticmethod
+   def get_df(db, db_index, query_res, use_number_index, value_index, qc=None, workers=None):
+      """gather selected series into one dataframe
+
+      Args:
+          db (dict): {site_id: site data}, or SiteCache in lazy mode
+          db_index (dict): {site_id: content_index}
+          query_res (tuple): result of Query.query
+          use_number_index (bool): whether site, component, unit and matrix are numbers or categorical names
+          value_index (dict): value index
+          qc (QCPolicy, optional): how qc flags are applied, see QCPolicy.create. Defaults to None, default bad flags.
+          workers (int, optional): number of threads selecting rows and filling the output columns,
+                                   the order of rows doesn't depend on it. Defaults to None, 
+                                   all threads of the shared pool (cpu cores, at most 8).
+
+      Returns:
+          pandas.DataFrame: columns are st, ed, val, (qc), site, component, unit, matrix. None if nothing is selected.
+      """
+      with span("get_df", workers=workers):
+         echo("Gathering data to dataframe...")
+         selected, time_selector = query_res
+         qc = QCPolicy.create(qc)
       
-      for site in tqdm(selected.keys()):
-         site_id = site
-         for file in selected[site_id]:
-            header = db_index[site_id][file]
-            ts = db[site_id][file]["ts"]
-            val = db[site_id][file]["val"]
-            
-            if len(time_selector)>0:
-               if "st" in time_selector.keys():
-                  st = time_selector["st"]
-                  index = ts[:,0]>= st
-                  ts = ts[index]
-                  val = val[index]
-               if "ed" in time_selector.keys():
-                  ed = time_selector["ed"]
-                  index = ts[:,1]<=ed
-                  ts = ts[index]
-                  val = val[index]           
-            
-            infor = np.empty((ts.shape[0], 4))
-            infor[:,0] = value_index["site"][site_id]
-            infor[:,1] = header["component"]
-            infor[:,2] = header["unit"]
-            infor[:,3] = header["matrix"]
-                        
-            val = np.hstack((val,infor))
-            
-            res_ts.append(ts)
-            res_val.append(val)
+         def select(site_id):
+            # in lazy mode, this loads the site data
+            return Query.site_parts(db[site_id], site_id, selected[site_id], db_index, time_selector, value_index, qc)
       
-      df = None
-      if len(res_ts)>0:
-         res_ts = np.vstack(tuple(res_ts))
-         res_val = np.vstack(tuple(res_val))
-         
-         df1 = pd.DataFrame(res_ts, columns=["st", "ed"])
-         df2 = pd.DataFrame(res_val, columns=["val", "site","component","unit","matrix"])
-         df = pd.concat([df1,df2],axis=1)
-
-         if not use_number_index:
-            df["site"] =df["site"].map(value_index["site"])
-            df["component"] =df["component"].map(value_index["component"])
-            df["unit"] =df["unit"].map(value_index["unit"])
-            df["matrix"] =df["matrix"].map(value_index["matrix"])
+         # select rows of each series first, output columns are allocated once with the total length
+         parts = []
+         site_ids = list(selected.keys())
+         for site_parts in progress(run_threads_iter(select, site_ids, workers), total=len(site_ids)):
+            parts.extend(site_parts)
+      
+         add_count("series_selected", len(parts))
+         if len(parts)==0:
+            return None
+         columns = Query.parts_to_columns(parts, value_index, qc, workers)
+         add_count("rows_returned", len(columns["val"]))
+         return Query.columns_to_df(columns, use_number_index, value_index)
+   
+   @staticmethod
+   def iter_df(load_site, db_index, query_res, use_number_index, value_index, qc=None, chunk_rows=None, arrays=False):
+      """gather selected series chunk by chunk
+
+      Sites are loaded one by one, and the data of a site are released when its rows have been yielded.
+
+      Args:
+          load_site (function): load_site(site_id) returns the data of one site
+          db_index (dict): {site_id: content_index}
+          query_res (tuple): result of Query.query
+          use_number_index (bool): whether site, component, unit and matrix are numbers or categorical names
+          value_index (dict): value index
+          qc (QCPolicy, optional): how qc flags are applied, see QCPolicy.create. Defaults to None, default bad flags.
+          chunk_rows (int, optional): number of rows of each chunk, the last chunk can be shorter. 
+                                      Defaults to None, one chunk per site.
+          arrays (bool, optional): yield dicts of numpy arrays instead of dataframes, 
+                                   site, component, unit and matrix are numbers. Defaults to False.
+
+      Yields:
+          pandas.DataFrame or dict: same columns as get_df
+      """
+      selected, time_selector = query_res
+      qc = QCPolicy.create(qc)
+      buffer = []
+      rows = 0
+      for site_id in selected.keys():
+         parts = Query.site_parts(load_site(site_id), site_id, selected[site_id], db_index, time_selector, value_index, qc)
+         add_count("series_selected", len(parts))
+         if chunk_rows is None:
+            if sum(ts.shape[0] for ts, _, _, _ in parts)>0:
+               yield Query.__chunk(parts, use_number_index, value_index, qc, arrays)
+            continue
          
-      return df
\ No newline at end of file
+         for ts, val, flags, codes in parts:
+            pos = 0
+            while pos<ts.shape[0]:
+               end = min(ts.shape[0], pos+chunk_rows-rows)
+               buffer.append((ts[pos:end], val[pos:end], None if flags is None else flags[pos:end], codes))
+               rows += end-pos
+               pos = end
+               if rows==chunk_rows:
+                  yield Query.__chunk(buffer, use_number_index, value_index, qc, arrays)
+                  buffer, rows = [], 0
+         # rows left for the next chunk are copied, so the site data can be released
+         buffer = [(np.array(ts), np.array(val), None if flags is None else np.array(flags), codes) 
+                   for ts, val, flags, codes in buffer]
+      if len(buffer)>0:
+         yield Query.__chunk(buffer, use_number_index, value_index, qc, arrays)
+   
+   @staticmethod
+   def __chunk(parts, use_number_index, value_index, qc, arrays):
+      columns = Query.parts_to_columns(parts, value_index, qc)
+      add_count("rows_returned", len(columns["val"]))
+      if arrays:
+         return columns
+      return Query.columns_to_df(columns, use_number_index, value_index)
+   
+   @staticmethod
+   def site_parts(site_data, site_id, content_ids, db_index, time_selector, value_index, qc):
+      """select rows of the series of one site
+
+      Args:
+          site_data (dict): data of the site
+          site_id (str): site id
+          content_ids (list): selected series
+          db_index (dict): {site_id: content_index}
+          time_selector (dict): {"st": starting time, "ed": ending time}, both are optional
+          value_index (dict): value index
+          qc (QCPolicy): qc policy
+
+      Returns:
+          list: [(ts, val, flags, (site, component, unit, matrix))], one for each stored part of the series,
+                flags is None if qc column is not required
+      """
+      parts = []
+      for file in content_ids:
+         header = db_index[site_id][file]
+         codes = (value_index["site"][site_id], header["component"], header["unit"], header["matrix"])
+         for series in Query.series_segments(site_data, file, time_selector):
+            ts, val, flags = Query.series_rows(series, header, time_selector, qc)
+            parts.append((ts, val, flags, codes))
+      return parts
+   
+   @staticmethod
+   def series_segments(site_data, content_id, time_selector):
+      """stored parts of one series, shards outside the time range are skipped in sharded databases
+
+      Returns:
+          list: [series], series is {"time": dict, "val": ndarray, "qc": ndarray}
+      """
+      if isinstance(site_data, ShardedSite):
+         return site_data.segments(content_id, time_selector)
+      return [site_data[content_id]]
+   
+   @staticmethod
+   def series_rows(series, header, time_selector, qc):
+      """select rows of one stored series and apply the qc policy
+
+      Args:
+          series (dict): stored series
+          header (dict): content header of the series in db_index
+          time_selector (dict): {"st": starting time, "ed": ending time}, both are optional
+          qc (QCPolicy): qc policy
+
+      Returns:
+          tuple: (ts, val, flags), flags is None if qc column is not required
+      """
+      val = series["val"]
+      # series imported by older versions have no flags
+      flags = series.get("qc")
+   
+      index = None
+      if "time" in series:
+         if len(time_selector)>0:
+            index, ts = select_bounds(series["time"], time_selector, header.get("sorted", False))
+         else:
+            ts = decode_bounds(series["time"])
+      else:
+         # series imported by older versions store all time bounds
+         ts = series["ts"]
+         if len(time_selector)>0:
+            index = Query.time_index(ts, time_selector, header.get("sorted", False))
+            ts = ts[index]
+      if index is not None:
+         val = val[index]
+         flags = flags[index] if flags is not None else None
+      val = qc.apply(val, flags)
+      flags = qc.flag_column(flags, ts.shape[0]) if qc.flags else None
+      return ts, val, flags
+   
+   @staticmethod
+   def parts_to_columns(parts, value_index, qc, workers=1):
+      """copy selected rows to output columns, which are allocated once with the total length
+
+      Args:
+          parts (list): results of Query.site_parts
+          value_index (dict): value index
+          qc (QCPolicy): qc policy
+          workers (int, optional): number of threads, each fills the rows of a run of parts. 
+                                   Defaults to 1, None for all threads of the shared pool.
+
+      Returns:
+          dict: {"st", "ed", "val", ("qc"), "site", "component", "unit", "matrix"} numpy arrays, codes are numbers
+      """
+      # rows of each part start at a fixed position, so threads write disjoint ranges and the order is kept
+      lengths = np.array([ts.shape[0] for ts, _, _, _ in parts], dtype=np.int64)
+      ends = np.cumsum(lengths)
+      starts = ends-lengths
+      n = int(ends[-1])
+      st = np.empty(n, dtype=parts[0][0].dtype)
+      ed = np.empty(n, dtype=parts[0][0].dtype)
+      val = np.empty(n, dtype=np.result_type(*[v.dtype for _, v, _, _ in parts]))
+      flag_col = np.empty(n, dtype=np.uint16) if qc.flags else None
+      code_cols = [np.empty(n, dtype=Query.code_dtype(len(value_index[k])//2)) for k in Query.code_keys]
+   
+      def fill(group):
+         for i in group:
+            ts, v, flags, codes = parts[i]
+            pos, end = starts[i], ends[i]
+            st[pos:end] = ts[:,0]
+            ed[pos:end] = ts[:,1]
+            val[pos:end] = v[:,0]
+            if flag_col is not None:
+               flag_col[pos:end] = flags
+            for col, code in zip(code_cols, codes):
+               col[pos:end] = code
+      
+      for _ in run_threads_iter(fill, Query.__groups(ends, workers), workers):
+         pass
+   
+      columns = {"st": st, "ed": ed, "val": val}
+      if flag_col is not None:
+         columns["qc"] = flag_col
+      columns.update(zip(Query.code_keys, code_cols))
+      return columns
+   
+   @staticmethod
+   def __groups(ends, workers):
+      """runs of consecutive parts with about the same number of rows, a few for each thread"""
+      num = 1 if workers==1 else 4*(workers or thread_count())
+      # the part where each run starts, by cumulative rows
+      cuts = np.searchsorted(ends, np.arange(1, num)*ends[-1]/num, side="right")
+      bounds = np.unique(np.r_[0, cuts, len(ends)])
+      return [range(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+   
+   @staticmethod
+   def columns_to_df(columns, use_number_index, value_index):
+      """dataframe of output columns, codes are converted to categorical names if required"""
+      if not use_number_index:
+         columns = dict(columns)
+         for k in Query.code_keys:
+            columns[k] = pd.Categorical.from_codes(columns[k], categories=Query.categories(value_index, k))
+      return pd.DataFrame(columns, copy=False)
+   
+   @staticmethod
+   def categories(value_index, attr):
+      """names of one coded attribute, ordered by their numbers
+
+      Args:
+          value_index (dict): value index
+          attr (str): "site", "component", "unit", "matrix", ...
+
+      Returns:
+          list: names, the position of each name is its number
+      """
+      codes = value_index[attr]
+      return [codes[i] for i in range(len(codes)//2)]
+   
+   @staticmethod
+   def code_dtype(num):
+      """smallest integer type which can hold the numbers of num values"""
+      for dtype in [np.int8, np.int16, np.int32]:
+         if num<=np.iinfo(dtype).max:
+            return dtype
+      return np.int64
@@ -0,0 +1,118 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+# condition keys compared as times
+TIME_KEYS = ["st", "ed"]
+# condition keys whose values are ordered, eg. "bbox": (lat_min, lat_max, lon_min, lon_max)
+ORDERED_KEYS = ["bbox", "radius", "nearest"]
+
+def canonical_value(value, time=False):
+   """hashable form of one condition value
+
+   Lists are treated as sets since selectors match any of the values, tuples keep their order,
+   and times are compared as datetime64[ns], so "2000-01-01" and np.datetime64("2000-01-01") are the same.
+   """
+   if isinstance(value, (list, set, frozenset, np.ndarray)):
+      return tuple(sorted(set(canonical_value(v, time) for v in value), key=repr))
+   if isinstance(value, tuple):
+      return tuple(canonical_value(v, time) for v in value)
+   if time:
+      return int(np.datetime64(value, "ns").astype(np.int64))
+   if isinstance(value, np.generic):
+      return value.item()
+   return value
+
+def canonical_query(condition, **options):
+   """immutable cache key of a query
+
+   Args:
+       condition (dict): query condition, see EbasDB.query
+       **options: other arguments changing the result, eg. use_number_indexing
+
+   Returns:
+       tuple: sorted (key, value) pairs of condition and options
+   """
+   res = tuple(sorted((k, canonical_value(tuple(v) if k in ORDERED_KEYS else v, k in TIME_KEYS))
+                      for k, v in condition.items()))
+   opts = tuple(sorted((k, canonical_value(v)) for k, v in options.items()))
+   return (res, opts)
+
+def df_nbytes(df):
+   """memory used by a query result"""
+   if df is None:
+      return 0
+   return int(df.memory_usage(index=True).sum())
+
+
+class QueryCache:
+   def __init__(self, max_items=128, max_bytes=None):
+      """LRU cache of query results
+
+      Args:
+          max_items (int, optional): number of cached results, 0 disables the cache. Defaults to 128.
+          max_bytes (int, optional): memory budget of the cached dataframes in bytes.
+                                     None means no limit. Defaults to None.
+      """
+      self.max_items = max_items
+      self.max_bytes = max_bytes
+      self.nbytes = 0
+      self.hits = 0
+      self.misses = 0
+      self.__results = OrderedDict()
+      self.__sizes = {}
+      # queries can be answered by several threads, see EbasServer
+      self.__lock = threading.Lock()
+
+   def get(self, key):
+      """cached result of key
+
+      Returns:
+          tuple: (found, dataframe), the dataframe is a copy, so callers can modify it
+      """
+      with self.__lock:
+         if key not in self.__results:
+            self.misses += 1
+            return False, None
+         self.hits += 1
+         self.__results.move_to_end(key)
+         df = self.__results[key]
+      return True, None if df is None else df.copy()
+
+   def put(self, key, df):
+      """cache a copy of the result"""
+      if self.max_items is not None and self.max_items<=0:
+         return
+      size = df_nbytes(df)
+      if self.max_bytes is not None and size>self.max_bytes:
+         # never fits in the budget
+         return
+      df = None if df is None else df.copy()
+      with self.__lock:
+         if key in self.__results:
+            self.nbytes -= self.__sizes[key]
+         self.__results[key] = df
+         self.__results.move_to_end(key)
+         self.__sizes[key] = size
+         self.nbytes += size
+         self.__evict()
+
+   def __contains__(self, key):
+      return key in self.__results
+
+   def __len__(self):
+      return len(self.__results)
+
+   def clear(self):
+      with self.__lock:
+         self.__results.clear()
+         self.__sizes.clear()
+         self.nbytes = 0
+
+   def __evict(self):
+      while len(self.__results)>0 and (
+            (self.max_items is not None and len(self.__results)>self.max_items) or
+            (self.max_bytes is not None and self.nbytes>self.max_bytes)):
+         key, _ = self.__results.popitem(last=False)
+         self.nbytes -= self.__sizes.pop(key)
@@ -0,0 +1,161 @@
+import numpy as np
+from .query import *
+
+# rollup resolutions, periods are calendar days, months and years
+RESOLUTIONS = ["D", "M", "Y"]
+# statistics of each period, mean is sum/count
+STATS = ["count", "sum", "min", "max"]
+
+
+def check_resolution(resolution):
+   if resolution not in RESOLUTIONS:
+      raise ValueError(f"Unknown resolution: {resolution}, use one of {RESOLUTIONS}")
+   return resolution
+
+def build_rollup(st, val, resolution):
+   """statistics of valid values in each period, samples belong to the period of their starting time
+
+   Args:
+       st (ndarray): (n,) starting time
+       val (ndarray): (n,) values, nan values are skipped
+       resolution (str): "D", "M" or "Y"
+
+   Returns:
+       dict: {"start": datetime64 period start, "count", "sum", "min", "max"}, periods without valid values are left out
+   """
+   valid = ~np.isnan(val) & ~np.isnat(st)
+   period = st[valid].astype(f"datetime64[{resolution}]")
+   val = val[valid]
+   if len(period)>1 and np.any(period[1:]<period[:-1]):
+      order = np.argsort(period, kind="stable")
+      period, val = period[order], val[order]
+   first = np.flatnonzero(np.r_[True, period[1:]!=period[:-1]]) if len(period)>0 else np.empty(0, dtype=np.int64)
+   if len(first)==0:
+      return {"start": period, "count": np.empty(0, dtype=np.int32), "sum": np.empty(0),
+              "min": np.empty(0, dtype=val.dtype), "max": np.empty(0, dtype=val.dtype)}
+   return {"start": period[first],
+           "count": np.diff(np.r_[first, len(val)]).astype(np.int32),
+           "sum": np.add.reduceat(val.astype(np.float64), first),
+           "min": np.minimum.reduceat(val, first),
+           "max": np.maximum.reduceat(val, first)}
+
+def build_rollups(ts, val, flags, qc, resolutions=RESOLUTIONS):
+   """rollups of one series at import
+
+   Args:
+       ts (ndarray): (n, 2) starting and ending time
+       val (ndarray): (n, 1) values
+       flags (ndarray): (n, k) qc flags
+       qc (QCPolicy): policy applied before aggregating
+       resolutions (list, optional): resolutions to build. Defaults to RESOLUTIONS.
+
+   Returns:
+       dict: {"bad": bad flags of qc, resolution: result of build_rollup}
+   """
+   val = qc.apply(val, flags)[:,0]
+   res = {"bad": tuple(qc.bad)}
+   for resolution in resolutions:
+      res[check_resolution(resolution)] = build_rollup(ts[:,0], val, resolution)
+   return res
+
+def period_end(start, resolution):
+   """ending time of periods, the start of the next period"""
+   return (start+np.timedelta64(1, resolution)).astype("datetime64[ns]")
+
+def select_periods(rollup, resolution, time_selector):
+   """periods lying within the time range
+
+   Returns:
+       ndarray: boolean mask of the periods
+   """
+   start = rollup["start"]
+   index = np.ones(len(start), dtype=bool)
+   if "st" in time_selector.keys():
+      index &= start.astype("datetime64[ns]")>=np.datetime64(time_selector["st"], "ns")
+   if "ed" in time_selector.keys():
+      index &= period_end(start, resolution)<=np.datetime64(time_selector["ed"], "ns")
+   return index
+
+def stored_rollup(series, resolution, qc):
+   """rollup stored with the series if it was built with the same qc policy, otherwise None"""
+   rollup = series.get("rollup")
+   if rollup is None or resolution not in rollup or qc.keep or tuple(rollup["bad"])!=tuple(qc.bad):
+      return None
+   return rollup[resolution]
+
+def rollup_parts(site_data, site_id, content_ids, db_index, time_selector, value_index, qc, resolution):
+   """period statistics of the selected series of one site
+
+   Stored rollups are used if they were built with the same qc policy, others are computed from the rows.
+
+   Returns:
+       list: [(start, end, stats, (site, component, unit, matrix))], stats is {"count", "sum", "min", "max"}
+   """
+   parts = []
+   # the qc column is not needed
+   rows_qc = QCPolicy(qc.bad, keep=qc.keep)
+   # rows of every period touching the time range, periods are cut by select_periods
+   selector = {}
+   if "st" in time_selector.keys():
+      selector["st"] = np.datetime64(time_selector["st"]).astype(f"datetime64[{resolution}]").astype("datetime64[ns]")
+   shard_selector = dict(time_selector, **selector)
+   for file in content_ids:
+      header = db_index[site_id][file]
+      codes = (value_index["site"][site_id], header["component"], header["unit"], header["matrix"])
+      # periods never cross shards, so each stored part is rolled up alone
+      for series in Query.series_segments(site_data, file, shard_selector):
+         rollup = stored_rollup(series, resolution, qc)
+         if rollup is None:
+            add_count("rollups_computed")
+            ts, val, _ = Query.series_rows(series, header, selector, rows_qc)
+            rollup = build_rollup(ts[:,0], val[:,0], resolution)
+         index = select_periods(rollup, resolution, time_selector)
+         start = rollup["start"][index]
+         stats = {k: rollup[k][index] for k in STATS}
+         parts.append((start, period_end(start, resolution), stats, codes))
+   return parts
+
+def rollup_columns(parts, value_index):
+   """output columns of rollup parts, same layout as Query.parts_to_columns
+
+   Returns:
+       dict: {"st", "ed", "val" (mean), "count", "sum", "min", "max", "site", "component", "unit", "matrix"}
+   """
+   columns = {"st": np.concatenate([p[0].astype("datetime64[ns]") for p in parts]),
+              "ed": np.concatenate([p[1] for p in parts])}
+   stats = {k: np.concatenate([p[2][k] for p in parts]) for k in STATS}
+   columns["val"] = stats["sum"]/np.maximum(stats["count"], 1)
+   columns.update(stats)
+   lengths = [len(p[0]) for p in parts]
+   for i, k in enumerate(Query.code_keys):
+      columns[k] = np.repeat(np.array([p[3][i] for p in parts], dtype=Query.code_dtype(len(value_index[k])//2)), lengths)
+   return columns
+
+def get_rollup_df(db, db_index, query_res, use_number_index, value_index, qc, resolution):
+   """gather period statistics of the selected series into one dataframe
+
+   Args:
+       db (dict): {site_id: site data}, or SiteCache in lazy mode
+       db_index (dict): {site_id: content_index}
+       query_res (tuple): result of Query.query
+       use_number_index (bool): whether site, component, unit and matrix are numbers or categorical names
+       value_index (dict): value index
+       qc (QCPolicy): qc policy, the flags option is ignored
+       resolution (str): "D", "M" or "Y"
+
+   Returns:
+       pandas.DataFrame: columns are st, ed, val (mean), count, sum, min, max, site, component, unit, matrix.
+                         Only periods within the time range are included. None if nothing is selected.
+   """
+   check_resolution(resolution)
+   with span("get_rollup_df", resolution=resolution):
+      selected, time_selector = query_res
+      parts = []
+      for site_id in progress(selected.keys()):
+         parts.extend(rollup_parts(db[site_id], site_id, selected[site_id], db_index, time_selector, value_index, qc, resolution))
+      add_count("series_selected", len(parts))
+      if len(parts)==0:
+         return None
+      columns = rollup_columns(parts, value_index)
+      add_count("rows_returned", len(columns["val"]))
+      return Query.columns_to_df(columns, use_number_index, value_index)
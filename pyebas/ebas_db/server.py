@@ -0,0 +1,230 @@
+import io
+import json
+import threading
+import urllib.request
+import urllib.error
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .query import *
+from .query_cache import TIME_KEYS
+
+DEFAULT_PORT = 8765
+
+
+class EbasServerError(Exception):
+   pass
+
+
+def encode_condition(condition):
+   """json form of a query condition, times are sent as strings"""
+   res = {}
+   for k, v in condition.items():
+      if k in TIME_KEYS:
+         res[k] = str(np.datetime64(v))
+      elif isinstance(v, (list, tuple, set, np.ndarray)):
+         res[k] = [x.item() if isinstance(x, np.generic) else x for x in v]
+      else:
+         res[k] = v
+   return res
+
+def decode_condition(condition):
+   """query condition from its json form"""
+   res = dict(condition)
+   for k in TIME_KEYS:
+      if k in res.keys():
+         res[k] = np.datetime64(res[k])
+   return res
+
+def encode_qc(qc):
+   """json form of the qc argument of EbasDB.query"""
+   if isinstance(qc, QCPolicy):
+      return {"bad": qc.bad, "keep": qc.keep, "flags": qc.flags}
+   if qc is None or isinstance(qc, str):
+      return qc
+   return [int(f) for f in qc]
+
+def decode_qc(qc):
+   if isinstance(qc, dict):
+      return QCPolicy(**qc)
+   return qc
+
+def json_default(value):
+   """json form of numpy numbers, times and other values"""
+   if isinstance(value, np.generic) and not isinstance(value, (np.datetime64, np.timedelta64)):
+      return value.item()
+   return str(value)
+
+def df_to_bytes(df, value_index=None):
+   """binary form of a query result, a .npz archive without pickled objects
+
+   Args:
+       df (pandas.DataFrame): query result with number indexing
+       value_index (dict, optional): value index, names of coded columns are added if given. Defaults to None.
+
+   Returns:
+       bytes: npz archive
+   """
+   arrays = {"__columns__": np.array(list(df.columns), dtype=str)}
+   for k in df.columns:
+      arrays[k] = df[k].to_numpy()
+   if value_index is not None:
+      for k in Query.code_keys:
+         arrays[f"{k}.categories"] = np.array(Query.categories(value_index, k), dtype=str)
+   buffer = io.BytesIO()
+   np.savez(buffer, **arrays)
+   return buffer.getvalue()
+
+def bytes_to_df(data):
+   """query result from df_to_bytes, coded columns are categorical if names are included"""
+   with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+      columns = {}
+      # names are read as numpy strings
+      for k in [str(c) for c in arrays["__columns__"]]:
+         columns[k] = arrays[k]
+         if f"{k}.categories" in arrays.files:
+            columns[k] = pd.Categorical.from_codes(columns[k], categories=arrays[f"{k}.categories"].tolist())
+   return pd.DataFrame(columns, copy=False)
+
+
+class EbasServer:
+   def __init__(self, db, host="127.0.0.1", port=DEFAULT_PORT):
+      """local http server answering queries with a loaded database
+
+      Requests:
+         POST /query {"condition": {}, "use_number_indexing": bool, "qc": qc policy, "resolution": str}, returns npz archive (see df_to_bytes),
+                     or no content if nothing is selected
+         POST /list_sites {"keys": [], "list_time": bool}, returns json
+         GET /ping
+
+      Args:
+          db (EbasDB): database, init_db is called if it is not loaded
+          host (str, optional): host name, the server should not be exposed to other machines. Defaults to "127.0.0.1".
+          port (int, optional): port. Defaults to 8765.
+      """
+      if db.site_index is None:
+         db.init_db()
+      self.db = db
+      self.httpd = ThreadingHTTPServer((host, port), self.__handler())
+      self.httpd.daemon_threads = True
+      self.address = self.httpd.server_address
+
+   def serve_forever(self):
+      self.httpd.serve_forever()
+
+   def start(self):
+      """serve in a background thread
+
+      Returns:
+          threading.Thread: server thread
+      """
+      thread = threading.Thread(target=self.serve_forever, daemon=True)
+      thread.start()
+      return thread
+
+   def shutdown(self):
+      self.httpd.shutdown()
+      self.httpd.server_close()
+
+   def query(self, request):
+      condition = decode_condition(request.get("condition", {}))
+      use_number_indexing = request.get("use_number_indexing", True)
+      df = self.db.query(condition, use_number_indexing=True, qc=decode_qc(request.get("qc")),
+                         resolution=request.get("resolution"))
+      if df is None:
+         return None
+      return df_to_bytes(df, None if use_number_indexing else self.db.value_index)
+
+   def list_sites(self, request):
+      sites = self.db.list_sites(request.get("keys"), request.get("list_time", False))
+      return json.dumps(sites, default=json_default).encode()
+
+   def __handler(self):
+      server = self
+
+      class Handler(BaseHTTPRequestHandler):
+         def do_GET(self):
+            if self.path=="/ping":
+               self.__send(200, b"{}", "application/json")
+            else:
+               self.__send(404, json.dumps({"error": f"Unknown path: {self.path}"}).encode(), "application/json")
+
+         def do_POST(self):
+            try:
+               length = int(self.headers.get("Content-Length", 0))
+               request = json.loads(self.rfile.read(length) or b"{}")
+               if self.path=="/query":
+                  res = server.query(request)
+                  if res is None:
+                     self.__send(204, b"", "application/octet-stream")
+                  else:
+                     self.__send(200, res, "application/octet-stream")
+               elif self.path=="/list_sites":
+                  self.__send(200, server.list_sites(request), "application/json")
+               else:
+                  self.__send(404, json.dumps({"error": f"Unknown path: {self.path}"}).encode(), "application/json")
+            except Exception as e:
+               self.__send(400, json.dumps({"error": str(e)}).encode(), "application/json")
+
+         def __send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+         def log_message(self, format, *args):
+            # requests are not printed
+            pass
+
+      return Handler
+
+
+class EbasClient:
+   def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=600):
+      """client of EbasServer, with the same query and list_sites methods as EbasDB
+
+      Args:
+          host (str, optional): server host. Defaults to "127.0.0.1".
+          port (int, optional): server port. Defaults to 8765.
+          timeout (float, optional): request timeout in seconds. Defaults to 600.
+      """
+      self.url = f"http://{host}:{port}"
+      self.timeout = timeout
+
+   def ping(self):
+      """whether the server is running"""
+      try:
+         with urllib.request.urlopen(self.url+"/ping", timeout=5) as res:
+            return res.status==200
+      except (urllib.error.URLError, OSError):
+         return False
+
+   def query(self, query_dict, use_number_indexing=True, qc=None, resolution=None):
+      """see EbasDB.query"""
+      body = {"condition": encode_condition(query_dict),
+              "use_number_indexing": use_number_indexing,
+              "qc": encode_qc(qc),
+              "resolution": resolution}
+      status, data = self.__post("/query", body)
+      if status==204:
+         return None
+      return bytes_to_df(data)
+
+   def list_sites(self, keys=None, list_time=False):
+      """see EbasDB.list_sites, values are converted to json types"""
+      _, data = self.__post("/list_sites", {"keys": keys, "list_time": list_time})
+      return json.loads(data)
+
+   def __post(self, path, body):
+      request = urllib.request.Request(self.url+path, data=json.dumps(body).encode(),
+                                       headers={"Content-Type": "application/json"})
+      try:
+         with urllib.request.urlopen(request, timeout=self.timeout) as res:
+            return res.status, res.read()
+      except urllib.error.HTTPError as e:
+         try:
+            message = json.loads(e.read())["error"]
+         except Exception:
+            message = str(e)
+         raise EbasServerError(message) from None
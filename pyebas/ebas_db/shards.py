@@ -0,0 +1,169 @@
+import os
+import re
+import numpy as np
+from .files_io import *
+from .site_cache import *
+
+# length of shards in years
+SHARD_PERIODS = {"year": 1, "decade": 10}
+# key of samples without starting time
+NAT_KEY = "nat"
+
+
+def check_period(period):
+   if period not in SHARD_PERIODS:
+      raise ValueError(f"Unknown shard period: {period}, use one of {list(SHARD_PERIODS.keys())}")
+   return period
+
+def shard_name(site_id, key):
+   """name of the dump of one shard, eg. "ES0010R.2019", used in place of site id in dump paths"""
+   return f"{site_id}.{key}"
+
+def shard_order(key):
+   """sort key of shard keys, shards without time come last"""
+   return (key==NAT_KEY, int(key) if key!=NAT_KEY else 0)
+
+def row_shards(st, period):
+   """shard key of each sample, the first year of its period
+
+   Args:
+       st (ndarray): (n,) starting time
+       period (str): "year" or "decade"
+
+   Returns:
+       tuple: (keys, inverse), keys are sorted shard keys, keys[inverse] is the key of each sample
+   """
+   length = SHARD_PERIODS[check_period(period)]
+   nat = np.isnat(st)
+   years = st.astype("datetime64[Y]").astype(np.int64)+1970
+   years = years//length*length
+   codes = np.where(nat, np.iinfo(np.int64).max, years)
+   values, inverse = np.unique(codes, return_inverse=True)
+   keys = [NAT_KEY if v==np.iinfo(np.int64).max else str(v) for v in values]
+   return keys, inverse.reshape(-1)
+
+def shard_range(ts):
+   """(first starting time, last ending time) of samples, None if there is no time"""
+   if ts.shape[0]==0 or np.isnat(ts).all():
+      return None
+   return (np.nanmin(ts[:,0]), np.nanmax(ts[:,1]))
+
+def shard_overlaps(time_range, time_selector):
+   """whether a shard can have samples within the time range, see Query.time_index"""
+   if len(time_selector)==0:
+      return True
+   if time_range is None:
+      return False
+   st, ed = time_range
+   if "st" in time_selector.keys() and ed<time_selector["st"]:
+      return False
+   if "ed" in time_selector.keys() and st>time_selector["ed"]:
+      return False
+   return True
+
+def remove_site_shards(dump_dir, site_id, dump):
+   """delete all shard dumps of one site"""
+   if not os.path.isdir(dump_dir):
+      return
+   pattern = re.compile(re.escape(site_id)+r"\.(\d+|"+NAT_KEY+r")(\.\w+)?$")
+   for name in os.listdir(dump_dir):
+      match = pattern.match(name)
+      if match:
+         remove_site_dump(dump_dir, shard_name(site_id, match.group(1)), dump)
+
+
+class ShardedSite:
+   def __init__(self, site_id, shards, load_shard):
+      """data of one site stored in time shards, shards are loaded when their series are read
+
+      Each shard is loaded at most once by one ShardedSite, queries use one ShardedSite per selected site.
+
+      Args:
+          site_id (str): site id
+          shards (dict): {key: {content_id: (starting time, ending time)}}, from the shard index
+          load_shard (function): load_shard(site_id, key) returns the data of one shard
+      """
+      self.site_id = site_id
+      self.shards = shards
+      self.load_shard = load_shard
+      self.order = sorted(shards.keys(), key=shard_order)
+      # shards read through this object are kept until it is released, 
+      # so series of the same shard don't load it again when the cache is smaller than the site
+      self.loaded = {}
+
+   def segments(self, content_id, time_selector=None):
+      """parts of one series in the shards overlapping the time range, in time order
+
+      Args:
+          content_id (int): content id
+          time_selector (dict, optional): {"st": starting time, "ed": ending time}. Defaults to None, all shards.
+
+      Returns:
+          list: [series], same dicts as in site dumps
+      """
+      time_selector = {} if time_selector is None else time_selector
+      keys = [k for k in self.order if content_id in self.shards[k]]
+      used = [k for k in keys if shard_overlaps(self.shards[k][content_id], time_selector)]
+      add_count("shards_read", len(used))
+      add_count("shards_skipped", len(keys)-len(used))
+      return [self.__shard(k)[content_id] for k in used]
+
+   def __getitem__(self, content_id):
+      return self.segments(content_id)
+
+   def __contains__(self, content_id):
+      return any(content_id in s for s in self.shards.values())
+
+   def keys(self):
+      return sorted(set(c for s in self.shards.values() for c in s))
+
+   def __shard(self, key):
+      if key not in self.loaded:
+         self.loaded[key] = self.load_shard(self.site_id, key)
+      return self.loaded[key]
+
+
+class ShardedDB:
+   def __init__(self, sites, load_shard, data=None):
+      """site data of a sharded database, in place of EbasDB.db
+
+      Args:
+          sites (dict): {site_id: {key: {content_id: (starting time, ending time)}}}, the shard index
+          load_shard (function): load_shard(name) returns the data of one shard, see shard_name
+          data (dict or SiteCache, optional): loaded shards by name. Defaults to None, shards are loaded on access
+                                              and kept in a SiteCache without memory limit.
+      """
+      self.sites = sites
+      self.loader = load_shard
+      self.data = SiteCache(load_shard) if data is None else data
+
+   def __getitem__(self, site_id):
+      return ShardedSite(site_id, self.sites[site_id], self.__shard)
+
+   def __contains__(self, site_id):
+      return site_id in self.sites
+
+   def __len__(self):
+      return len(self.sites)
+
+   def keys(self):
+      return self.sites.keys()
+
+   def refresh(self, sites, site_ids):
+      """use a new shard index after site_ids are imported again, their loaded shards are outdated"""
+      self.sites = sites
+      if isinstance(self.data, SiteCache):
+         self.data.clear()
+         return
+      for name in list(self.data.keys()):
+         if name.rsplit(".", 1)[0] in site_ids:
+            self.data.pop(name)
+      for site_id in site_ids:
+         for key in self.sites.get(site_id, {}).keys():
+            self.data[shard_name(site_id, key)] = self.loader(shard_name(site_id, key))
+
+   def __shard(self, site_id, key):
+      name = shard_name(site_id, key)
+      if not isinstance(self.data, SiteCache) and name not in self.data:
+         self.data[name] = self.loader(name)
+      return self.data[name]
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def data_nbytes(data):
+   """estimate the memory used by the arrays of one site
+
+   Args:
+       data (dict): site data, nested dicts/lists of numpy arrays
+
+   Returns:
+       int: number of bytes held by the arrays
+   """
+   if isinstance(data, np.memmap):
+      # memory-mapped arrays are paged in and out by the system
+      return 0
+   if isinstance(data, np.ndarray):
+      return data.nbytes
+   if isinstance(data, dict):
+      return sum(data_nbytes(v) for v in data.values())
+   if isinstance(data, (list, tuple)):
+      return sum(data_nbytes(v) for v in data)
+   return 0
+
+
+class SiteCache:
+   def __init__(self, loader, max_bytes=None):
+      """LRU cache of site data, sites are loaded on first access
+
+      Args:
+          loader (function): loader(site_id) returns the data of one site, same as EbasDB.db[site_id]
+          max_bytes (int, optional): memory budget of the cached arrays in bytes.
+                                     None means no limit. Defaults to None.
+      """
+      self.loader = loader
+      self.max_bytes = max_bytes
+      self.nbytes = 0
+      self.__sites = OrderedDict()
+      self.__sizes = {}
+      # queries can be answered by several threads, see EbasServer
+      self.__lock = threading.RLock()
+
+   def __getitem__(self, site_id):
+      with self.__lock:
+         if site_id in self.__sites:
+            self.__sites.move_to_end(site_id)
+            return self.__sites[site_id]
+
+         data = self.loader(site_id)
+         self.__sites[site_id] = data
+         self.__sizes[site_id] = data_nbytes(data)
+         self.nbytes += self.__sizes[site_id]
+         self.__evict()
+         return data
+
+   def __contains__(self, site_id):
+      return site_id in self.__sites
+
+   def __len__(self):
+      return len(self.__sites)
+
+   def keys(self):
+      return self.__sites.keys()
+
+   def clear(self):
+      with self.__lock:
+         self.__sites.clear()
+         self.__sizes.clear()
+         self.nbytes = 0
+
+   def __evict(self):
+      if self.max_bytes is None:
+         return
+      # the most recent site is always kept, even if it is larger than the budget
+      while self.nbytes > self.max_bytes and len(self.__sites) > 1:
+         site_id, _ = self.__sites.popitem(last=False)
+         self.nbytes -= self.__sizes.pop(site_id)
@@ -60,13 +60,17 @@ class SiteIndex():
       super(SiteIndex, self).__init__()
    
    def create_site_index(self):
-      print("Gathering site information...")
+      echo("Gathering site information...")
       # filter out non ".nc" files
       raw_data = os.listdir(self.raw_dir)
       files = list(filter(lambda x: x.endswith('nc'), raw_data))
-      self.site_index = run_mp(self.get_file_indexing, files, self.combine_file_index)
+      # module-level function, so the database object is not sent to workers
+      arg_list = [(self.raw_dir, f, self.detailed) for f in files]
+      with span("create_site_index", files=len(files)):
+         self.site_index = run_mp(index_file, arg_list, self.combine_file_index)
+         add_count("files_indexed", len(files))
       
-      print(f"Collected site number: {len(self.site_index.keys())}")
+      echo(f"Collected site number: {len(self.site_index.keys())}")
       # analysis bad files
       bad =[]
       for k in self.site_index.keys():
@@ -74,11 +78,11 @@ class SiteIndex():
             bad.append(k)
 
       if len(bad)>0:
-         print(f"Bad files :{len(bad)}")
+         echo(f"Bad files :{len(bad)}")
          for b in bad:
-            print(b)
+            echo(b)
       else:
-         print("No bad files were found.")
+         echo("No bad files were found.")
       
    def get_file_indexing(self, file_name):
       """gathering indexing information from one .nc file
@@ -89,124 +93,7 @@ class SiteIndex():
       Returns:
           dict: indexing information, similar as SiteIndex
       """
-      try:
-         # get site information
-         ebas = xr.open_dataset(os.path.join(self.raw_dir, file_name))
-         ebas_metadata = ebas.ebas_metadata
-         ebas_metadata = json.loads(ebas_metadata)
-            
-         site = {
-                "id": ebas_metadata["Station code"],
-                "name": ebas_metadata["Station name"],
-                "country": code2country(ebas_metadata["Station code"][0:2]),
-                "land_use":None,
-                "station_setting":None,
-                "alt":None,
-                "lat":None,
-                "lon":None,
-                "files":{},
-               #  "var_content":[]
-            }
-         try:
-            site["land_use"] = ebas_metadata["Station land use"]           
-         except:
-            pass
-         try:
-            site["station_setting"] = ebas_metadata["Station setting"]         
-         except:
-            pass
-         try:
-            site["alt"] = ebas_metadata["Station altitude"]                           
-         except:
-            pass
-         try:           
-            site["lat"] = ebas_metadata["Station latitude"]                           
-         except:
-            pass
-         try:            
-            site["lon"] = ebas_metadata["Station longitude"]               
-         except:
-            pass
-         
-         # get var content
-         vars = list(ebas.data_vars.keys())
-         vars = list(filter(lambda x: not x.endswith("_qc") and not x.endswith("_ebasmetadata"), vars))
-         vars.remove("time_bnds")
-         vars.remove("metadata_time_bnds")
-         
-         var_content = []
-         for v in vars:
-            temp = ebas[v+"_ebasmetadata"].data.tolist()[-1]
-            
-            while isinstance(temp, list):
-               temp = temp[-1]
-               
-            temp = json.loads(temp)
-            
-            if "Matrix" in temp.keys():
-               content ={
-                  "res_code": ebas_metadata["Resolution code"],
-                  "matrix": temp["Matrix"],
-                  "unit":temp["Unit"],
-                  "meta": "no_ebas", 
-                  
-                  "var":v,
-                  "site": ebas_metadata["Station code"],
-                  "stat": temp["Statistics"],
-                  "component":temp["Component"],
-                  "st":ebas["time_bnds"][0,0].values,
-                  "ed":ebas["time_bnds"][-1,1].values,
-               }
-            elif "ebas_matrix" in temp.keys():
-               content ={
-                  # "res": res_code_index[ebas_metadata["Resolution code"]],
-                  # "matrix": matrix_index[temp["ebas_matrix"]],
-                  # "unit":units_index[temp["ebas_unit"]],
-                  # "meta": meta_index["no_ebas"],
-                  
-                  "res_code": ebas_metadata["Resolution code"],
-                  "matrix": temp["ebas_matrix"],
-                  "unit":temp["ebas_unit"],
-                  "meta": "no_ebas",
-                  
-                  "var":v,
-                  "site": ebas_metadata["Station code"],
-                  "stat": temp["ebas_statistics"],
-                  "component":temp["ebas_component"],
-                  "st":ebas["time_bnds"][0,0].values,
-                  "ed":ebas["time_bnds"][-1,1].values,
-               }
-               
-            var_content.append(content)
-            
-         # get attr information
-         attr_content={}
-         if self.detailed:
-            attrs = ebas.attrs
-            attr_content ={}
-            for a in attrs:
-               temp = getattr(ebas,a)
-               if isinstance(temp, np.ndarray):
-                  temp= temp.tolist()
-               attr_content[a] = temp
-         
-         site["files"] = {file_name:{"contents": var_content, "detail_attrs": attr_content}}
-                       
-         return {site["id"]: site}
-      
-      except Exception as e:
-         print(e)
-         print(file_name)
-         return {file_name: {
-                "id": "",
-                "name": "",
-                "land_use": "",
-                "station_setting": "",
-                "lat": "",
-                "lon": "",
-                "alt": "",
-                "error":str(e),
-            }}
+      return index_file((self.raw_dir, file_name, self.detailed))
          
    def combine_file_index(self, list_dict_res):
       res = {}
@@ -236,4 +123,215 @@ class SiteIndex():
                else:
                   res[id]["matrix"][c["matrix"]].append(f)
                                
-      return res
\ No newline at end of file
+      return res
+   
+   def merge_file_index(self, site_index, list_dict_res):
+      """add indexing information of new files to site index
+
+      Args:
+          site_index (dict): site index
+          list_dict_res (list): results of get_file_indexing
+
+      Returns:
+          tuple: (site_index, merged site ids, bad file names)
+      """
+      bad = []
+      good = []
+      for d in list_dict_res:
+         id = list(d.keys())[0]
+         if "error" in d[id].keys():
+            bad.append(id)
+         else:
+            good.append(d)
+      
+      new = self.combine_file_index(good)
+      for id in new.keys():
+         if id not in site_index.keys():
+            site_index[id] = new[id]
+            continue
+         site_index[id]["file_num"] += new[id]["file_num"]
+         site_index[id]["files"].update(new[id]["files"])
+         for key in ["components", "matrix"]:
+            for name, files in new[id][key].items():
+               site_index[id][key].setdefault(name, []).extend(files)
+      
+      return site_index, set(new.keys()), bad
+   
+   def remove_file_index(self, site_index, files):
+      """remove files from site index, sites without files are removed
+
+      Args:
+          site_index (dict): site index
+          files (list): file names
+
+      Returns:
+          tuple: (site_index, ids of sites which had these files)
+      """
+      files = set(files)
+      touched = set()
+      for id in list(site_index.keys()):
+         removed = files & set(site_index[id]["files"].keys())
+         if len(removed)==0:
+            continue
+         touched.add(id)
+         for f in removed:
+            site_index[id]["files"].pop(f)
+         site_index[id]["file_num"] -= len(removed)
+         for key in ["components", "matrix"]:
+            for name in list(site_index[id][key].keys()):
+               left = [f for f in site_index[id][key][name] if f not in removed]
+               if len(left)>0:
+                  site_index[id][key][name] = left
+               else:
+                  site_index[id][key].pop(name)
+         
+         if len(site_index[id]["files"])==0:
+            site_index.pop(id)
+      
+      return site_index, touched
+
+def index_file(args):
+   """gathering indexing information from one .nc file
+
+   Args:
+       args (tuple): (raw data path, .nc file name, detailed)
+
+   Returns:
+       dict: indexing information, similar as SiteIndex
+   """
+   raw_dir, file_name, detailed = args
+   try:
+      with xr.open_dataset(os.path.join(raw_dir, file_name)) as ebas:
+         return index_dataset(ebas, file_name, detailed)
+   
+   except Exception as e:
+      echo(e)
+      echo(file_name)
+      return error_index(file_name, e)
+
+def index_dataset(ebas, file_name, detailed=True):
+   """gathering indexing information from one opened .nc file
+
+   Args:
+       ebas (xarray.Dataset): opened .nc file
+       file_name (str): .nc file name
+       detailed (bool, optional): whether save detail descriptions from .nc file. Defaults to True.
+
+   Returns:
+       dict: indexing information, similar as SiteIndex
+   """
+   # get site information
+   ebas_metadata = ebas.ebas_metadata
+   ebas_metadata = json.loads(ebas_metadata)
+      
+   site = {
+          "id": ebas_metadata["Station code"],
+          "name": ebas_metadata["Station name"],
+          "country": code2country(ebas_metadata["Station code"][0:2]),
+          "land_use":None,
+          "station_setting":None,
+          "alt":None,
+          "lat":None,
+          "lon":None,
+          "files":{},
+         #  "var_content":[]
+      }
+   try:
+      site["land_use"] = ebas_metadata["Station land use"]           
+   except:
+      pass
+   try:
+      site["station_setting"] = ebas_metadata["Station setting"]         
+   except:
+      pass
+   try:
+      site["alt"] = ebas_metadata["Station altitude"]                           
+   except:
+      pass
+   try:           
+      site["lat"] = ebas_metadata["Station latitude"]                           
+   except:
+      pass
+   try:            
+      site["lon"] = ebas_metadata["Station longitude"]               
+   except:
+      pass
+   
+   # get var content
+   vars = list(ebas.data_vars.keys())
+   vars = list(filter(lambda x: not x.endswith("_qc") and not x.endswith("_ebasmetadata"), vars))
+   vars.remove("time_bnds")
+   vars.remove("metadata_time_bnds")
+   
+   var_content = []
+   for v in vars:
+      temp = ebas[v+"_ebasmetadata"].data.tolist()[-1]
+      
+      while isinstance(temp, list):
+         temp = temp[-1]
+         
+      temp = json.loads(temp)
+      
+      if "Matrix" in temp.keys():
+         content ={
+            "res_code": ebas_metadata["Resolution code"],
+            "matrix": temp["Matrix"],
+            "unit":temp["Unit"],
+            "meta": "no_ebas", 
+            
+            "var":v,
+            "site": ebas_metadata["Station code"],
+            "stat": temp["Statistics"],
+            "component":temp["Component"],
+            "st":ebas["time_bnds"][0,0].values,
+            "ed":ebas["time_bnds"][-1,1].values,
+         }
+      elif "ebas_matrix" in temp.keys():
+         content ={
+            # "res": res_code_index[ebas_metadata["Resolution code"]],
+            # "matrix": matrix_index[temp["ebas_matrix"]],
+            # "unit":units_index[temp["ebas_unit"]],
+            # "meta": meta_index["no_ebas"],
+            
+            "res_code": ebas_metadata["Resolution code"],
+            "matrix": temp["ebas_matrix"],
+            "unit":temp["ebas_unit"],
+            "meta": "no_ebas",
+            
+            "var":v,
+            "site": ebas_metadata["Station code"],
+            "stat": temp["ebas_statistics"],
+            "component":temp["ebas_component"],
+            "st":ebas["time_bnds"][0,0].values,
+            "ed":ebas["time_bnds"][-1,1].values,
+         }
+         
+      var_content.append(content)
+      
+   # get attr information
+   attr_content={}
+   if detailed:
+      attrs = ebas.attrs
+      attr_content ={}
+      for a in attrs:
+         temp = getattr(ebas,a)
+         if isinstance(temp, np.ndarray):
+            temp= temp.tolist()
+         attr_content[a] = temp
+   
+   site["files"] = {file_name:{"contents": var_content, "detail_attrs": attr_content}}
+                 
+   return {site["id"]: site}
+
+def error_index(file_name, e):
+   """indexing information of a file which can't be indexed"""
+   return {file_name: {
+          "id": "",
+          "name": "",
+          "land_use": "",
+          "station_setting": "",
+          "lat": "",
+          "lon": "",
+          "alt": "",
+          "error":str(e),
+      }}
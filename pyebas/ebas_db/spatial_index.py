@@ -0,0 +1,141 @@
+import numpy as np
+
+
+def to_float(value):
+   """number from site metadata, eg. "100.0 m", nan if it is not a number"""
+   try:
+      return float(str(value).split()[0])
+   except (ValueError, IndexError):
+      return np.nan
+
+
+class SpatialIndex:
+   # mean earth radius in km
+   earth_radius = 6371.0088
+   # query conditions answered by the index, values are ordered tuples
+   spatial_keys = ["bbox", "radius", "nearest"]
+
+   def __init__(self, site_index, sites=None):
+      """station coordinates sorted by latitude, so bounding boxes and radius queries only look at one latitude band
+
+      Args:
+          site_index (dict): site index
+          sites (list, optional): site ids, sites are numbered in this order. Defaults to None, all sites of site_index.
+
+      Sites without valid lat/lon never match a spatial condition.
+      """
+      self.sites = list(site_index.keys()) if sites is None else list(sites)
+      self.lat = np.array([to_float(site_index[s]["lat"]) for s in self.sites], dtype=np.float64)
+      self.lon = np.array([to_float(site_index[s]["lon"]) for s in self.sites], dtype=np.float64)
+      self.alt = np.array([to_float(site_index[s]["alt"]) for s in self.sites], dtype=np.float64)
+      valid = np.flatnonzero(~np.isnan(self.lat) & ~np.isnan(self.lon))
+      # site numbers with valid coordinates, ordered by latitude
+      self.order = valid[np.argsort(self.lat[valid], kind="stable")]
+      self.sorted_lat = self.lat[self.order]
+
+   def __len__(self):
+      return len(self.sites)
+
+   def band(self, lat_min, lat_max):
+      """site numbers with latitude in [lat_min, lat_max], unsorted"""
+      i0 = np.searchsorted(self.sorted_lat, lat_min, side="left")
+      i1 = np.searchsorted(self.sorted_lat, lat_max, side="right")
+      return self.order[i0:i1]
+
+   def distance(self, lat, lon, index=None):
+      """great-circle (haversine) distance in km
+
+      Args:
+          lat (float): latitude in degrees
+          lon (float): longitude in degrees
+          index (ndarray, optional): site numbers. Defaults to None, all sites.
+
+      Returns:
+          ndarray: distance of each site, nan if the site has no coordinates
+      """
+      if index is None:
+         index = slice(None)
+      lat1, lon1 = np.radians(lat), np.radians(lon)
+      lat2, lon2 = np.radians(self.lat[index]), np.radians(self.lon[index])
+      a = np.sin((lat2-lat1)/2)**2+np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2)**2
+      return 2*self.earth_radius*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+   def bbox(self, lat_min, lat_max, lon_min, lon_max):
+      """sites within a latitude/longitude box, lon_min > lon_max means the box crosses 180°
+
+      Returns:
+          ndarray: sorted site numbers
+      """
+      index = self.band(lat_min, lat_max)
+      lon = self.lon[index]
+      if lon_min<=lon_max:
+         inside = (lon>=lon_min) & (lon<=lon_max)
+      else:
+         inside = (lon>=lon_min) | (lon<=lon_max)
+      return np.sort(index[inside])
+
+   def radius(self, lat, lon, km):
+      """sites within km of a point
+
+      Returns:
+          ndarray: sorted site numbers
+      """
+      # a circle never leaves the latitude band of its radius
+      dlat = np.degrees(km/self.earth_radius)
+      index = self.band(lat-dlat, lat+dlat)
+      return np.sort(index[self.distance(lat, lon, index)<=km])
+
+   def nearest(self, lat, lon, k, candidates=None):
+      """k sites closest to a point
+
+      Args:
+          lat (float): latitude in degrees
+          lon (float): longitude in degrees
+          k (int): number of sites
+          candidates (ndarray, optional): site numbers to choose from. Defaults to None, all sites.
+
+      Returns:
+          ndarray: site numbers ordered by distance, ties by site number
+      """
+      index = self.order if candidates is None else np.asarray(candidates, dtype=np.int64)
+      dist = self.distance(lat, lon, index)
+      valid = ~np.isnan(dist)
+      index, dist = index[valid], dist[valid]
+      k = int(k)
+      if k<len(index):
+         part = np.argpartition(dist, k-1)[:k] if k>0 else np.empty(0, dtype=np.int64)
+         index, dist = index[part], dist[part]
+      return index[np.lexsort((index, dist))]
+
+   def search(self, condition):
+      """sites matching the bbox and radius conditions
+
+      Args:
+          condition (dict): query condition, "bbox": (lat_min, lat_max, lon_min, lon_max), "radius": (lat, lon, km)
+
+      Returns:
+          ndarray: sorted site numbers, None if there are no such conditions
+      """
+      res = None
+      if "bbox" in condition.keys():
+         res = self.bbox(*self.__values("bbox", condition["bbox"], 4))
+      if "radius" in condition.keys():
+         sites = self.radius(*self.__values("radius", condition["radius"], 3))
+         res = sites if res is None else np.intersect1d(res, sites, assume_unique=True)
+      return res
+
+   def search_nearest(self, condition, candidates=None):
+      """sites of the "nearest": (lat, lon, k) condition, chosen from candidates
+
+      Returns:
+          ndarray: site numbers ordered by distance
+      """
+      lat, lon, k = self.__values("nearest", condition["nearest"], 3)
+      return self.nearest(lat, lon, k, candidates)
+
+   @staticmethod
+   def __values(key, values, num):
+      values = list(values)
+      if len(values)!=num:
+         raise ValueError(f"{key} needs {num} values, got {values}")
+      return [float(v) for v in values]
@@ -0,0 +1,167 @@
+import numpy as np
+
+# end bounds differing from the regular width, more than this share makes the series irregular
+MAX_EXCEPTIONS = 0.25
+
+
+def int_dtype(max_value):
+   """smallest of int32 and int64 holding max_value"""
+   return np.int32 if max_value < 2**31 else np.int64
+
+def encode_bounds(ts):
+   """compact form of the starting and ending time of one series
+
+   Regular series (constant step between starting times) are stored as
+   {"kind": "regular", "start", "step", "width", "count"} and the indexes and ending time of samples
+   with a different width ("exc_idx", "exc_ed", only if there are any).
+   Other series are stored as {"kind": "delta", "base", "unit", "offset", "width"},
+   offsets of starting time from base in int32/int64 units, and the width is one value or an array.
+   Series with missing time are kept as {"kind": "raw", "ts"}.
+
+   Args:
+       ts (ndarray): (n, 2) starting and ending time
+
+   Returns:
+       dict: encoded time bounds
+   """
+   if np.isnat(ts).any():
+      return {"kind": "raw", "ts": ts}
+   st = ts[:,0]
+   ed = ts[:,1]
+   n = st.shape[0]
+   width = ed-st
+   if n>1:
+      step = st[1]-st[0]
+      if step>np.timedelta64(0) and np.all(np.diff(st)==step):
+         # the most common width, others are exceptions
+         widths, counts = np.unique(width, return_counts=True)
+         regular_width = widths[np.argmax(counts)]
+         exc_idx = np.flatnonzero(width!=regular_width)
+         if len(exc_idx)<=MAX_EXCEPTIONS*n:
+            res = {"kind": "regular", "start": st[0], "step": step, "width": regular_width, "count": n}
+            if len(exc_idx)>0:
+               res["exc_idx"] = exc_idx.astype(int_dtype(n))
+               res["exc_ed"] = np.array(ed[exc_idx])
+            return res
+
+   # offsets in seconds if possible, EBAS time is rarely finer
+   base = st[0] if n>0 else np.datetime64(0, "ns")
+   offset = st-base
+   unit = "s" if np.all(offset%np.timedelta64(1, "s")==np.timedelta64(0)) and \
+                 np.all(width%np.timedelta64(1, "s")==np.timedelta64(0)) else "ns"
+   offset = offset//np.timedelta64(1, unit)
+   width = width//np.timedelta64(1, unit)
+   res = {"kind": "delta", "base": base, "unit": unit}
+   res["offset"] = offset.astype(int_dtype(offset.max() if n>0 else 0))
+   if n>0 and np.all(width==width[0]):
+      res["width"] = int(width[0])
+   else:
+      res["width"] = width.astype(int_dtype(np.abs(width).max() if n>0 else 0))
+   return res
+
+def bounds_length(time):
+   """number of samples of encoded time bounds"""
+   if time["kind"]=="regular":
+      return time["count"]
+   if time["kind"]=="raw":
+      return time["ts"].shape[0]
+   return time["offset"].shape[0]
+
+def decode_bounds(time, index=None):
+   """starting and ending time from encoded time bounds
+
+   Args:
+       time (dict): result of encode_bounds
+       index (slice or ndarray, optional): samples to decode. Defaults to None, all samples.
+
+   Returns:
+       ndarray: (m, 2) starting and ending time in column-major order
+   """
+   n = bounds_length(time)
+   if index is None:
+      index = slice(0, n)
+   if time["kind"]=="raw":
+      return time["ts"][index]
+
+   if time["kind"]=="regular":
+      pos = np.arange(n)[index]
+      st = time["start"]+pos*time["step"]
+      ed = st+time["width"]
+      if "exc_idx" in time:
+         # exceptions within the selected samples
+         exc = np.zeros(n, dtype=bool)
+         exc[time["exc_idx"]] = True
+         sel = exc[pos]
+         if sel.any():
+            ed_exc = np.empty(n, dtype=ed.dtype)
+            ed_exc[time["exc_idx"]] = time["exc_ed"]
+            ed[sel] = ed_exc[pos[sel]]
+   else:
+      unit = np.timedelta64(1, time["unit"])
+      st = time["base"]+time["offset"][index].astype(np.int64)*unit
+      width = time["width"]
+      width = width[index].astype(np.int64) if isinstance(width, np.ndarray) else width
+      ed = st+width*unit
+
+   ts = np.empty((st.shape[0], 2), dtype=st.dtype, order="F")
+   ts[:,0] = st
+   ts[:,1] = ed
+   return ts
+
+def bounds_index(ts, time_selector, sorted=False):
+   """select rows within the time range
+
+   Args:
+       ts (ndarray): (n, 2) starting and ending time
+       time_selector (dict): {"st": starting time, "ed": ending time}, both are optional
+       sorted (bool, optional): whether both columns of ts are in ascending order. Defaults to False.
+
+   Returns:
+       slice or ndarray: slice for sorted series (indexing returns views), otherwise boolean mask
+   """
+   if sorted:
+      i0, i1 = 0, ts.shape[0]
+      if "st" in time_selector.keys():
+         i0 = np.searchsorted(ts[:,0], time_selector["st"], side="left")
+      if "ed" in time_selector.keys():
+         i1 = np.searchsorted(ts[:,1], time_selector["ed"], side="right")
+      return slice(i0, max(i0, i1))
+
+   index = np.ones(ts.shape[0], dtype=bool)
+   if "st" in time_selector.keys():
+      index &= ts[:,0]>=time_selector["st"]
+   if "ed" in time_selector.keys():
+      index &= ts[:,1]<=time_selector["ed"]
+   return index
+
+def select_bounds(time, time_selector, sorted=False):
+   """select samples of encoded time bounds within the time range
+
+   Regular series without exceptions are selected with arithmetic, others are decoded first.
+
+   Args:
+       time (dict): result of encode_bounds
+       time_selector (dict): {"st": starting time, "ed": ending time}, both are optional
+       sorted (bool, optional): whether starting and ending time are in ascending order. Defaults to False.
+
+   Returns:
+       tuple: (index, ts), index is slice or boolean mask, ts is (m, 2) time bounds of the selected samples
+   """
+   if time["kind"]=="regular" and "exc_idx" not in time:
+      n = time["count"]
+      start, step = time["start"], time["step"]
+      i0, i1 = 0, n
+      if "st" in time_selector.keys():
+         # first sample with start+i*step >= st
+         i0 = -((start-np.datetime64(time_selector["st"]))//step)
+      if "ed" in time_selector.keys():
+         # last sample with start+i*step+width <= ed
+         i1 = (np.datetime64(time_selector["ed"])-start-time["width"])//step+1
+      i0 = int(min(max(i0, 0), n))
+      i1 = int(min(max(i1, 0), n))
+      index = slice(i0, max(i0, i1))
+      return index, decode_bounds(time, index)
+
+   ts = decode_bounds(time)
+   index = bounds_index(ts, time_selector, sorted)
+   return index, ts[index]
@@ -12,7 +12,7 @@ class ValueIndex:
       self.site={}
    
    def create_value_index(self, site_index):
-      print("creating value index...")
+      echo("creating value index...")
       matrix = Query.summary_attr(site_index, "matrix")
       unit = Query.summary_attr(site_index, "unit")
       res_code = Query.summary_attr(site_index, "res_code")
@@ -34,12 +34,15 @@ class ValueIndex:
          "meta": self.meta
       }
       
-   def update_site_index(self, site_index):
+   def update_site_index(self, site_index, files=None):
       """
       update site index with value index (convert string to number)
+      if files is given, only contents of these files are converted
       """
       for site in site_index.keys():
          for f in site_index[site]["files"].keys():
+            if files is not None and f not in files:
+               continue
             for index, content in enumerate(site_index[site]["files"][f]["contents"]):
                site_index[site]["files"][f]["contents"][index]["site"] = self.value2index("site", content["site"])
                site_index[site]["files"][f]["contents"][index]["matrix"] = self.value2index("matrix", content["matrix"])
@@ -50,6 +53,17 @@ class ValueIndex:
 
       return site_index
    
+   def encode_content_index(self, content_index):
+      """
+      copy of content index with names converted to numbers
+      """
+      res = {}
+      for id, content in content_index.items():
+         res[id] = dict(content)
+         for attr in ["component", "matrix", "res_code", "unit"]:
+            res[id][attr] = self.value2index(attr, content[attr])
+      return res
+   
    def update_value_index(self, attr_name, vals):
       temp = {}
       for index, val in enumerate(vals):
@@ -58,5 +72,19 @@ class ValueIndex:
       
       setattr(self, attr_name, temp)
       
+   def extend_value_index(self, attr_name, vals):
+      """
+      add new values to value index, numbers of existing values are not changed
+      """
+      temp = self.value_index[attr_name]
+      num = len(temp)//2
+      for val in vals:
+         if val not in temp.keys():
+            temp[num] = val
+            temp[val] = num
+            num += 1
+      
+      setattr(self, attr_name, temp)
+      
    def value2index(self, attr, val):
       return self.value_index[attr][val]
\ No newline at end of file
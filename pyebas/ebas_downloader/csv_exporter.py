@@ -1,10 +1,17 @@
 import os
+import io
+import gzip
 import xarray as xr
-from tqdm import tqdm
 import numpy as np
 import pandas as pd
 import time
 import json
+from ..utilities import *
+
+try:
+   import zstandard
+except ImportError:
+   zstandard = None
 
 class csvExporter:
    def __init__(self, loc=None):
@@ -17,90 +24,127 @@ class csvExporter:
          self.csv_loc = loc
       if not os.path.exists(self.loc):
          os.makedirs(self.loc)
-         print(f"Make data folder {self.loc}...") 
-         
-   def export_csv(self, file_name=None):
-      res = pd.DataFrame()
-      
+         echo(f"Make data folder {self.loc}...")
+
+   def export_csv(self, file_name=None, compression=None, num_cores=None):
+      """export all downloaded .nc files to one .csv file
+
+      Files are converted in a process pool and appended to the output one by one,
+      so memory use does not grow with the number of files.
+
+      Args:
+          file_name (str, optional): output file name. Defaults to None, "pyebas_<time>.csv".
+          compression (str, optional): None, 'gzip', or 'zstd' (requires zstandard). Defaults to None.
+          num_cores (int, optional): number of processes. Defaults to None, all cpu cores.
+      """
+      if compression not in [None, "gzip", "zstd"]:
+         raise ValueError(f"Unknown compression: {compression}")
+      if compression=="zstd" and zstandard is None:
+         raise ImportError("zstandard is required for zstd compression, use 'pip install zstandard'.")
+
       files = os.listdir(self.loc)
       nc_files = list(filter(lambda x: x.endswith("nc"), files))
-      for file in tqdm(nc_files, desc="Processing files..."):
-         ebas = xr.open_dataset(os.path.join(self.loc, file))
-         ebas_metadata = ebas.ebas_metadata
-         ebas_metadata = json.loads(ebas_metadata)
-         
-         # file time series
-         st = np.array(ebas["time_bnds"].data[:,0])
-         ed = np.array(ebas["time_bnds"].data[:,1])
-         
-         # file site information
-         site_id = ebas_metadata["Station code"]
-         # site_name = ebas_metadata["Station name"]
-         try:
-            alt = ebas_metadata["Station altitude"]                           
-         except:
-            alt = ""
-         try:           
-            lat = ebas_metadata["Station latitude"]                           
-         except:
-            lat = ""
-         try:            
-            lon = ebas_metadata["Station longitude"]               
-         except:
-            lon = ""      
-         
-         # file variable information
-         vars = list(ebas.data_vars.keys())
-         vars = list(filter(lambda x: not x.endswith("_qc") and not x.endswith("_ebasmetadata"), vars))
-         vars.remove("time_bnds")
-         vars.remove("metadata_time_bnds")   
-         for v in vars:
-            temp = ebas[v+"_ebasmetadata"].data.tolist()[-1]
-            while isinstance(temp, list):
-               temp = temp[-1]
-            temp = json.loads(temp)
-            
-            if "Matrix" in temp.keys():
-               matrix = temp["Matrix"],
-               unit = temp["Unit"],
-               stat = temp["Statistics"],
-               component = temp["Component"],
-            elif "ebas_matrix" in temp.keys():
-               matrix = temp["ebas_matrix"],
-               unit = temp["ebas_unit"],
-               stat = temp["ebas_statistics"],
-               component = temp["ebas_component"],
-            
-            # get var value and qc, the values can be updated for several times, so additional dimensions may be applied       
-            val = ebas[v].data
-            while len(val.shape)>1:
-               val = val[-1,:]  
-            qc = ebas[v+"_qc"].data
-            while len(qc.shape)>1:
-               qc = qc[-1,:]
-            
-            temp_pd = pd.DataFrame({"st":st, "ed":ed})
-            
-            temp_pd["site"] = site_id
-            # temp_pd["name"] = site_name
-            temp_pd["alt"] = alt
-            temp_pd["lat"] = lat
-            temp_pd["lon"] = lon
-            temp_pd["val"] = val
-            temp_pd["qc"] = qc
-            temp_pd["unit"] = unit[0]
-            temp_pd["matrix"] = matrix[0]
-            temp_pd["stat"] = stat[0]
-            temp_pd["component"] = component[0]    
-            
-            res = pd.concat([res,temp_pd], ignore_index= True)   
-            
-      print("Exporting...")
+      arg_list = [os.path.join(self.loc, f) for f in nc_files]
+
       if file_name is None:
          t= time.strftime("%Y%m%d%H%M")
          file_name = f"pyebas_{t}.csv"
+         if compression=="gzip":
+            file_name += ".gz"
+         elif compression=="zstd":
+            file_name += ".zst"
       out_file = os.path.join(self.csv_loc, file_name)
-      res.to_csv(out_file, index=False)
-      print(f"Data has been exported to {out_file}.")
-   
-   
\ No newline at end of file
+
+      echo("Processing files...")
+      header = True
+      with span("export_csv", files=len(arg_list)), open_csv(out_file, compression) as f:
+         for df in run_mp_iter(nc_to_df, arg_list, num_cores):
+            if df is None:
+               continue
+            df.to_csv(f, header=header, index=False)
+            add_count("rows_exported", len(df))
+            header = False
+      echo(f"Data has been exported to {out_file}.")
+
+def open_csv(out_file, compression=None):
+   """open a text stream for writing, compressed with 'gzip' or 'zstd' if required"""
+   if compression=="gzip":
+      return gzip.open(out_file, "wt", newline="")
+   if compression=="zstd":
+      writer = zstandard.ZstdCompressor(threads=-1).stream_writer(open(out_file, "wb"))
+      return io.TextIOWrapper(writer, newline="")
+   return open(out_file, "w", newline="")
+
+def nc_to_df(file_path):
+   """convert all variables of one .nc file to one dataframe
+
+   Args:
+       file_path (str): path to .nc file
+
+   Returns:
+       pandas.DataFrame: columns are st, ed, site, alt, lat, lon, val, qc, unit, matrix, stat, component.
+                         None if the file has no variables.
+   """
+   with xr.open_dataset(file_path) as ebas:
+      ebas_metadata = ebas.ebas_metadata
+      ebas_metadata = json.loads(ebas_metadata)
+
+      # file time series
+      st = np.array(ebas["time_bnds"].data[:,0])
+      ed = np.array(ebas["time_bnds"].data[:,1])
+
+      # file site information
+      site_id = ebas_metadata["Station code"]
+      alt = ebas_metadata.get("Station altitude", "")
+      lat = ebas_metadata.get("Station latitude", "")
+      lon = ebas_metadata.get("Station longitude", "")
+
+      # file variable information
+      vars = list(ebas.data_vars.keys())
+      vars = list(filter(lambda x: not x.endswith("_qc") and not x.endswith("_ebasmetadata"), vars))
+      vars.remove("time_bnds")
+      vars.remove("metadata_time_bnds")
+      res = []
+      for v in vars:
+         temp = ebas[v+"_ebasmetadata"].data.tolist()[-1]
+         while isinstance(temp, list):
+            temp = temp[-1]
+         temp = json.loads(temp)
+
+         if "Matrix" in temp.keys():
+            matrix = temp["Matrix"]
+            unit = temp["Unit"]
+            stat = temp["Statistics"]
+            component = temp["Component"]
+         elif "ebas_matrix" in temp.keys():
+            matrix = temp["ebas_matrix"]
+            unit = temp["ebas_unit"]
+            stat = temp["ebas_statistics"]
+            component = temp["ebas_component"]
+
+         # get var value and qc, the values can be updated for several times, so additional dimensions may be applied
+         val = ebas[v].data
+         while len(val.shape)>1:
+            val = val[-1,:]
+         qc = ebas[v+"_qc"].data
+         while len(qc.shape)>1:
+            qc = qc[-1,:]
+
+         res.append(pd.DataFrame({
+            "st": st,
+            "ed": ed,
+            "site": site_id,
+            "alt": alt,
+            "lat": lat,
+            "lon": lon,
+            "val": val,
+            "qc": qc,
+            "unit": unit,
+            "matrix": matrix,
+            "stat": stat,
+            "component": component,
+         }))
+
+   if len(res)==0:
+      return None
+   return pd.concat(res, ignore_index=True)
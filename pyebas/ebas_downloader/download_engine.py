@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import threading
+import concurrent.futures
+from ..utilities.instrument import *
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DownloadError(Exception):
+   pass
+
+class DownloadEngine:
+   # responses which are worth another try
+   retry_status = [408, 429, 500, 502, 503, 504]
+
+   def __init__(self, out_dir, max_workers=8, retries=3, backoff=1.0, timeout=60, chunk_size=1<<20):
+      """concurrent file downloader with keep-alive sessions, resume, and retry
+
+      Files are written to '<name>.part' and renamed when they are complete,
+      so a file in out_dir is never partial. An interrupted '.part' file is resumed with HTTP Range requests,
+      with the ETag or Last-Modified of the remote file in If-Range ('<name>.part.json'), 
+      so the download starts again if the remote file is changed.
+
+      Args:
+          out_dir (str): path to save files
+          max_workers (int, optional): number of concurrent downloads. Defaults to 8.
+          retries (int, optional): number of retries after the first attempt. Defaults to 3.
+          backoff (float, optional): seconds to wait before the first retry, doubled for each retry. Defaults to 1.0.
+          timeout (float, optional): connection and read timeout in seconds. Defaults to 60.
+          chunk_size (int, optional): bytes written at a time. Defaults to 1MB.
+      """
+      self.out_dir = out_dir
+      self.max_workers = max_workers
+      self.retries = retries
+      self.backoff = backoff
+      self.timeout = timeout
+      self.chunk_size = chunk_size
+      self.error_file = os.path.join(out_dir, "download_errors.json")
+      self.__local = threading.local()
+
+   def download(self, urls):
+      """download files
+
+      Args:
+          urls (list): file urls, files are saved with the last part of the url as name
+
+      Returns:
+          list: failed downloads, [{"url", "file", "error", "attempts", "time"}], also saved to download_errors.json
+      """
+      failures = []
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+         futures = {pool.submit(self.get_file, url): url for url in urls}
+         for future in progress(concurrent.futures.as_completed(futures), total=len(futures), desc="downloading..."):
+            error = future.exception()
+            if error is None:
+               # counted here, counters of worker threads are not added to the open spans
+               add_count("files_downloaded")
+               add_count("bytes_downloaded", os.path.getsize(future.result()))
+            else:
+               add_count("download_failures")
+               url = futures[future]
+               failures.append({
+                  "url": url,
+                  "file": url.split("/")[-1],
+                  "error": str(error),
+                  "attempts": getattr(error, "attempts", 1),
+                  "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+               })
+
+      with open(self.error_file, "w") as f:
+         json.dump(failures, f, indent=4)
+      return failures
+
+   def get_file(self, url):
+      """download one file, retry with exponential backoff
+
+      Args:
+          url (str): file url
+
+      Returns:
+          str: path to the downloaded file
+      """
+      for attempt in range(self.retries+1):
+         try:
+            return self.__get_file(url)
+         except (requests.RequestException, DownloadError) as e:
+            error = e
+            retry = not isinstance(e, DownloadError) or getattr(e, "retry", False)
+            if not retry or attempt==self.retries:
+               break
+            time.sleep(self.backoff*2**attempt)
+
+      error.attempts = attempt+1
+      raise error
+
+   def session(self):
+      """keep-alive session of the current thread"""
+      session = getattr(self.__local, "session", None)
+      if session is None:
+         session = requests.Session()
+         adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+         session.mount("http://", adapter)
+         session.mount("https://", adapter)
+         self.__local.session = session
+      return session
+
+   def __get_file(self, url):
+      name = url.split("/")[-1]
+      out_file = os.path.join(self.out_dir, name)
+      part_file = out_file+".part"
+      # validator of the remote file the partial file belongs to
+      meta_file = part_file+".json"
+
+      # resume from the bytes downloaded by previous attempts, only if the remote file is unchanged
+      headers = {}
+      offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+      validator = self.__load_validator(meta_file) if offset>0 else None
+      if validator is not None:
+         headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+
+      with self.session().get(url, headers=headers, stream=True, timeout=self.timeout) as res:
+         if res.status_code==416:
+            # the partial file is not valid for current remote file
+            self.__remove(part_file, meta_file)
+            error = DownloadError(f"Invalid range for {url}, restart download.")
+            error.retry = True
+            raise error
+         if res.status_code not in [200, 206]:
+            error = DownloadError(f"HTTP {res.status_code} for {url}")
+            error.retry = res.status_code in self.retry_status
+            raise error
+
+         mode = "ab"
+         if res.status_code==200:
+            # whole file, the remote file is changed or the server ignored the range request
+            mode, offset = "wb", 0
+            self.__save_validator(meta_file, res.headers)
+         expected = res.headers.get("Content-Length")
+         written = 0
+         with open(part_file, mode) as f:
+            for chunk in res.iter_content(chunk_size=self.chunk_size):
+               f.write(chunk)
+               written += len(chunk)
+
+      if expected is not None and written!=int(expected):
+         error = DownloadError(f"Incomplete download of {url}: {written} of {expected} bytes.")
+         error.retry = True
+         raise error
+
+      os.replace(part_file, out_file)
+      self.__remove(meta_file)
+      return out_file
+
+   @staticmethod
+   def __save_validator(meta_file, headers):
+      # weak etags can't be used in If-Range
+      etag = headers.get("ETag")
+      validator = etag if etag and not etag.startswith("W/") else headers.get("Last-Modified")
+      if validator is None:
+         DownloadEngine.__remove(meta_file)
+         return
+      with open(meta_file, "w") as f:
+         json.dump({"validator": validator}, f)
+
+   @staticmethod
+   def __load_validator(meta_file):
+      """ETag or Last-Modified of the partial file, None if it is unknown and the download starts again"""
+      try:
+         with open(meta_file, "r") as f:
+            return json.load(f)["validator"]
+      except (OSError, ValueError, KeyError):
+         return None
+
+   @staticmethod
+   def __remove(*files):
+      for f in files:
+         if os.path.exists(f):
+            os.remove(f)
@@ -1,10 +1,10 @@
 import os
-from tqdm import tqdm
 from argparse import Namespace
 from ..utilities import *
+from .download_engine import *
 
 class EbasDownloader:
-   def __init__(self, loc=None, url=None, ftp=None, bs4_selector=None):
+   def __init__(self, loc=None, url=None, ftp=None, bs4_selector=None, max_workers=8, retries=3):
       """init
 
       Args:
@@ -12,8 +12,11 @@ class EbasDownloader:
           url (str, optional): url for ebas file list. Defaults to None.
           ftp (str, optional): url for ebas ftp server. Defaults to None.
           bs4_selector (str, optional): selector for bs4. Defaults to None.
+          max_workers (int, optional): number of concurrent downloads. Defaults to 8.
+          retries (int, optional): number of retries for each file. Defaults to 3.
       """
       self.loc, self.url, self.ftp, self.bs4_selector = loc, url, ftp, bs4_selector
+      self.max_workers, self.retries = max_workers, retries
       if loc is None:
          cwd = os.getcwd()
          self.loc = os.path.join(cwd, 'ebas', 'raw_data')
@@ -22,7 +25,7 @@ class EbasDownloader:
          
       if not os.path.exists(self.loc):
          os.makedirs(self.loc)
-         print(f"Make data folder {self.loc}...")
+         echo(f"Make data folder {self.loc}...")
          
       if ftp is None:
          self.ftp = 'https://thredds.nilu.no/thredds/fileServer/ebas/'
@@ -38,12 +41,18 @@ class EbasDownloader:
           conditions (dict, optional): files selection conditions. Defaults to None.
           download (bool, optional): whether performs download. Defaults to False.
       """
+      with span("get_raw_files"):
+         self.__get_raw_files(conditions, download)
+
+   def __get_raw_files(self, conditions, download):
       loc_files = self.__get_loc_files()
-      ftp_files = self.__get_ebas_files()
+      with span("catalog"):
+         ftp_files = self.__get_ebas_files()
       
       # remove files no longer exists on ftp server
-      del_files = list(filter(lambda x: x not in ftp_files, loc_files))
-      print(f"{len(del_files)} files need to be deleted...")
+      ftp_set = set(ftp_files)
+      del_files = list(filter(lambda x: x not in ftp_set, loc_files))
+      echo(f"{len(del_files)} files need to be deleted...")
       if len(del_files)>0:
          self.__del_files(del_files)
       
@@ -51,9 +60,10 @@ class EbasDownloader:
          if isinstance(conditions, dict):
             conditions = Namespace(**conditions)
          ftp_files = self.__select_files(ftp_files, conditions)
-      new_files = list(filter(lambda x: x not in loc_files, ftp_files))
+      loc_set = set(loc_files)
+      new_files = list(filter(lambda x: x not in loc_set, ftp_files))
       
-      print(f"{len(new_files)} files need to be downloaded...")
+      echo(f"{len(new_files)} files need to be downloaded...")
       
       if not download and len(new_files)>0:
          p = input("View file names? (y/n) ")
@@ -73,18 +83,22 @@ class EbasDownloader:
          self.__download_files(new_files) # download new files
          
    def __download_files(self, files):
-      ftp_list = []
-      for (_, f) in enumerate(files):
-         ftp_list.append((self.ftp+"/"+f, self.loc))
-      if len(ftp_list)>0:
-         print("Start downloading files...")
-         run_mp_async(ftp_get_file, ftp_list)
-         print("\nDownload completed.")
+      urls = []
+      for f in files:
+         urls.append(self.ftp.rstrip("/")+"/"+f)
+      if len(urls)>0:
+         echo("Start downloading files...")
+         engine = DownloadEngine(self.loc, max_workers=self.max_workers, retries=self.retries)
+         with span("download", files=len(urls)):
+            failures = engine.download(urls)
+         if len(failures)>0:
+            echo(f"{len(failures)} files failed, see {engine.error_file}.")
+         echo("Download completed.")
 
    def __del_files(self, files):
       for f in files:
          os.remove(os.path.join(self.loc, f))
-      print("Old files have been removed.")
+      echo("Old files have been removed.")
      
    def __select_files(self, files, conditions):
       """select files with args from files list
@@ -98,17 +112,22 @@ class EbasDownloader:
       ma = []
       com = []
       
+      # set lookup for long selection lists
+      site = set(conditions.site) if conditions.site is not None else None
+      matrix = set(conditions.matrix) if conditions.matrix is not None else None
+      components = set(conditions.components) if conditions.components is not None else None
+      
       selected = []
-      for f in tqdm(files, desc="selecting ftp files..."):
+      for f in progress(files, desc="selecting ftp files..."):
          temp = f.split('.')
-         site = temp[0]
+         f_site = temp[0]
          st = int(temp[1][0:4])
          ed = int(temp[2][0:4])
-         matrix = temp[5]
-         component = temp[4]
+         f_matrix = temp[5]
+         f_component = temp[4]
          
-         ma.append(matrix)
-         com.append(component)
+         ma.append(f_matrix)
+         com.append(f_component)
          
          if conditions.start_year is not None:
             if int(conditions.start_year) > ed:
@@ -116,14 +135,14 @@ class EbasDownloader:
          if conditions.end_year is not None:
             if int(conditions.end_year) < st:
                continue
-         if conditions.site is not None:
-            if site not in conditions.site:
+         if site is not None:
+            if f_site not in site:
                continue
-         if conditions.matrix is not None:
-            if matrix not in conditions.matrix:
+         if matrix is not None:
+            if f_matrix not in matrix:
                continue
-         if conditions.components is not None:
-            if component not in conditions.components:
+         if components is not None:
+            if f_component not in components:
                continue
          
          selected.append(f)
@@ -134,17 +153,19 @@ class EbasDownloader:
       return selected
    
    def __get_ebas_files(self):
-      print("Requesting data from ebas sever...")
-      files = bs4_get(self.url, self.bs4_selector)
+      echo("Requesting data from ebas sever...")
+      # catalog is parsed again only if it has changed
+      cache_file = os.path.join(os.path.dirname(self.loc), "catalog_cache.json")
+      files = bs4_get_cached(self.url, self.bs4_selector, cache_file)
       # the first line is "Ebas", not a file
-      print(f"{len(files)-1} files found on ftp server.")
+      echo(f"{len(files)-1} files found on ftp server.")
       return files[1:]
    
    def __get_loc_files(self):
       nc_files =[]
       files = os.listdir(self.loc)
       nc_files = list(filter(lambda x: x.endswith("nc"), files))      
-      print(f"{len(nc_files)} raw data (*.nc) files have been downloaded.")
+      echo(f"{len(nc_files)} raw data (*.nc) files have been downloaded.")
       
       return nc_files
  
\ No newline at end of file
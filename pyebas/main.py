@@ -72,11 +72,12 @@ Example: pyebas 2019 2021 --mode csv --site ES0010R ES0011R --matrix air --compo
    
    parser.add_argument('start_year', type=int, help='starting year, eg. 1990', default=None)
    parser.add_argument('end_year', type=int, help='ending year, eg. 2021', default=None)
-   parser.add_argument('--mode', choices=['db','csv', 'query'], help='export mode', default='csv')
+   parser.add_argument('--mode', choices=['db','csv', 'query', 'serve'], help='export mode', default='csv')
    parser.add_argument('--site', nargs="*", help='site code', default=None)
    parser.add_argument('--matrix', nargs="*", help='matrix', default=None)
    parser.add_argument('--components', nargs="*", help='component names', default=None)
    parser.add_argument('--output', type=str, help='output path', default=None)
+   parser.add_argument('--port', type=int, help='port of the local query server', default=DEFAULT_PORT)
       
    args = parser.parse_args()
    
@@ -94,9 +95,25 @@ Example: pyebas 2019 2021 --mode csv --site ES0010R ES0011R --matrix air --compo
       db = EbasDB(args.output, dump='xz', detailed=True)
       db.update_db()
       
-   elif args.mode=="query":
+   elif args.mode=="serve":
+      # load the database once and answer queries until stopped
       db = EbasDB(args.output, dump='xz', detailed=True)
-      db.init_db()
+      server = EbasServer(db, port=args.port)
+      print(f"Serving {args.output} on port {args.port} (ctrl+c to exit)")
+      set_console(False)
+      try:
+         server.serve_forever()
+      except KeyboardInterrupt:
+         server.shutdown()
+
+   elif args.mode=="query":
+      # attach to a running server, otherwise load the database
+      db = EbasClient(port=args.port)
+      if db.ping():
+         print(f"Connected to the query server on port {args.port}")
+      else:
+         db = EbasDB(args.output, dump='xz', detailed=True)
+         db.init_db()
       print("Query Mode (ctrl+c to exit)")
       while True:
          condition ={}
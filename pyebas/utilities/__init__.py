@@ -1,2 +1,2 @@
 from .utilities import *
-
+from .instrument import *
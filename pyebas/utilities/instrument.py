@@ -0,0 +1,166 @@
+import json
+import time
+import logging
+import threading
+import contextlib
+from tqdm import tqdm
+
+# console messages and progress bars
+CONSOLE = {"enabled": True}
+SINKS = []
+COUNTERS = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class LoggingSink:
+   def __init__(self, logger=None, level=logging.INFO):
+      """send spans and messages to a logger
+
+      Args:
+          logger (logging.Logger, optional): logger. Defaults to None, logger "pyebas".
+          level (int, optional): logging level. Defaults to logging.INFO.
+      """
+      self.logger = logger if logger is not None else logging.getLogger("pyebas")
+      self.level = level
+
+   def __call__(self, event):
+      if event["type"]=="message":
+         self.logger.log(self.level, event["text"])
+      else:
+         counters = " ".join(f"{k}={v}" for k, v in event["counters"].items())
+         self.logger.log(self.level, f"{event['path']} wall={event['wall']:.4f}s cpu={event['cpu']:.4f}s {counters}".rstrip())
+
+class JsonLinesSink:
+   def __init__(self, file_path, messages=False):
+      """append events to a json lines file
+
+      Args:
+          file_path (str): output file
+          messages (bool, optional): whether console messages are written as well. Defaults to False.
+      """
+      self.file_path = file_path
+      self.messages = messages
+
+   def __call__(self, event):
+      if event["type"]=="message" and not self.messages:
+         return
+      with open(self.file_path, "a") as f:
+         f.write(json.dumps(event, default=str)+"\n")
+
+class MemorySink:
+   def __init__(self):
+      """keep events in memory, eg. for tests"""
+      self.events = []
+
+   def __call__(self, event):
+      self.events.append(event)
+
+   def spans(self, name=None):
+      return [e for e in self.events if e["type"]=="span" and (name is None or e["name"]==name)]
+
+   def clear(self):
+      self.events = []
+
+
+def add_sink(sink):
+   """add a sink, a sink is called with each event dict"""
+   with _lock:
+      SINKS.append(sink)
+   return sink
+
+def remove_sink(sink):
+   with _lock:
+      if sink in SINKS:
+         SINKS.remove(sink)
+
+def set_console(enabled=True):
+   """switch console messages and progress bars on or off"""
+   CONSOLE["enabled"] = enabled
+
+def emit(event):
+   with _lock:
+      sinks = list(SINKS)
+   for sink in sinks:
+      sink(event)
+
+def echo(text):
+   """console message, also sent to sinks"""
+   if CONSOLE["enabled"]:
+      print(text)
+   if len(SINKS)>0:
+      emit({"type": "message", "text": str(text), "time": time.time()})
+
+def progress(iterable=None, **kwargs):
+   """tqdm progress bar, hidden when console is switched off"""
+   return tqdm(iterable, disable=not CONSOLE["enabled"], **kwargs)
+
+def add_count(name, value=1):
+   """increase a counter, eg. files scanned or bytes read
+
+   The total is kept in COUNTERS, and the value is added to every open span of the current thread.
+   Inside collect_counts, the value is kept for the caller instead of COUNTERS.
+   """
+   collected = getattr(_local, "collected", None)
+   if collected is not None:
+      collected[name] = collected.get(name, 0)+value
+   else:
+      with _lock:
+         COUNTERS[name] = COUNTERS.get(name, 0)+value
+   for s in getattr(_local, "stack", []):
+      s["counters"][name] = s["counters"].get(name, 0)+value
+
+def add_counts(counts):
+   """add counters collected by collect_counts, eg. in the thread which started the work"""
+   for name, value in counts.items():
+      add_count(name, value)
+
+@contextlib.contextmanager
+def collect_counts():
+   """keep the counters added by the current thread in a dict, which is recorded later with add_counts
+
+   Worker threads have their own spans, so their counters are handed to the thread which waits for them.
+   """
+   previous = getattr(_local, "collected", None)
+   collected = _local.collected = {}
+   try:
+      yield collected
+   finally:
+      _local.collected = previous
+
+def counters(reset=False):
+   """copy of the counter totals"""
+   with _lock:
+      res = dict(COUNTERS)
+      if reset:
+         COUNTERS.clear()
+   return res
+
+@contextlib.contextmanager
+def span(name, **attrs):
+   """time a named stage, wall and cpu time are sent to sinks when the stage ends
+
+   Args:
+       name (str): stage name, eg. "init_db"
+       **attrs: extra values of the event
+   """
+   stack = getattr(_local, "stack", None)
+   if stack is None:
+      stack = _local.stack = []
+   event = {"type": "span",
+            "name": name,
+            "path": "/".join([s["name"] for s in stack]+[name]),
+            "start": time.time(),
+            "counters": {}}
+   event.update(attrs)
+   stack.append(event)
+   wall = time.perf_counter()
+   cpu = time.process_time()
+   try:
+      yield event
+   finally:
+      event["wall"] = time.perf_counter()-wall
+      event["cpu"] = time.process_time()-cpu
+      stack.pop()
+      if len(SINKS)>0:
+         emit(event)
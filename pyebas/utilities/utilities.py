@@ -1,10 +1,13 @@
 import concurrent.futures
+import collections
 import multiprocessing
-from tqdm import tqdm
+import threading
+from .instrument import *
 import csv
 import pycountry
-import wget
 import os
+import json
+import hashlib
 
 
 from bs4 import BeautifulSoup
@@ -20,7 +23,10 @@ def bs4_get(url, selector, tags=None):
    if wb_res.status_code !=200:
       raise ValueError("Connection error.")
 
-   soup = BeautifulSoup(wb_res.text, 'lxml')
+   return bs4_parse(wb_res.text, selector, tags)
+
+def bs4_parse(text, selector, tags=None):
+   soup = BeautifulSoup(text, 'lxml')
    
    selected = soup.select(selector)
    res = []
@@ -36,45 +42,158 @@ def bs4_get(url, selector, tags=None):
       
    return res
 
-def ftp_get_file(ftp, out_path):
-   try:
-      wget.download(ftp, out=out_path)
-   except Exception as e:
-      print(e)
-      with open(os.path.join(out_path, 'ftp_error.txt'),'a') as f:
-         f.write(ftp+'\n')
+def bs4_get_cached(url, selector, cache_file, tags=None):
+   """bs4_get with the parsed result cached on disk
+   
+   The page is requested with the ETag and Last-Modified of the cached page, 
+   it is parsed again only if the server returns a changed page.
 
-def run_mp_async(map_func, arg_list,num_cores=None):
-   if num_cores is None:
-      num_cores = multiprocessing.cpu_count()
-      num_cores = len(arg_list) if len(arg_list)<num_cores else num_cores
-   print(f"Using {num_cores} threads...")
+   Args:
+       url (str): page url
+       selector (str): css selector
+       cache_file (str): path to json cache file
+       tags (list, optional): see bs4_get. Defaults to None.
+
+   Returns:
+       list: same as bs4_get
+   """
+   cache = None
+   if os.path.exists(cache_file):
+      try:
+         with open(cache_file, "r") as f:
+            cache = json.load(f)
+      except ValueError:
+         cache = {}
+      if cache.get("url")!=url or cache.get("selector")!=selector or cache.get("tags")!=tags:
+         cache = None
+   
+   headers = {}
+   if cache is not None:
+      if cache.get("etag"):
+         headers["If-None-Match"] = cache["etag"]
+      if cache.get("last_modified"):
+         headers["If-Modified-Since"] = cache["last_modified"]
+   
+   wb_res = requests.get(url, headers=headers)
+   if wb_res.status_code==304 and cache is not None:
+      return cache["res"]
+   if wb_res.status_code !=200:
+      raise ValueError("Connection error.")
+   
+   # servers without validators send the whole page, it is parsed only when it has changed
+   digest = hashlib.sha1(wb_res.content).hexdigest()
+   if cache is not None and cache.get("sha1")==digest:
+      res = cache["res"]
+   else:
+      res = bs4_parse(wb_res.text, selector, tags)
    
-   pool = multiprocessing.Pool(num_cores)
-   for arg in arg_list:
-      pool.apply_async(map_func,  args=arg) 
-   pool.close()
-   pool.join()
+   cache = {"url": url,
+            "selector": selector,
+            "tags": tags,
+            "etag": wb_res.headers.get("ETag"),
+            "last_modified": wb_res.headers.get("Last-Modified"),
+            "sha1": digest,
+            "res": res}
+   temp_file = cache_file+".tmp"
+   with open(temp_file, "w") as f:
+      json.dump(cache, f)
+   os.replace(temp_file, cache_file)
+   return res
+
+# memory reserved for each worker process when the number of workers is decided
+MEM_PER_WORKER = 1<<30
+
+def worker_count(num_tasks=None, num_cores=None, mem_per_worker=None):
+   """number of worker processes, limited by cpu cores, available memory, and number of tasks
 
-def run_mp(map_func, arg_list, combine_func=None, num_cores=None):
+   Args:
+       num_tasks (int, optional): number of tasks. Defaults to None.
+       num_cores (int, optional): required number of workers. Defaults to None, all cpu cores.
+       mem_per_worker (int, optional): memory (bytes) needed by one worker. Defaults to None, MEM_PER_WORKER.
+
+   Returns:
+       int: number of workers, at least 1
+   """
    if num_cores is None:
       num_cores = multiprocessing.cpu_count()
-      num_cores = len(arg_list) if len(arg_list)<num_cores else num_cores
-   print(f"Using {num_cores} threads...")
+      if mem_per_worker is None:
+         mem_per_worker = MEM_PER_WORKER
+      try:
+         available = os.sysconf("SC_AVPHYS_PAGES")*os.sysconf("SC_PAGE_SIZE")
+         num_cores = min(num_cores, available//mem_per_worker)
+      except (ValueError, OSError, AttributeError):
+         # available memory is unknown on this system
+         pass
+   if num_tasks is not None:
+      num_cores = min(num_cores, num_tasks)
+   return max(int(num_cores), 1)
+
+class WorkerPool:
+   def __init__(self, num_cores=None, mem_per_worker=None):
+      """process pool which can be reused by several run_mp calls
+
+      Args:
+          num_cores (int, optional): number of workers. Defaults to None, decided by worker_count.
+          mem_per_worker (int, optional): memory (bytes) needed by one worker. Defaults to None.
+      """
+      self.num_cores = worker_count(num_cores=num_cores, mem_per_worker=mem_per_worker)
+      self.executor = None
    
-   with concurrent.futures.ProcessPoolExecutor(max_workers=num_cores) as pool:
-      with tqdm(total=len(arg_list)) as progress:
-         futures = []
-         for args in arg_list:
-               future = pool.submit(map_func, args)
-               future.add_done_callback(lambda p: progress.update())
-               futures.append(future)
+   def __enter__(self):
+      return self
+   
+   def __exit__(self, *args):
+      self.close()
+   
+   def close(self):
+      if self.executor is not None:
+         self.executor.shutdown()
+         self.executor = None
+   
+   def map(self, map_func, arg_list, chunksize=None):
+      """run map_func for each item of arg_list, items are sent to workers in chunks
 
-         results = []
-         
-         for future in futures:
-               result = future.result()
-               results.append(result)
+      Args:
+          map_func (function): module-level function, so only the arguments are sent to workers
+          arg_list (list): arguments
+          chunksize (int, optional): number of items sent at a time. Defaults to None, about 4 chunks per worker.
+
+      Returns:
+          list: results in the order of arg_list
+      """
+      if self.executor is None:
+         # workers are started at the first use
+         echo(f"Using {self.num_cores} threads...")
+         self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_cores)
+      if chunksize is None:
+         chunksize = max(len(arg_list)//(self.num_cores*4), 1)
+      
+      results = []
+      with progress(total=len(arg_list)) as bar:
+         for result in self.executor.map(map_func, arg_list, chunksize=chunksize):
+            results.append(result)
+            bar.update()
+      return results
+
+def run_mp(map_func, arg_list, combine_func=None, num_cores=None, pool=None, chunksize=None):
+   """run map_func for each item of arg_list in worker processes
+
+   Args:
+       map_func (function): module-level function
+       arg_list (list): arguments
+       combine_func (function, optional): function to combine the list of results. Defaults to None.
+       num_cores (int, optional): number of workers of the new pool. Defaults to None.
+       pool (WorkerPool, optional): pool to use instead of a new one. Defaults to None.
+       chunksize (int, optional): see WorkerPool.map. Defaults to None.
+
+   Returns:
+       list: results, or the result of combine_func
+   """
+   if pool is None:
+      with WorkerPool(worker_count(len(arg_list), num_cores)) as pool:
+         results = pool.map(map_func, arg_list, chunksize)
+   else:
+      results = pool.map(map_func, arg_list, chunksize)
    
    if combine_func is not None:
       return combine_func(results)
@@ -82,6 +201,87 @@ def run_mp(map_func, arg_list, combine_func=None, num_cores=None):
       return results   
          
 
+def run_mp_iter(map_func, arg_list, num_cores=None, max_pending=None):
+   """run map_func in a process pool and yield results in the order of arg_list
+   
+   at most max_pending tasks are submitted at the same time, 
+   so finished results don't pile up when the consumer is slower than the workers.
+   """
+   num_cores = worker_count(len(arg_list), num_cores)
+   if max_pending is None:
+      max_pending = 2*num_cores
+   echo(f"Using {num_cores} threads...")
+   
+   with concurrent.futures.ProcessPoolExecutor(max_workers=num_cores) as pool:
+      with progress(total=len(arg_list)) as bar:
+         futures = collections.deque()
+         for args in arg_list:
+            futures.append(pool.submit(map_func, args))
+            if len(futures)>=max_pending:
+               yield futures.popleft().result()
+               bar.update()
+         while len(futures)>0:
+            yield futures.popleft().result()
+            bar.update()
+
+# threads of the pool shared by all run_threads_iter calls
+MAX_THREADS = 8
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+_thread_local = threading.local()
+
+def thread_count():
+   """threads of the shared pool, cpu cores but at most MAX_THREADS"""
+   return max(min(multiprocessing.cpu_count(), MAX_THREADS), 1)
+
+def thread_pool():
+   """thread pool shared by all run_threads_iter calls, so concurrent queries don't start more threads"""
+   global _thread_pool
+   with _thread_pool_lock:
+      if _thread_pool is None:
+         _thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=thread_count(), thread_name_prefix="pyebas")
+      return _thread_pool
+
+def _run_counted(map_func, args):
+   _thread_local.in_pool = True
+   with collect_counts() as counts:
+      res = map_func(args)
+   return res, counts
+
+def run_threads_iter(map_func, arg_list, num_threads=None):
+   """run map_func in the shared thread pool and yield results in the order of arg_list
+
+   For work which releases the GIL, eg. numpy slicing and copying, and for sharing objects which can't be pickled.
+   Counters added by map_func are recorded in the calling thread, so they reach its open spans.
+
+   Args:
+       map_func (function): function of one argument
+       arg_list (list): arguments
+       num_threads (int, optional): number of tasks running at the same time, 
+                                    the threads of the shared pool are shared with concurrent calls. 
+                                    Defaults to None, all threads of the pool.
+   """
+   if num_threads is None:
+      num_threads = thread_count()
+   num_threads = max(min(int(num_threads), len(arg_list)), 1)
+   if num_threads==1 or getattr(_thread_local, "in_pool", False):
+      # no pool for a single thread, and tasks of the pool don't wait for other tasks of the pool
+      for args in arg_list:
+         yield map_func(args)
+      return
+   pool = thread_pool()
+   futures = collections.deque()
+   for args in arg_list:
+      futures.append(pool.submit(_run_counted, map_func, args))
+      if len(futures)>=num_threads:
+         res, counts = futures.popleft().result()
+         add_counts(counts)
+         yield res
+   while len(futures)>0:
+      res, counts = futures.popleft().result()
+      add_counts(counts)
+      yield res
+
 def list2csv(data, file_name, header=None, single_col=True):
    with open(file_name, 'w', newline='', encoding="utf-8") as f:
     write = csv.writer(f)
@@ -93,7 +293,7 @@ def list2csv(data, file_name, header=None, single_col=True):
     else:
        write.writerows(data)
    
-   print(f"Data is written to {file_name}.")
+   echo(f"Data is written to {file_name}.")
    
 
 # convert country name and code 
@@ -21,9 +21,9 @@ setup(
     description=DESCRIPTION,
     long_description_content_type="text/markdown",
     long_description=long_description,
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     
-    install_requires=["numpy","pandas","xarray","pycountry","bs4","wget","tqdm"],
+    install_requires=["numpy","pandas","xarray","pycountry","bs4","tqdm","requests"],
     url = 'https://github.com/defve1988/pyebas',
     entry_points={
         'console_scripts': [
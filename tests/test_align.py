@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pyebas.ebas_db.align import align_columns, time_grid, to_step
+
+M = np.timedelta64(1, "m")
+H = np.timedelta64(1, "h")
+T0 = np.datetime64("2000-01-01T00:00:00", "ns")
+GRID = time_grid(T0+H, T0+49*H, "1h")
+
+
+def samples(columns=3, n=400, seed=0):
+   """samples of several series in one array, in random order, with nan values and samples outside of the grid"""
+   rng = np.random.default_rng(seed)
+   st = T0+rng.integers(0, 50*60, n)*M
+   ed = st+rng.integers(1, 180, n)*M
+   val = rng.normal(size=n)
+   val[rng.random(n)<0.1] = np.nan
+   column = rng.integers(0, columns, n)
+   return np.stack([st, ed], axis=1), val, column
+
+def expected(columns, how, func):
+   return np.stack([func(c) for c in range(columns)], axis=1)
+
+@pytest.mark.parametrize("how", ["mean", "sum", "min", "max", "count"])
+def test_start_rules_match_resample(how):
+   ts, val, column = samples()
+   res = align_columns(ts, val, column, 3, GRID, H, how=how)
+
+   def resample(c):
+      s = pd.Series(val[column==c], index=ts[column==c, 0]).sort_index()
+      agg = s.resample("1h", origin=pd.Timestamp(GRID[0]))
+      agg = agg.sum(min_count=1) if how=="sum" else getattr(agg, how)()
+      return agg.reindex(GRID, fill_value=0 if how=="count" else np.nan).to_numpy(dtype=np.float64)
+   np.testing.assert_allclose(res, expected(3, how, resample))
+
+def test_weighted_matches_minute_resample():
+   ts, val, column = samples()
+   res = align_columns(ts, val, column, 3, GRID, H, how="weighted")
+
+   def weighted(c):
+      # every sample as one row per minute, so each row has the weight of one minute
+      sel = (column==c) & ~np.isnan(val)
+      minutes = [pd.Series(v, index=pd.date_range(st, ed-M, freq="1min")) for (st, ed), v in zip(ts[sel], val[sel])]
+      s = pd.concat(minutes)
+      return s.groupby(s.index.floor("1h")).mean().reindex(GRID).to_numpy()
+   np.testing.assert_allclose(res, expected(3, "weighted", weighted))
+
+def test_nearest_matches_merge_asof():
+   # point samples at distinct times, 1 s mod 4 s, so no two samples are as close to a cell middle
+   ts, val, column = samples()
+   seconds = np.random.default_rng(1).choice(50*900, len(val), replace=False)*4+1
+   ts[:,0] = T0+seconds*np.timedelta64(1, "s")
+   ts[:,1] = ts[:,0]
+   for tolerance in [None, np.timedelta64(10, "m"), np.timedelta64(3, "h")]:
+      res = align_columns(ts, val, column, 3, GRID, H, how="nearest", tolerance=tolerance)
+
+      def nearest(c):
+         sel = (column==c) & ~np.isnan(val)
+         right = pd.DataFrame({"time": ts[sel, 0], "val": val[sel]}).sort_values("time")
+         left = pd.DataFrame({"time": GRID+30*M})
+         return pd.merge_asof(left, right, on="time", direction="nearest",
+                              tolerance=pd.Timedelta(30*M if tolerance is None else tolerance))["val"].to_numpy()
+      np.testing.assert_allclose(res, expected(3, "nearest", nearest))
+
+def test_nearest_weekly_on_daily_grid():
+   # each cell middle is within one weekly sample
+   week = np.timedelta64(7, "D")
+   st = T0+np.arange(10)*week
+   ts = np.stack([st, st+week], axis=1)
+   val = np.arange(10, dtype=np.float64)
+   grid = time_grid(T0, T0+70*np.timedelta64(1, "D"), "1D")
+   res = align_columns(ts, val, np.zeros(10, dtype=int), 1, grid, to_step("1D"), how="nearest")
+
+   left = pd.DataFrame({"time": grid+to_step("1D")//2})
+   right = pd.DataFrame({"time": st, "val": val})
+   np.testing.assert_array_equal(res[:,0], pd.merge_asof(left, right, on="time", direction="backward")["val"].to_numpy())
+
+def test_empty_cells():
+   ts, val, column = samples()
+   res = align_columns(ts, val, column, 5, GRID, H, how="mean")
+   # no samples of the last columns
+   assert np.isnan(res[:,3:]).all()
+   assert (align_columns(ts, val, column, 5, GRID, H, how="count")[:,3:]==0).all()
+   assert align_columns(ts, val, column, 3, GRID[:0], H).shape==(0, 3)
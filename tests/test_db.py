@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import pytest
+from pyebas import *
+from pyebas.utilities.instrument import set_console
+from benchmarks.synthetic import make_archive, make_file
+
+set_console(False)
+
+
+def create_db(tmp_path, num_sites=4, **kwargs):
+   db_dir = str(tmp_path/"db")
+   make_archive(os.path.join(db_dir, "raw_data"), num_sites=num_sites, num_files=2, num_vars=2, length=240)
+   db = EbasDB(dir=db_dir, **kwargs)
+   db.update_db()
+   return db
+
+def test_incremental_update_with_zstd_dict(tmp_path):
+   pytest.importorskip("zstandard")
+   db = create_db(tmp_path, num_sites=8, dump="zst")
+   db.init_db()
+   db.train_zstd_dict(dict_size=4096, sample_size=1024)
+   db.update_db(full=True)
+
+   # a new file of one site, the indexes are read with the dictionary
+   make_file(db.raw_dir, 0, 2, 2, 240, np.timedelta64(1, "h"), np.random.default_rng(1))
+   db = EbasDB(dir=db.db_dir, dump="zst", codec_options=db.codec_options)
+   db.update_db()
+   db.init_db()
+   df = db.query({"id": ["DE0000R"]})
+   assert len(df)==3*2*240
+
+def test_update_keeps_shard_layout(tmp_path):
+   db = create_db(tmp_path, shards="year")
+   shards = sorted(os.listdir(db.dump_dir))
+
+   # opened without shards, as the command line tool does
+   make_file(db.raw_dir, 0, 2, 2, 240, np.timedelta64(1, "h"), np.random.default_rng(1))
+   db = EbasDB(dir=db.db_dir)
+   db.update_db()
+   assert db.shards=="year"
+   db.init_db()
+   assert db.shard_index["period"]=="year"
+   assert set(shards)<=set(os.listdir(db.dump_dir))
+   assert len(db.query({"id": ["DE0000R"]}))==3*2*240
+
+def test_threaded_query_counters(tmp_path):
+   create_db(tmp_path, shards="year")
+   sink = add_sink(MemorySink())
+   try:
+      for workers in [1, 4]:
+         db = EbasDB(dir=str(tmp_path/"db"), lazy=True, query_workers=workers)
+         db.init_db()
+         sink.clear()
+         df = db.query({}, cache=False)
+         counters = sink.spans("query")[-1]["counters"]
+         # one shard per site, read by each of its 4 series
+         assert counters["sites_loaded"]==4
+         assert counters["shards_read"]==16
+         assert counters["bytes_read"]>0
+         assert counters["rows_returned"]==len(df)==4*2*2*240
+   finally:
+      remove_sink(sink)
@@ -0,0 +1,159 @@
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from pyebas.ebas_downloader import download_engine
+from pyebas.ebas_downloader.download_engine import DownloadEngine
+from pyebas.utilities.instrument import set_console
+
+set_console(False)
+
+
+class FileServer:
+   def __init__(self):
+      """local stand-in for THREDDS, with range requests, ETags, and scripted failures"""
+      # {name: (data, etag)}
+      self.files = {}
+      # {name: [status, ...]} answered before the file is sent
+      self.errors = {}
+      # {name: bytes} sent before the connection is closed, for the next request only
+      self.cuts = {}
+      # [(name, headers)]
+      self.requests = []
+      server = self
+
+      class Handler(BaseHTTPRequestHandler):
+         def do_GET(self):
+            name = self.path.split("/")[-1]
+            server.requests.append((name, dict(self.headers)))
+            if len(server.errors.get(name, []))>0:
+               self.send_response(server.errors[name].pop(0))
+               self.send_header("Content-Length", "0")
+               self.end_headers()
+               return
+            if name not in server.files:
+               self.send_response(404)
+               self.send_header("Content-Length", "0")
+               self.end_headers()
+               return
+            data, etag = server.files[name]
+            start = 0
+            # a range without If-Range is always served
+            if self.headers.get("Range") and self.headers.get("If-Range", etag)==etag:
+               start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            body = data[start:]
+            self.send_response(206 if start>0 else 200)
+            if start>0:
+               self.send_header("Content-Range", f"bytes {start}-{len(data)-1}/{len(data)}")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            cut = server.cuts.pop(name, None)
+            if cut is not None:
+               # interrupted transfer
+               self.wfile.write(body[:cut])
+               self.wfile.flush()
+               self.close_connection = True
+               return
+            self.wfile.write(body)
+
+         def log_message(self, format, *args):
+            pass
+
+      self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+      self.httpd.daemon_threads = True
+      self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/files"
+      threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+   def close(self):
+      self.httpd.shutdown()
+      self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+   server = FileServer()
+   yield server
+   server.close()
+
+@pytest.fixture
+def sleeps(monkeypatch):
+   res = []
+   monkeypatch.setattr(download_engine.time, "sleep", res.append)
+   return res
+
+def engine(tmp_path, **kwargs):
+   return DownloadEngine(str(tmp_path), max_workers=2, backoff=0.5, timeout=5, chunk_size=64, **kwargs)
+
+
+def test_resume_from_part_file(tmp_path, server, sleeps):
+   data = os.urandom(5000)
+   server.files["a.nc"] = (data, '"v1"')
+   server.cuts["a.nc"] = 2048
+   out_file = tmp_path/"a.nc"
+
+   with pytest.raises(Exception):
+      engine(tmp_path, retries=0).get_file(server.url+"/a.nc")
+   # the file is only renamed when it is complete
+   assert not out_file.exists()
+   part = (tmp_path/"a.nc.part").read_bytes()
+   assert 0<len(part)<len(data) and data.startswith(part)
+
+   assert engine(tmp_path).get_file(server.url+"/a.nc")==str(out_file)
+   assert out_file.read_bytes()==data
+   _, headers = server.requests[-1]
+   assert headers["Range"]==f"bytes={len(part)}-"
+   assert headers["If-Range"]=='"v1"'
+   assert sorted(os.listdir(tmp_path))==["a.nc"]
+
+def test_restart_when_remote_file_changed(tmp_path, server, sleeps):
+   old, new = os.urandom(3000), os.urandom(4000)
+   server.files["a.nc"] = (old, '"v1"')
+   server.cuts["a.nc"] = 1024
+   with pytest.raises(Exception):
+      engine(tmp_path, retries=0).get_file(server.url+"/a.nc")
+
+   server.files["a.nc"] = (new, '"v2"')
+   engine(tmp_path).get_file(server.url+"/a.nc")
+   # the server answers 200 for another ETag, old bytes are not kept
+   assert (tmp_path/"a.nc").read_bytes()==new
+
+def test_part_file_without_validator_starts_again(tmp_path, server, sleeps):
+   data = os.urandom(1000)
+   server.files["a.nc"] = (data, '"v1"')
+   (tmp_path/"a.nc.part").write_bytes(b"x"*100)
+   engine(tmp_path).get_file(server.url+"/a.nc")
+   assert (tmp_path/"a.nc").read_bytes()==data
+   assert "Range" not in server.requests[-1][1]
+
+def test_retry_with_backoff(tmp_path, server, sleeps):
+   data = os.urandom(1000)
+   server.files["a.nc"] = (data, '"v1"')
+   server.errors["a.nc"] = [503, 500]
+   engine(tmp_path, retries=3).get_file(server.url+"/a.nc")
+   assert (tmp_path/"a.nc").read_bytes()==data
+   assert len(server.requests)==3
+   assert sleeps==[0.5, 1.0]
+
+def test_retries_are_limited(tmp_path, server, sleeps):
+   server.files["a.nc"] = (b"data", '"v1"')
+   server.errors["a.nc"] = [503]*5
+   failures = engine(tmp_path, retries=2).download([server.url+"/a.nc"])
+   assert failures[0]["attempts"]==3
+   assert sleeps==[0.5, 1.0]
+   assert not (tmp_path/"a.nc").exists()
+
+def test_failure_record_on_404(tmp_path, server, sleeps):
+   data = os.urandom(1000)
+   server.files["a.nc"] = (data, '"v1"')
+   failures = engine(tmp_path).download([server.url+"/a.nc", server.url+"/missing.nc"])
+   assert (tmp_path/"a.nc").read_bytes()==data
+   assert len(failures)==1
+   # not found is not retried
+   assert failures[0]["file"]=="missing.nc"
+   assert failures[0]["attempts"]==1
+   assert "404" in failures[0]["error"]
+   assert sleeps==[]
+   with open(tmp_path/"download_errors.json") as f:
+      assert json.load(f)==failures
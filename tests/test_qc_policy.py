@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from pyebas import *
+
+
+def test_default_bad_flags(tmp_path):
+   db = EbasDB(dir=str(tmp_path/"db"))
+   assert db.bad_qc==QCPolicy().bad
+   # changing the flags of one database doesn't change the default
+   db.bad_qc.append(1)
+   assert 1 not in QCPolicy().bad
+
+def flags(n=2000, k=3, seed=0):
+   """(n, k) flags, mostly 0 or valid flags, and some bad ones"""
+   rng = np.random.default_rng(seed)
+   bad = QCPolicy().bad
+   choices = np.array([0, 0, 0, 100, 110, 147, 247]+bad[:5], dtype=np.uint16)
+   return choices[rng.integers(0, len(choices), (n, k))]
+
+def first_flag(row, bad):
+   """a bad flag if there is any, otherwise the first non zero flag"""
+   for f in row:
+      if f in bad:
+         return f
+   for f in row:
+      if f!=0:
+         return f
+   return 0
+
+@pytest.mark.parametrize("k", [1, 2, 4])
+def test_invalid_and_flag_column_match_loop(k):
+   qc = flags(k=k)
+   for policy in [QCPolicy(), QCPolicy(bad=[110, 247]), QCPolicy(bad=[])]:
+      bad = set(policy.bad)
+      assert policy.lut.sum()==len([f for f in bad if 0<=f<QCPolicy.flag_num])
+      np.testing.assert_array_equal(policy.invalid(qc), [any(f in bad for f in row) for row in qc])
+      column = policy.flag_column(qc, len(qc))
+      assert column.dtype==np.uint16
+      if k==1:
+         np.testing.assert_array_equal(column, qc[:,0])
+      else:
+         np.testing.assert_array_equal(column, [first_flag(row, bad) for row in qc])
+
+def test_apply():
+   qc = flags(k=3)
+   val = np.arange(len(qc), dtype=np.float64)[:,None]
+   policy = QCPolicy(bad=[110, 247])
+   res = policy.apply(val, qc)
+   assert res.shape==val.shape
+   invalid = np.array([110 in row or 247 in row for row in qc])
+   assert np.isnan(res[invalid,0]).all()
+   np.testing.assert_array_equal(res[~invalid], val[~invalid])
+   # nothing to change
+   assert QCPolicy(keep=True).apply(val, qc) is val
+   assert policy.apply(val, None) is val
+   assert QCPolicy(bad=[1]).apply(val, qc) is val
+   np.testing.assert_array_equal(policy.flag_column(None, 3), [0, 0, 0])
+
+def test_create():
+   assert QCPolicy.create().key()==QCPolicy().key()
+   assert QCPolicy.create("keep").keep
+   assert QCPolicy.create("flags").flags
+   assert QCPolicy.create([999, 980, 999]).bad==[980, 999]
+   policy = QCPolicy(bad=[1])
+   assert QCPolicy.create(policy) is policy
+   with pytest.raises(ValueError):
+      QCPolicy.create("other")
+   # flags out of the uint16 range never match
+   assert not QCPolicy(bad=[-1, 1<<16]).lut.any()
@@ -0,0 +1,39 @@
+import os
+import numpy as np
+import pandas as pd
+from pyebas import *
+from pyebas.utilities.instrument import set_console, counters
+from benchmarks.synthetic import make_archive
+
+set_console(False)
+
+
+def test_scalar_string_selector(tmp_path):
+   db_dir = str(tmp_path/"db")
+   make_archive(os.path.join(db_dir, "raw_data"), num_sites=3, num_files=1, num_vars=2, length=48)
+   db = EbasDB(dir=db_dir)
+   db.update_db()
+   db.init_db()
+   df = db.query({"id": "DE0000R", "matrix": "air"}, cache=False)
+   assert df is not None
+   assert df.equals(db.query({"id": ["DE0000R"], "matrix": ["air"]}, cache=False))
+
+def test_string_times(tmp_path):
+   db_dir = str(tmp_path/"db")
+   make_archive(os.path.join(db_dir, "raw_data"), num_sites=2, num_files=1, num_vars=1, length=48)
+   db = EbasDB(dir=db_dir)
+   db.update_db()
+   db.init_db()
+   df = db.query({"st": "1990-01-01T12", "ed": "1990-01-02"})
+   assert len(df)==2*12
+   # same cache entry as datetime64 times
+   hits = counters().get("query_cache_hits", 0)
+   assert db.query({"st": np.datetime64("1990-01-01T12"), "ed": np.datetime64("1990-01-02")}).equals(df)
+   assert counters().get("query_cache_hits", 0)==hits+1
+
+def test_result_bytes_column_names():
+   df = pd.DataFrame({"st": np.array(["1990-01-01"], dtype="datetime64[ns]"), "val": [1.0],
+                      "site": np.array([0], dtype=np.int8)})
+   res = bytes_to_df(df_to_bytes(df))
+   assert all(type(c) is str for c in res.columns)
+   pd.testing.assert_frame_equal(res, df)
@@ -0,0 +1,85 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from pyebas import *
+from pyebas.ebas_db.rollup import build_rollup
+from pyebas.utilities.instrument import set_console, counters
+from benchmarks.synthetic import make_archive
+
+set_console(False)
+
+H = np.timedelta64(1, "h")
+FREQ = {"D": "D", "M": "MS", "Y": "YS"}
+KEYS = ["site", "component", "unit", "matrix"]
+# time ranges cutting periods, the archive covers 1990-01-01 to 1992-03-11
+WINDOWS = {"D": ("1990-03-15T12:00", "1990-05-01"), "M": ("1990-03-15", "1991-01-01"), "Y": ("1989-06-01", "1991-02-01")}
+
+
+def grouped(st, val, resolution):
+   """period statistics by pandas, periods without valid values are left out"""
+   df = pd.DataFrame({"period": pd.DatetimeIndex(st).to_period(resolution).to_timestamp(), "val": val}).dropna()
+   return df.groupby("period")["val"].agg(["count", "sum", "min", "max"])
+
+@pytest.mark.parametrize("resolution", ["D", "M", "Y"])
+def test_build_rollup_matches_groupby(resolution):
+   rng = np.random.default_rng(0)
+   n = 5000
+   # unsorted, with nan values and missing time
+   st = np.datetime64("1999-12-30", "ns")+rng.integers(0, 800*24, n)*H
+   st[rng.random(n)<0.01] = np.datetime64("NaT")
+   val = rng.normal(size=n)
+   val[rng.random(n)<0.1] = np.nan
+   rollup = build_rollup(st, val, resolution)
+
+   expected = grouped(st, val, resolution)
+   np.testing.assert_array_equal(rollup["start"].astype("datetime64[ns]"), expected.index.to_numpy())
+   np.testing.assert_array_equal(rollup["count"], expected["count"].to_numpy())
+   np.testing.assert_allclose(rollup["sum"], expected["sum"].to_numpy())
+   np.testing.assert_array_equal(rollup["min"], expected["min"].to_numpy())
+   np.testing.assert_array_equal(rollup["max"], expected["max"].to_numpy())
+
+def test_build_rollup_without_values():
+   rollup = build_rollup(np.array(["2000-01-01"], dtype="datetime64[ns]"), np.array([np.nan]), "M")
+   assert len(rollup["start"])==len(rollup["count"])==0
+
+@pytest.fixture(scope="module")
+def archive(tmp_path_factory):
+   raw_dir = str(tmp_path_factory.mktemp("archive")/"raw_data")
+   make_archive(raw_dir, num_sites=2, num_files=2, num_vars=2, length=24*400, resolution=H)
+   return raw_dir
+
+def open_db(raw_dir, db_dir, **kwargs):
+   shutil.copytree(raw_dir, os.path.join(db_dir, "raw_data"))
+   db = EbasDB(dir=db_dir, **kwargs)
+   db.update_db()
+   db.init_db()
+   return db
+
+@pytest.mark.parametrize("resolution", ["D", "M", "Y"])
+@pytest.mark.parametrize("stored", [True, False])
+def test_rollup_query_matches_groupby(archive, tmp_path, resolution, stored):
+   db = open_db(archive, str(tmp_path/"db"), rollups=[resolution] if stored else None)
+   st, ed = WINDOWS[resolution]
+   condition = {"st": np.datetime64(st), "ed": np.datetime64(ed)}
+   before = counters().get("rollups_computed", 0)
+   res = db.query(condition, use_number_indexing=False, resolution=resolution)
+   assert (counters().get("rollups_computed", 0)==before)==stored
+
+   rows = db.query({}, use_number_indexing=False).astype({k: str for k in KEYS})
+   rows["period"] = rows["st"].dt.to_period(resolution).dt.to_timestamp()
+   expected = rows.dropna(subset=["val"]).groupby(KEYS+["period"])["val"].agg(["count", "sum", "min", "max", "mean"]).reset_index()
+   end = expected["period"]+pd.tseries.frequencies.to_offset(FREQ[resolution])
+   expected = expected[(expected["period"]>=condition["st"]) & (end<=condition["ed"])]
+
+   res = res.astype({k: str for k in KEYS}).sort_values(KEYS+["st"]).reset_index(drop=True)
+   expected = expected.sort_values(KEYS+["period"]).reset_index(drop=True)
+   assert len(res)==len(expected)>0
+   for k in KEYS:
+      assert (res[k]==expected[k]).all()
+   np.testing.assert_array_equal(res["st"].to_numpy(), expected["period"].to_numpy())
+   np.testing.assert_array_equal(res["count"].to_numpy(), expected["count"].to_numpy())
+   for k in ["sum", "min", "max"]:
+      np.testing.assert_allclose(res[k].to_numpy(), expected[k].to_numpy())
+   np.testing.assert_allclose(res["val"].to_numpy(), expected["mean"].to_numpy())
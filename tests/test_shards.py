@@ -0,0 +1,45 @@
+import os
+import numpy as np
+from pyebas import *
+from pyebas.utilities.instrument import set_console, counters
+from benchmarks.synthetic import make_archive
+
+set_console(False)
+
+
+def create_db(tmp_path, **kwargs):
+   db_dir = str(tmp_path/"db")
+   # daily data over about 3 years, 2 sites with 5 variables
+   make_archive(os.path.join(db_dir, "raw_data"), num_sites=2, num_files=2, num_vars=5, length=500, 
+                resolution=np.timedelta64(1, "D"))
+   db = EbasDB(dir=db_dir, shards="year", **kwargs)
+   db.update_db()
+   db.init_db()
+   return db
+
+def shard_count(db):
+   return sum(len(shards) for shards in db.shard_index["sites"].values())
+
+def loads(func):
+   before = counters().get("sites_loaded", 0)
+   res = func()
+   return res, counters().get("sites_loaded", 0)-before
+
+def test_iter_query_loads_each_shard_once(tmp_path):
+   db = create_db(tmp_path, lazy=True)
+   chunks, num = loads(lambda: list(db.iter_query({})))
+   assert sum(len(c) for c in chunks)==2*2*5*500
+   assert num<=shard_count(db)
+
+def test_query_with_small_cache_loads_each_shard_once(tmp_path):
+   # the cache can't hold the shards of one site
+   db = create_db(tmp_path, lazy=True, cache_size=1)
+   df, num = loads(lambda: db.query({}, cache=False))
+   assert len(df)==2*2*5*500
+   assert num<=shard_count(db)
+
+def test_shards_outside_time_range_are_skipped(tmp_path):
+   db = create_db(tmp_path, lazy=True)
+   df, num = loads(lambda: db.query({"st": np.datetime64("1991-02-01"), "ed": np.datetime64("1991-03-01")}, cache=False))
+   assert len(df)==2*5*28
+   assert num==2
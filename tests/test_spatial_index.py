@@ -0,0 +1,68 @@
+import math
+import numpy as np
+import pytest
+from pyebas.ebas_db.spatial_index import SpatialIndex
+
+
+def make_sites(n=500, seed=0):
+   rng = np.random.default_rng(seed)
+   sites = {}
+   for i in range(n):
+      sites[f"S{i:04d}"] = {"lat": f"{rng.uniform(-90, 90)}", "lon": f"{rng.uniform(-180, 180)}", "alt": f"{rng.uniform(0, 3000)} m"}
+   # sites without coordinates
+   sites["S9998"] = {"lat": "", "lon": "10.0", "alt": ""}
+   sites["S9999"] = {"lat": "n/a", "lon": None, "alt": "0 m"}
+   return sites
+
+def haversine(lat1, lon1, lat2, lon2):
+   p1, p2 = math.radians(lat1), math.radians(lat2)
+   a = math.sin((p2-p1)/2)**2+math.cos(p1)*math.cos(p2)*math.sin(math.radians(lon2-lon1)/2)**2
+   return 2*SpatialIndex.earth_radius*math.asin(math.sqrt(min(a, 1)))
+
+def coordinates(sites):
+   res = []
+   for i, s in enumerate(sites.values()):
+      try:
+         res.append((i, float(s["lat"]), float(s["lon"])))
+      except (ValueError, TypeError):
+         pass
+   return res
+
+SITES = make_sites()
+INDEX = SpatialIndex(SITES)
+COORDS = coordinates(SITES)
+
+
+@pytest.mark.parametrize("box", [(40, 55, -5, 15), (-90, 90, -180, 180), (-30, 30, 170, -170), (60, 90, 100, -100), (10, 10.5, 0, 0.5)])
+def test_bbox_matches_brute_force(box):
+   lat_min, lat_max, lon_min, lon_max = box
+   if lon_min<=lon_max:
+      expected = [i for i, lat, lon in COORDS if lat_min<=lat<=lat_max and lon_min<=lon<=lon_max]
+   else:
+      expected = [i for i, lat, lon in COORDS if lat_min<=lat<=lat_max and (lon>=lon_min or lon<=lon_max)]
+   assert INDEX.bbox(*box).tolist()==expected
+
+@pytest.mark.parametrize("point", [(47.5, 8.0, 1500), (0, 179.5, 2000), (89, 0, 800), (-60, -100, 3000), (10, 10, 0), (0, 0, 30000)])
+def test_radius_matches_brute_force(point):
+   lat, lon, km = point
+   expected = [i for i, s_lat, s_lon in COORDS if haversine(lat, lon, s_lat, s_lon)<=km]
+   assert INDEX.radius(*point).tolist()==expected
+
+@pytest.mark.parametrize("point", [(47.5, 8.0, 5), (0, 179.5, 1), (89, 0, 20), (-60, -100, 0), (10, 10, 1000)])
+def test_nearest_matches_brute_force(point):
+   lat, lon, k = point
+   dist = sorted((haversine(lat, lon, s_lat, s_lon), i) for i, s_lat, s_lon in COORDS)
+   assert INDEX.nearest(*point).tolist()==[i for _, i in dist[:k]]
+
+def test_nearest_among_candidates():
+   candidates = np.arange(0, len(SITES), 3)
+   dist = sorted((haversine(47.5, 8.0, s_lat, s_lon), i) for i, s_lat, s_lon in COORDS if i%3==0)
+   assert INDEX.nearest(47.5, 8.0, 4, candidates).tolist()==[i for _, i in dist[:4]]
+
+def test_search_intersects_conditions():
+   condition = {"bbox": (30, 70, -20, 40), "radius": (47.5, 8.0, 2000)}
+   expected = np.intersect1d(INDEX.bbox(*condition["bbox"]), INDEX.radius(*condition["radius"]))
+   assert INDEX.search(condition).tolist()==expected.tolist()
+   assert INDEX.search({"component": ["ozone"]}) is None
+   with pytest.raises(ValueError):
+      INDEX.search({"bbox": (1, 2, 3)})
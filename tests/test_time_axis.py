@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from pyebas.ebas_db.time_axis import encode_bounds, decode_bounds, select_bounds, bounds_length
+
+H = np.timedelta64(1, "h")
+T0 = np.datetime64("2000-01-01T00:00:00", "ns")
+
+
+def bounds(st, width):
+   return np.stack([st, st+width], axis=1)
+
+def regular(n=100):
+   return bounds(T0+np.arange(n)*H, H)
+
+def regular_with_exceptions(n=100):
+   ts = regular(n)
+   ts[[3, 50], 1] += 30*np.timedelta64(1, "m")
+   ts[99, 1] -= 10*np.timedelta64(1, "m")
+   return ts
+
+def delta(n=100):
+   # irregular starting time, one width
+   rng = np.random.default_rng(0)
+   return bounds(T0+np.cumsum(rng.integers(1, 48, n))*H, 2*H)
+
+def delta_widths(n=100):
+   rng = np.random.default_rng(1)
+   return bounds(T0+np.cumsum(rng.integers(1, 48, n))*H, rng.integers(1, 24, n)*H)
+
+def delta_ns(n=100):
+   # not whole seconds
+   rng = np.random.default_rng(2)
+   return bounds(T0+np.cumsum(rng.integers(1, 10**9, n)).astype("timedelta64[ns]"), np.timedelta64(5, "ns"))
+
+def raw(n=100):
+   ts = regular(n)
+   ts[10, 1] = np.datetime64("NaT")
+   return ts
+
+def unsorted(n=100):
+   return regular(n)[np.random.default_rng(3).permutation(n)]
+
+CASES = {"regular": (regular, "regular"),
+         "regular_with_exceptions": (regular_with_exceptions, "regular"),
+         "delta": (delta, "delta"),
+         "delta_widths": (delta_widths, "delta"),
+         "delta_ns": (delta_ns, "delta"),
+         "raw": (raw, "raw"),
+         "unsorted": (unsorted, "delta"),
+         "single": (lambda: regular(1), "delta")}
+
+
+@pytest.mark.parametrize("case", CASES.keys())
+def test_round_trip(case):
+   make, kind = CASES[case]
+   ts = make()
+   time = encode_bounds(ts)
+   assert time["kind"]==kind
+   assert bounds_length(time)==ts.shape[0]
+   np.testing.assert_array_equal(decode_bounds(time), ts)
+
+   rng = np.random.default_rng(4)
+   n = ts.shape[0]
+   for index in [slice(0, 0), slice(n//3, 2*n//3), slice(n-1, n), rng.random(n)<0.3, np.sort(rng.choice(n, n//2))]:
+      np.testing.assert_array_equal(decode_bounds(time, index), ts[index])
+
+def test_regular_with_many_exceptions_is_delta():
+   ts = regular()
+   ts[::2, 1] += H
+   assert encode_bounds(ts)["kind"]=="delta"
+   np.testing.assert_array_equal(decode_bounds(encode_bounds(ts)), ts)
+
+def selectors(ts):
+   st, ed = ts[:,0].min(), ts[:,1].max()
+   span = ed-st
+   m = np.timedelta64(7, "m")
+   res = [{}, {"st": st}, {"ed": ed}, {"st": st-span, "ed": ed+span},
+          {"st": ed+H}, {"ed": st-H}, {"st": ed, "ed": st}]
+   for a, b in [(0.2, 0.6), (0.5, 0.5), (0.33, 0.9)]:
+      # on the samples and between them
+      lo, hi = st+(span*a).astype("timedelta64[ns]"), st+(span*b).astype("timedelta64[ns]")
+      res += [{"st": lo, "ed": hi}, {"st": lo+m, "ed": hi-m}, {"st": lo+m}, {"ed": hi-m}]
+   return res
+
+@pytest.mark.parametrize("case", CASES.keys())
+def test_select_bounds_matches_mask(case):
+   ts = CASES[case][0]()
+   time = encode_bounds(ts)
+   is_sorted = bool(np.all(np.diff(ts[:,0].astype(np.int64))>=0) and np.all(np.diff(ts[:,1].astype(np.int64))>=0)) \
+               and not np.isnat(ts).any()
+   for selector in selectors(ts[~np.isnat(ts).any(axis=1)]):
+      mask = np.ones(ts.shape[0], dtype=bool)
+      if "st" in selector:
+         mask &= ts[:,0]>=selector["st"]
+      if "ed" in selector:
+         mask &= ts[:,1]<=selector["ed"]
+      for sorted in {False, is_sorted}:
+         index, sel = select_bounds(time, selector, sorted=sorted)
+         np.testing.assert_array_equal(sel, ts[mask], err_msg=str(selector))
+         np.testing.assert_array_equal(np.arange(ts.shape[0])[index], np.flatnonzero(mask))
+
+def test_select_bounds_with_string_time():
+   ts = regular()
+   index, sel = select_bounds(encode_bounds(ts), {"st": "2000-01-02", "ed": "2000-01-03"})
+   assert index==slice(24, 48)
+   np.testing.assert_array_equal(sel, ts[24:48])
@@ -0,0 +1,84 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from pyebas import *
+from pyebas.utilities.instrument import set_console, counters
+from benchmarks.synthetic import make_archive, make_file, site_code
+
+set_console(False)
+
+DAY = np.timedelta64(1, "D")
+
+
+def normalized(df):
+   """query result in a fixed order, names instead of numbers, which depend on the import order"""
+   df = df.astype({k: str for k in ["site", "component", "unit", "matrix"]})
+   return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+def open_db(db_dir, **kwargs):
+   db = EbasDB(dir=db_dir, **kwargs)
+   db.init_db()
+   return db
+
+def change_files(raw_dir):
+   rng = np.random.default_rng(1)
+   # new file of site 0
+   make_file(raw_dir, 0, 2, 2, 200, DAY, rng)
+   # changed file of site 1, same name with other values
+   name = make_file(raw_dir, 1, 1, 2, 200, DAY, rng)
+   stat = os.stat(os.path.join(raw_dir, name))
+   os.utime(os.path.join(raw_dir, name), (stat.st_atime, stat.st_mtime+10))
+   # deleted file of site 2, and all files of site 3
+   for f in os.listdir(raw_dir):
+      if f.startswith(site_code(3)) or f.startswith(site_code(2)+".19900720"):
+         os.remove(os.path.join(raw_dir, f))
+
+@pytest.mark.parametrize("shards", [None, "year"])
+def test_incremental_update_matches_full_rebuild(tmp_path, shards):
+   inc_dir, full_dir = str(tmp_path/"inc"), str(tmp_path/"full")
+   make_archive(os.path.join(inc_dir, "raw_data"), num_sites=4, num_files=2, num_vars=2, length=200, resolution=DAY)
+   EbasDB(dir=inc_dir, shards=shards, rollups=["M"]).update_db()
+   change_files(os.path.join(inc_dir, "raw_data"))
+   assert len(os.listdir(os.path.join(inc_dir, "raw_data")))==8+1-3
+
+   # opened without the settings, as the command line tool does
+   EbasDB(dir=inc_dir).update_db()
+   shutil.copytree(os.path.join(inc_dir, "raw_data"), os.path.join(full_dir, "raw_data"))
+   EbasDB(dir=full_dir, shards=shards, rollups=["M"]).update_db(full=True)
+
+   inc, full = open_db(inc_dir), open_db(full_dir)
+   assert inc.shards==shards
+   assert inc.rollups==["M"]
+   assert sorted(inc.site_index.keys())==sorted(full.site_index.keys())==sorted(site_code(i) for i in range(3))
+   pd.testing.assert_frame_equal(normalized(inc.query({}, use_number_indexing=False, qc="flags")),
+                                 normalized(full.query({}, use_number_indexing=False, qc="flags")))
+
+   # rollups of the sites imported again are built as well
+   before = counters().get("rollups_computed", 0)
+   monthly = inc.query({}, use_number_indexing=False, resolution="M")
+   assert counters().get("rollups_computed", 0)==before
+   pd.testing.assert_frame_equal(normalized(monthly), normalized(full.query({}, use_number_indexing=False, resolution="M")))
+
+   # the manifest is up to date
+   files = sorted(os.listdir(os.path.join(inc_dir, "raw_data")))
+   assert sorted(f for s in inc.site_index.values() for f in s["files"].keys())==files
+
+def test_other_rollups_rebuild_database(tmp_path):
+   db_dir = str(tmp_path/"db")
+   make_archive(os.path.join(db_dir, "raw_data"), num_sites=2, num_files=1, num_vars=1, length=100, resolution=DAY)
+   EbasDB(dir=db_dir, rollups=["M"]).update_db()
+   EbasDB(dir=db_dir, rollups=["Y"]).update_db()
+   db = open_db(db_dir)
+   assert db.rollups==["Y"]
+   before = counters().get("rollups_computed", 0)
+   db.query({}, resolution="Y")
+   assert counters().get("rollups_computed", 0)==before
+
+   # no rollups
+   EbasDB(dir=db_dir, rollups=[]).update_db()
+   db = open_db(db_dir)
+   assert not db.rollups
+   db.query({}, resolution="Y")
+   assert counters().get("rollups_computed", 0)==before+2